@@ -1 +1,7 @@
+python -m cogs.utils.migrations config/website.toml
+python -m cogs.utils.build_assets
+
+# The raffle scheduler only starts with the website's first request, so
+# close anything that ended while the website was down before starting it
+python -m cogs.utils.raffle_scheduler config/website.toml
 vbu run-website
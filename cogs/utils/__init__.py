@@ -1,6 +1,22 @@
 from .raffle import *
+from .raffle_draw import *
 from .video import *
+from .video_cache import *
+from .playlist_fetcher import *
 from .website_permissions import *
 from .wrappers import *
 from .json_encoder import *
+from .metrics import *
+from .token_bucket import *
 from .streamelements import *
+from .http_client import *
+from .page_cache import *
+from .timing import *
+from .database import *
+from .session_user import *
+from .raffle_index import *
+from .raffle_scheduler import *
+from .entry_broadcaster import *
+from .response_cache import *
+from .assets import *
+from .image_proxy import *
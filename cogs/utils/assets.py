@@ -0,0 +1,180 @@
+from typing import Optional
+import json
+import logging
+import os
+
+from aiohttp.web import FileResponse, HTTPNotFound, Request
+import aiohttp_jinja2
+
+
+__all__ = (
+    'AssetManifest',
+    'asset_manifest',
+    'serve_asset',
+    'serve_static',
+    'install_asset_globals',
+)
+
+
+log = logging.getLogger("assets")
+log.setLevel(logging.INFO)
+
+
+ASSETS_DIRECTORY = "website/assets"
+STATIC_DIRECTORY = "website/static"
+ASSETS_URL = "/assets"
+STATIC_URL = "/static"
+
+
+class AssetManifest:
+    """
+    The manifest written by ``python -m cogs.utils.build_assets``, mapping
+    the original paths of the static files to their built copies.
+
+    If the assets haven't been built, every path is given back under
+    ``/static`` as it was before.
+    """
+
+    def __init__(self, directory: str = ASSETS_DIRECTORY):
+        self.directory = directory
+        self.assets: dict = {}
+        self.files: dict = {}
+        self._loaded: bool = False
+
+    def load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(os.path.join(self.directory, "manifest.json")) as a:
+                manifest = json.load(a)
+        except FileNotFoundError:
+            log.warning("No asset manifest found; serving files from %s" % STATIC_URL)
+            return
+        self.assets = manifest["assets"]
+        self.files = manifest["files"]
+        log.info("Loaded %s built asset(s)" % len(self.assets))
+
+    def url(self, path: str) -> str:
+        """
+        Get the URL for a static file, by its path in ``website/static``.
+        """
+
+        self.load()
+        if not path.startswith("/"):
+            path = "/" + path
+        asset = self.assets.get(path)
+        if asset is None:
+            return STATIC_URL + path
+        return f"{ASSETS_URL}/{asset['file']}"
+
+    def srcset(self, path: str) -> str:
+        """
+        Get a ``srcset`` attribute value listing each built width of an
+        image, including its original one. This is empty if it hasn't been
+        resized.
+        """
+
+        self.load()
+        asset = self.assets.get(path if path.startswith("/") else "/" + path)
+        if asset is None or len(asset['widths']) < 2:
+            return ""
+        return ", ".join(
+            f"{ASSETS_URL}/{file} {width}w"
+            for width, file in sorted(asset['widths'].items(), key=lambda i: int(i[0]))
+        )
+
+
+asset_manifest = AssetManifest()
+
+
+def accepts(header: Optional[str], value: str) -> bool:
+    """
+    Whether a comma separated header (eg ``Accept``) lists the given value
+    without a quality of zero.
+    """
+
+    for i in (header or "").split(","):
+        item, *params = [o.strip() for o in i.split(";")]
+        if item != value:
+            continue
+        for p in params:
+            if p.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+                return False
+        return True
+    return False
+
+
+async def serve_asset(request: Request) -> FileResponse:
+    """
+    Serve a built asset. Images are swapped for their AVIF or WebP
+    versions and text files for their precompressed ones when the client
+    supports them. As each file's name has its content hash in it, it's
+    cached for as long as browsers allow.
+    """
+
+    asset_manifest.load()
+    name = request.match_info["path"]
+    entry = asset_manifest.files.get(name)
+    if entry is None:
+        raise HTTPNotFound()
+    headers = {
+        "Content-Type": entry['type'],
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+
+    # Pick the best format the client can take
+    if entry['variants']:
+        headers["Vary"] = "Accept"
+        accept = request.headers.get("Accept")
+        for content_type in ("image/avif", "image/webp"):
+            variant = entry['variants'].get(content_type)
+            if variant and accepts(accept, content_type):
+                name = variant
+                headers["Content-Type"] = content_type
+                break
+
+    # And the best encoding
+    if entry['encodings']:
+        headers["Vary"] = "Accept-Encoding"
+        accept_encoding = request.headers.get("Accept-Encoding")
+        for encoding in ("br", "gzip"):
+            encoded = entry['encodings'].get(encoding)
+            if encoded and accepts(accept_encoding, encoding):
+                name = encoded
+                headers["Content-Encoding"] = encoding
+                break
+
+    return FileResponse(os.path.join(asset_manifest.directory, name), headers=headers)
+
+
+async def serve_static(request: Request) -> FileResponse:
+    """
+    Serve a file from ``website/static``, as is. These are only linked to
+    when the assets haven't been built, and their names don't change with
+    their content, so they're only cached for a short while; browsers
+    check back with the file's ETag after that.
+    """
+
+    directory = os.path.realpath(STATIC_DIRECTORY)
+    path = os.path.realpath(os.path.join(directory, request.match_info["path"]))
+    if os.path.commonpath([directory, path]) != directory or not os.path.isfile(path):
+        raise HTTPNotFound()
+    max_age = request.app['config'].get('assets', {}).get('static_max_age', 3600)
+    return FileResponse(path, headers={
+        "Cache-Control": "public, max-age=%s" % max_age,
+    })
+
+
+def install_asset_globals(request: Request) -> None:
+    """
+    Point the templates' ``static`` function at the built assets, and give
+    them ``asset_srcset`` for responsive images. VBU sets up the jinja
+    environment itself, so this is done when the first page is rendered.
+    """
+
+    env = aiohttp_jinja2.get_env(request.app)
+    if "asset_srcset" in env.globals:
+        return
+    env.globals["static"] = asset_manifest.url
+    env.globals["asset_srcset"] = asset_manifest.srcset
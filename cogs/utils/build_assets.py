@@ -0,0 +1,221 @@
+from typing import Dict, Set
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+
+from PIL import Image, features
+import brotli
+
+
+__all__ = (
+    'build_assets',
+)
+
+
+log = logging.getLogger("build_assets")
+log.setLevel(logging.INFO)
+
+
+# Images are also written at each of these widths that's smaller than
+# the original, for srcset
+RESPONSIVE_WIDTHS = (480, 960, 1440)
+RASTER_IMAGES = {".png", ".jpg", ".jpeg"}
+TEXT_ASSETS = {".css", ".js", ".svg"}
+CSS_URL = re.compile(r"""url\(\s*(['"]?)(?P<url>[^'")]+)\1\s*\)""")
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+class AssetBuilder:
+
+    def __init__(self, source: str, output: str):
+        self.source = source
+        self.output = output
+        self.assets: Dict[str, dict] = {}
+        self.files: Dict[str, dict] = {}
+        self.written: Set[str] = set()
+        self.avif = features.check("avif")
+        self.webp = features.check("webp")
+
+    def write(self, name: str, data: bytes) -> str:
+        """
+        Write some data to the output directory, unless a file with that
+        (content-hashed) name is already there.
+        """
+
+        self.written.add(name)
+        path = os.path.join(self.output, name)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as a:
+                a.write(data)
+        return name
+
+    def add_file(self, name: str, content_type: str) -> dict:
+        entry = {
+            "type": content_type,
+            "variants": {},
+            "encodings": {},
+        }
+        self.files[name] = entry
+        return entry
+
+    def build_image(self, asset: str, data: bytes) -> None:
+        stem, ext = os.path.splitext(asset.lstrip("/"))
+        digest = content_hash(data)
+        name = self.write(f"{stem}.{digest}{ext}", data)
+        self.assets[asset] = {"file": name, "widths": {}}
+        content_type = mimetypes.guess_type(asset)[0] or "application/octet-stream"
+
+        # Make the modern formats and smaller sizes
+        with Image.open(os.path.join(self.output, name)) as image:
+            image.load()
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA")
+            if ext != ".png":
+                image = image.convert("RGB")
+            self.assets[asset]["widths"][str(image.width)] = name
+            sizes = [(None, image)]
+            for width in RESPONSIVE_WIDTHS:
+                if width < image.width:
+                    height = round(image.height * width / image.width)
+                    sizes.append((width, image.resize((width, height), Image.LANCZOS)))
+            for width, sized in sizes:
+                suffix = f".{width}w" if width else ""
+                sized_name = f"{stem}.{digest}{suffix}"
+                if width:
+                    self.assets[asset]["widths"][str(width)] = self.save(sized, f"{sized_name}{ext}", ext)
+                entry = self.add_file(sized_name + ext, content_type)
+                base_size = os.path.getsize(os.path.join(self.output, sized_name + ext))
+                formats = [("image/avif", ".avif", self.avif), ("image/webp", ".webp", self.webp)]
+                for variant_type, variant_ext, supported in formats:
+                    if not supported:
+                        continue
+
+                    # Only offer a variant if it's actually smaller
+                    variant = self.save(sized, f"{sized_name}{variant_ext}", variant_ext)
+                    if os.path.getsize(os.path.join(self.output, variant)) < base_size:
+                        entry["variants"][variant_type] = variant
+
+    def save(self, image, name: str, ext: str) -> str:
+        self.written.add(name)
+        path = os.path.join(self.output, name)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if ext == ".avif":
+                image.save(path, quality=60)
+            elif ext == ".webp":
+                image.save(path, quality=80, method=6)
+            else:
+                image.save(path, optimize=True)
+        return name
+
+    def build_text(self, asset: str, data: bytes) -> None:
+        stem, ext = os.path.splitext(asset.lstrip("/"))
+
+        # Point stylesheets at the built images
+        if ext == ".css":
+            data = CSS_URL.sub(self.rewrite_css_url, data.decode()).encode()
+        name = self.write(f"{stem}.{content_hash(data)}{ext}", data)
+        self.assets[asset] = {"file": name, "widths": {}}
+        entry = self.add_file(name, mimetypes.guess_type(asset)[0] or "text/plain")
+        entry["encodings"]["gzip"] = self.write(name + ".gz", gzip.compress(data, 9, mtime=0))
+        entry["encodings"]["br"] = self.write(name + ".br", brotli.compress(data, quality=11))
+
+    def rewrite_css_url(self, match: re.Match) -> str:
+        url = match.group("url")
+        if "/static/" not in url:
+            return match.group(0)
+        asset = self.assets.get("/" + url.split("/static/", 1)[1])
+        if asset is None:
+            return match.group(0)
+        return f"url('/assets/{asset['file']}')"
+
+    def build(self) -> dict:
+        os.makedirs(self.output, exist_ok=True)
+        sources = []
+        for root, _, filenames in os.walk(self.source):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                sources.append("/" + os.path.relpath(path, self.source).replace(os.sep, "/"))
+
+        # Images go first so that stylesheets can point at them
+        sources.sort(key=lambda i: (os.path.splitext(i)[1] == ".css", i))
+        for asset in sources:
+            ext = os.path.splitext(asset)[1].lower()
+            with open(os.path.join(self.source, asset.lstrip("/")), "rb") as a:
+                data = a.read()
+            if ext in RASTER_IMAGES:
+                self.build_image(asset, data)
+            elif ext in TEXT_ASSETS:
+                self.build_text(asset, data)
+            else:
+                stem = os.path.splitext(asset.lstrip("/"))[0]
+                name = self.write(f"{stem}.{content_hash(data)}{ext}", data)
+                self.assets[asset] = {"file": name, "widths": {}}
+                self.add_file(name, mimetypes.guess_type(asset)[0] or "application/octet-stream")
+        return {
+            "assets": self.assets,
+            "files": self.files,
+        }
+
+    def prune(self) -> None:
+        """
+        Delete any file left over from a previous build. Files made by this
+        build are kept even if they're not in the manifest (eg variants that
+        weren't any smaller), so that they aren't made again next time.
+        """
+
+        keep = self.written | {"manifest.json"}
+        for root, _, filenames in os.walk(self.output):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                if os.path.relpath(path, self.output).replace(os.sep, "/") not in keep:
+                    os.remove(path)
+
+
+def build_assets(
+        source: str = "website/static",
+        output: str = "website/assets") -> dict:
+    """
+    Build the website's static files for serving from ``/assets``.
+
+    Every file is written with a hash of its content in its name, so that
+    it can be cached forever. Images also get WebP and AVIF versions, and
+    smaller copies for srcset. Stylesheets, scripts and SVGs are
+    precompressed with gzip and brotli. A manifest mapping the original
+    paths to the built files is written alongside them.
+
+    Parameters
+    ----------
+    source : str, optional
+        The directory of static files to build.
+    output : str, optional
+        The directory to write the built files and manifest to.
+
+    Returns
+    -------
+    dict
+        The manifest.
+    """
+
+    builder = AssetBuilder(source, output)
+    if not builder.avif:
+        log.warning("Pillow doesn't support AVIF here; only WebP images will be made")
+    manifest = builder.build()
+    with open(os.path.join(output, "manifest.json"), "w") as a:
+        json.dump(manifest, a, indent=4, sort_keys=True)
+    builder.prune()
+    log.info("Built %s asset(s) into %s" % (len(manifest["assets"]), output))
+    return manifest
+
+
+if __name__ == "__main__":
+    logging.basicConfig()
+    build_assets()
@@ -0,0 +1,58 @@
+from typing import Any, List
+import logging
+import re
+import time
+
+from discord.ext import vbu
+
+from .timing import current_timings
+
+
+__all__ = (
+    'Database',
+)
+
+
+log = logging.getLogger("database")
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Strip the comments and extra whitespace out of some SQL so that it
+    fits on one log line.
+    """
+
+    sql = re.sub(r"--[^\n]*", "", sql)
+    return " ".join(sql.split())
+
+
+class Database(vbu.Database):
+    """
+    A database wrapper that records how long acquiring a connection and
+    running each query took against the current request's timings, and
+    logs any query slower than the request's threshold.
+    """
+
+    async def __aenter__(self):
+        start = time.perf_counter()
+        v = await super().__aenter__()
+        timings = current_timings.get()
+        if timings is not None:
+            timings.add("db_acquire", time.perf_counter() - start)
+        return v
+
+    async def call(self, sql: str, *args) -> List[Any]:
+        start = time.perf_counter()
+        rows = await super().call(sql, *args)
+        duration = time.perf_counter() - start
+        timings = current_timings.get()
+        threshold = 0.1
+        if timings is not None:
+            timings.add("db_query", duration)
+            threshold = timings.slow_query_threshold
+        if duration >= threshold:
+            log.warning(
+                "Slow query (%.1fms, %s rows): %s"
+                % (duration * 1_000, len(rows), normalize_sql(sql))
+            )
+        return rows
@@ -0,0 +1,275 @@
+from typing import Dict, List, Optional, Set, Tuple
+from uuid import UUID
+import asyncio
+import logging
+
+from .database import Database
+from .raffle_index import raffle_index
+
+
+__all__ = (
+    'EntrySubscription',
+    'EntryBroadcaster',
+    'entry_broadcaster',
+)
+
+
+log = logging.getLogger("entry_broadcaster")
+log.setLevel(logging.INFO)
+
+
+Counts = Dict[UUID, int]
+
+
+class EntrySubscription:
+    """
+    A single client listening for changes to raffle entry counts.
+
+    Rather than queueing every update, only the latest count for each
+    raffle is kept until the client reads it. A slow client can fall
+    behind on how often it's told about changes, but never on what the
+    counts actually are, and never holds more than one count per raffle.
+
+    Attributes
+    -----------
+    user_id: Optional[UUID]
+        The logged in user that's listening, if there is one.
+    entries: Counts
+        The user's number of entries into each raffle that they've been
+        told about.
+    """
+
+    __slots__ = (
+        'user_id',
+        'entries',
+        '_pending_totals',
+        '_pending_entries',
+        '_event',
+    )
+
+    def __init__(self, user_id: Optional[UUID] = None):
+        self.user_id = user_id
+        self.entries: Counts = {}
+        self._pending_totals: Counts = {}
+        self._pending_entries: Counts = {}
+        self._event = asyncio.Event()
+
+    def push(self, totals: Optional[Counts] = None, entries: Optional[Counts] = None) -> None:
+        """
+        Store some changed counts for the client to pick up.
+        """
+
+        if totals:
+            self._pending_totals.update(totals)
+        if entries:
+            for i, o in entries.items():
+                if self.entries.get(i) != o:
+                    self._pending_entries[i] = o
+                    self.entries[i] = o
+        if self._pending_totals or self._pending_entries:
+            self._event.set()
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Tuple[Counts, Counts]]:
+        """
+        Wait for the counts that have changed since the last call.
+
+        Parameters
+        ----------
+        timeout : Optional[float], optional
+            How long to wait for a change, in seconds.
+
+        Returns
+        -------
+        Optional[Tuple[Counts, Counts]]
+            The changed totals for each raffle and the changed entries for
+            the user, or ``None`` if nothing changed before the timeout.
+        """
+
+        if not self._event.is_set():
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        self._event.clear()
+        totals, self._pending_totals = self._pending_totals, {}
+        entries, self._pending_entries = self._pending_entries, {}
+        return totals, entries
+
+
+class EntryBroadcaster:
+    """
+    Fans changes to the entry counts of active raffles out to every
+    connected client.
+
+    Joins made in this process are published straight away. While anyone
+    is listening, a single background task also re-reads the counts from
+    the database every ``stream_refresh_interval`` seconds, so that joins
+    handled by other processes are picked up too.
+
+    Attributes
+    -----------
+    totals: Counts
+        The last known number of entries into each active raffle.
+    subscriptions: Set[EntrySubscription]
+        The clients that are listening.
+    """
+
+    def __init__(self):
+        self.totals: Counts = {}
+        self.subscriptions: Set[EntrySubscription] = set()
+        self._config: dict = {}
+        self._loaded: bool = False
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def refresh_interval(self) -> float:
+        return float(self._config.get('raffles', {}).get('stream_refresh_interval', 5))
+
+    async def subscribe(self, config: dict, user_id: Optional[UUID] = None) -> EntrySubscription:
+        """
+        Start listening for changes. The new subscription is given the
+        current counts straight away.
+
+        Parameters
+        ----------
+        config : dict
+            The website config.
+        user_id : Optional[UUID], optional
+            The logged in user, whose own entries should be sent too.
+
+        Returns
+        -------
+        EntrySubscription
+            The new subscription.
+        """
+
+        self._config = config
+        if not self._loaded:
+            await self.refresh()
+        subscription = EntrySubscription(user_id)
+        entries = {}
+        if user_id is not None:
+            entries = (await self._load_entries([user_id])).get(user_id, {})
+        subscription.push(dict(self.totals), entries)
+        self.subscriptions.add(subscription)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._refresh_loop())
+        return subscription
+
+    def unsubscribe(self, subscription: EntrySubscription) -> None:
+        self.subscriptions.discard(subscription)
+
+    def publish(
+            self,
+            raffle_id: UUID,
+            total: int,
+            user_id: Optional[UUID] = None,
+            user_count: Optional[int] = None) -> None:
+        """
+        Tell every client about a raffle's new entry count.
+
+        Parameters
+        ----------
+        raffle_id : UUID
+            The raffle that was entered.
+        total : int
+            The raffle's total number of entries.
+        user_id : Optional[UUID], optional
+            The user that entered, if their own count has changed.
+        user_count : Optional[int], optional
+            The user's number of entries into the raffle.
+        """
+
+        if self.totals.get(raffle_id) == total and user_id is None:
+            return
+        self.totals[raffle_id] = total
+        totals = {raffle_id: total}
+        for i in self.subscriptions:
+            if user_id is not None and i.user_id == user_id:
+                i.push(totals, {raffle_id: user_count})
+            else:
+                i.push(totals)
+
+    async def refresh(self) -> None:
+        """
+        Read the entry counts of the active raffles, and the counts of
+        every listening user, from the database, publishing any that have
+        changed.
+        """
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            await raffle_index.ensure_loaded(self._config)
+            raffle_ids = [i.id for i in raffle_index.active()]
+            async with Database() as db:
+                rows = await db.call(
+                    """
+                    SELECT
+                        raffle_id,
+                        COUNT(*)
+                    FROM
+                        raffle_entries
+                    WHERE
+                        raffle_id = ANY($1::UUID[])
+                    GROUP BY
+                        raffle_id
+                    """,
+                    raffle_ids,
+                )
+            totals = {i: 0 for i in raffle_ids}
+            totals.update({i['raffle_id']: i['count'] for i in rows})
+            changed = {
+                i: o
+                for i, o in totals.items()
+                if self.totals.get(i) != o
+            }
+            self.totals = totals
+            self._loaded = True
+
+            user_ids = list({i.user_id for i in self.subscriptions if i.user_id is not None})
+            entries = await self._load_entries(user_ids) if user_ids else {}
+        for i in list(self.subscriptions):
+            i.push(changed, entries.get(i.user_id))
+
+    async def _load_entries(self, user_ids: List[UUID]) -> Dict[UUID, Counts]:
+        async with Database() as db:
+            rows = await db.call(
+                """
+                SELECT
+                    user_id,
+                    raffle_id,
+                    COUNT(*)
+                FROM
+                    raffle_entries
+                WHERE
+                    raffle_id = ANY($1::UUID[])
+                AND
+                    user_id = ANY($2::UUID[])
+                GROUP BY
+                    user_id,
+                    raffle_id
+                """,
+                list(self.totals), user_ids,
+            )
+        entries: Dict[UUID, Counts] = {}
+        for i in rows:
+            entries.setdefault(i['user_id'], {})[i['raffle_id']] = i['count']
+        return entries
+
+    async def _refresh_loop(self) -> None:
+        while self.subscriptions:
+            await asyncio.sleep(self.refresh_interval)
+            if not self.subscriptions:
+                break
+            try:
+                await self.refresh()
+            except Exception:
+                log.exception("Failed to refresh entry counts")
+
+        # Nobody's listening, so the counts will go stale
+        self._loaded = False
+
+
+entry_broadcaster = EntryBroadcaster()
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import functools
-from typing import Dict, Type
+from typing import Dict, Tuple, Type
 
 
 __all__ = (
@@ -31,20 +31,61 @@ class flag_value:
 
 class Flags:
 
+    __slots__ = ('value',)
+
+    # Built once for each subclass when it's created, rather than every
+    # time an instance is made
     VALID_FLAGS: Dict[str, int] = {
     }
 
-    def __new__(cls, *args, **kwargs):
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        valid_flags = dict(cls.VALID_FLAGS)
         for i, o in cls.__dict__.items():
             if isinstance(o, flag_value):
-                cls.VALID_FLAGS[i] = o(None)
-        return super().__new__(cls)
+                valid_flags[i] = o.value
+        cls.VALID_FLAGS = valid_flags
 
     def __init__(self, value: int = 0, **kwargs):
         self.value = value
         for i, o in kwargs.items():
             setattr(self, i, o)
 
+    @classmethod
+    def compile(cls, **kwargs: bool) -> Tuple[int, int]:
+        """
+        Turn a set of flag requirements into a mask and the value that the
+        masked bits need to have, so that they can be checked with a
+        single comparison.
+
+        Parameters
+        ----------
+        **kwargs : bool
+            The flags to check, and whether each needs to be set or unset.
+
+        Returns
+        -------
+        Tuple[int, int]
+            The mask and the expected value.
+
+        Raises
+        ------
+        AttributeError
+            If one of the given flags doesn't exist.
+        """
+
+        mask = 0
+        expected = 0
+        for i, o in kwargs.items():
+            try:
+                bit = cls.VALID_FLAGS[i]
+            except KeyError:
+                raise AttributeError(f"{cls.__name__} has no flag {i!r}")
+            mask |= bit
+            if o:
+                expected |= bit
+        return mask, expected
+
     def __repr__(self) -> str:
         d = []
         for i in self.VALID_FLAGS.keys():
@@ -0,0 +1,94 @@
+from typing import ClassVar, Optional
+import asyncio
+
+import aiohttp
+
+from .metrics import create_trace_config
+
+
+__all__ = (
+    'HTTPClient',
+)
+
+
+class HTTPClient:
+    """
+    A single connection-pooled HTTP session that's shared by everything on
+    the website that talks to an external API.
+
+    The session is created the first time it's asked for (so that it's
+    bound to the running event loop), and is kept for the lifetime of the
+    process so that connections can be reused between requests. The
+    website has no shutdown hook that route modules can add to, so the
+    session is closed by a task that waits until it's cancelled, which
+    the event loop does to every remaining task as it shuts down.
+    """
+
+    session: ClassVar[Optional[aiohttp.ClientSession]] = None
+    _closer: ClassVar[Optional[asyncio.Task]] = None
+
+    @classmethod
+    def get_session(cls, config: Optional[dict] = None) -> aiohttp.ClientSession:
+        """
+        Get the shared client session, creating it if necessary.
+
+        Parameters
+        ----------
+        config : Optional[dict], optional
+            The website config. Connection settings are read from its
+            ``[http]`` table.
+
+        Returns
+        -------
+        aiohttp.ClientSession
+            The shared client session.
+        """
+
+        if cls.session is not None and not cls.session.closed:
+            return cls.session
+        http_config = (config or {}).get('http', {})
+        dns_cache_ttl = http_config.get('dns_cache_ttl', 300)
+        connector = aiohttp.TCPConnector(
+            limit=http_config.get('connection_limit', 100),
+            limit_per_host=http_config.get('connection_limit_per_host', 20),
+            keepalive_timeout=http_config.get('keepalive_timeout', 30),
+            use_dns_cache=dns_cache_ttl > 0,
+            ttl_dns_cache=dns_cache_ttl or None,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=http_config.get('timeout', 30),
+        )
+        cls.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            trace_configs=[create_trace_config()],
+        )
+        cls._closer = asyncio.get_running_loop().create_task(cls._close_on_shutdown(cls.session))
+        return cls.session
+
+    @classmethod
+    async def _close_on_shutdown(cls, session: aiohttp.ClientSession) -> None:
+        """
+        Wait until cancelled, then close the given session.
+        """
+
+        try:
+            await asyncio.get_running_loop().create_future()
+        finally:
+            await session.close()
+            if cls.session is session:
+                cls.session = None
+
+    @classmethod
+    async def close(cls) -> None:
+        """
+        Close the shared client session and all of its pooled connections.
+        """
+
+        if cls._closer is not None:
+            cls._closer.cancel()
+            cls._closer = None
+        if cls.session is None:
+            return
+        await cls.session.close()
+        cls.session = None
@@ -0,0 +1,380 @@
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import asyncio
+import hashlib
+import hmac
+import io
+import logging
+import mimetypes
+import os
+import secrets
+
+from aiohttp.web import (
+    FileResponse, HTTPBadGateway, HTTPBadRequest, HTTPForbidden,
+    HTTPUnsupportedMediaType, Request, Response,
+)
+from PIL import Image, UnidentifiedImageError
+from yarl import URL
+import aiohttp
+import aiohttp_jinja2
+
+from .http_client import HTTPClient
+from .metrics import Counter
+
+
+__all__ = (
+    'ImageFetchError',
+    'UnsupportedImageError',
+    'ImageProxy',
+    'image_proxy',
+    'serve_proxied_image',
+    'install_image_proxy_globals',
+)
+
+
+log = logging.getLogger("image_proxy")
+log.setLevel(logging.INFO)
+
+
+image_proxy_requests = Counter(
+    "image_proxy_requests_total",
+    "Requests to the image proxy, by whether the image was already on disk.",
+    ("result",),
+)
+
+
+# The formats that resized images are saved as, by the type they were
+# fetched as; anything else is stored as it was fetched
+RESIZABLE_TYPES = {
+    "image/jpeg": ("JPEG", ".jpg", {"quality": 85, "optimize": True}),
+    "image/png": ("PNG", ".png", {"optimize": True}),
+    "image/webp": ("WEBP", ".webp", {"quality": 80}),
+}
+
+
+class ImageFetchError(Exception):
+    """
+    Raised when a remote image can't be fetched, or can't be safely
+    decoded.
+    """
+
+
+class UnsupportedImageError(ImageFetchError):
+    """
+    Raised when a remote image isn't in a format that can be read.
+    """
+
+
+class ImageProxy:
+    """
+    Fetches remote images, such as raffle images and video thumbnails,
+    once, and keeps resized copies of them on disk so that visitors'
+    browsers don't have to load the originals from wherever they're
+    hosted.
+
+    Images are stored in ``directory`` under a hash of their URL and
+    width. The total size of the directory is kept under ``max_size``
+    bytes by removing the least recently served images first; the files'
+    modification times are used as the last served time, so the order
+    survives restarts. Concurrent requests for an image that isn't stored
+    yet share a single fetch.
+
+    URLs for the proxy are signed with ``[image_proxy] secret`` so that
+    it can't be used to fetch anything other than the images the site
+    itself links to.
+    """
+
+    def __init__(self, directory: str = "website/image_cache"):
+        self.directory = directory
+        self._config: dict = {}
+        self._secret: Optional[bytes] = None
+        self._entries: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self._size: int = 0
+        self._scanned: bool = False
+        self._loading: Dict[str, asyncio.Task] = {}
+
+    @property
+    def proxy_config(self) -> dict:
+        return self._config.get('image_proxy', {})
+
+    @property
+    def enabled(self) -> bool:
+        return self.proxy_config.get('enabled', True)
+
+    @property
+    def max_size(self) -> int:
+        return int(self.proxy_config.get('max_cache_size', 256 * 1024 * 1024))
+
+    @property
+    def max_source_size(self) -> int:
+        return int(self.proxy_config.get('max_source_size', 10 * 1024 * 1024))
+
+    @property
+    def max_pixels(self) -> int:
+        return int(self.proxy_config.get('max_pixels', 25_000_000))
+
+    @property
+    def widths(self) -> Tuple[int, ...]:
+        return tuple(sorted(self.proxy_config.get('widths', [320, 640, 1280])))
+
+    def configure(self, config: dict) -> None:
+        """
+        Set the website config to read the proxy's settings from.
+        """
+
+        self._config = config
+        self.directory = self.proxy_config.get('directory', self.directory)
+        secret = self.proxy_config.get('secret')
+        if secret:
+            self._secret = secret.encode()
+        elif self._secret is None:
+            log.warning("No image proxy secret set; proxied image URLs will only work in this process")
+            self._secret = secrets.token_bytes(32)
+
+    def sign(self, url: str, width: int) -> str:
+        return hmac.new(self._secret, f"{width}:{url}".encode(), hashlib.sha256).hexdigest()[:32]
+
+    def url(self, url: str, width: Optional[int] = None) -> str:
+        """
+        Get the proxied URL for a remote image.
+
+        Parameters
+        ----------
+        url : str
+            The URL of the remote image.
+        width : Optional[int], optional
+            The width that the image is shown at. The image is resized to
+            the smallest configured width that's at least this wide. It's
+            kept at its original size if this isn't given.
+
+        Returns
+        -------
+        str
+            The proxy's URL for the image, or the original URL if it can't
+            be proxied.
+        """
+
+        if not self.enabled or not url or not url.startswith(("http://", "https://")):
+            return url
+        if width:
+            width = next((i for i in self.widths if i >= width), self.widths[-1])
+        else:
+            width = 0
+        return str(URL("/img").with_query(url=url, w=width, s=self.sign(url, width)))
+
+    def _scan(self) -> None:
+        """
+        Load the images that are already on disk, least recently served
+        first.
+        """
+
+        self._scanned = True
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for i in os.scandir(self.directory):
+            if not i.is_file() or i.name.startswith("."):
+                continue
+            stat = i.stat()
+            files.append((stat.st_mtime, i.name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[os.path.splitext(name)[0]] = (name, size)
+            self._size += size
+        self._evict()
+
+    def _evict(self) -> None:
+        while self._size > self.max_size and len(self._entries) > 1:
+            _, (name, size) = self._entries.popitem(last=False)
+            self._size -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    async def get(self, url: str, width: int) -> str:
+        """
+        Get the path of a stored image, fetching it if it isn't stored.
+
+        Parameters
+        ----------
+        url : str
+            The URL of the remote image.
+        width : int
+            The width to resize the image to, or ``0`` to keep it at its
+            original size.
+
+        Returns
+        -------
+        str
+            The path to the stored image.
+
+        Raises
+        ------
+        ImageFetchError
+            If the image couldn't be fetched.
+        """
+
+        if not self._scanned:
+            self._scan()
+        key = hashlib.blake2b(f"{width}:{url}".encode(), digest_size=16).hexdigest()
+        entry = self._entries.get(key)
+        if entry is not None:
+            image_proxy_requests.inc(result="hit")
+            self._entries.move_to_end(key)
+            path = os.path.join(self.directory, entry[0])
+            try:
+                os.utime(path)
+                return path
+            except FileNotFoundError:
+                self._entries.pop(key, None)
+                self._size -= entry[1]
+
+        image_proxy_requests.inc(result="miss")
+        task = self._loading.get(key)
+        if task is None:
+            task = asyncio.create_task(self._load(key, url, width))
+            self._loading[key] = task
+        return await asyncio.shield(task)
+
+    async def _load(self, key: str, url: str, width: int) -> str:
+        try:
+            data, content_type = await self._fetch(url)
+            loop = asyncio.get_running_loop()
+            name = await loop.run_in_executor(None, self._store, key, data, content_type, width)
+        finally:
+            del self._loading[key]
+        size = os.path.getsize(os.path.join(self.directory, name))
+        self._entries[key] = (name, size)
+        self._size += size
+        self._evict()
+        return os.path.join(self.directory, name)
+
+    async def _fetch(self, url: str) -> Tuple[bytes, str]:
+        session = HTTPClient.get_session(self._config)
+        trace_request_ctx = {
+            "upstream": "image_proxy",
+            "route": "/img",
+        }
+        try:
+            # Redirects aren't followed, since the signature only vouches
+            # for the URL that the site linked to and not wherever that
+            # sends us (which could be somewhere on the local network)
+            async with session.get(
+                    url, headers={"Accept": "image/*"}, allow_redirects=False,
+                    trace_request_ctx=trace_request_ctx) as r:
+                if r.status != 200:
+                    raise ImageFetchError(f"Got status {r.status} from {url}")
+                if not r.content_type.startswith("image/"):
+                    raise ImageFetchError(f"Got non-image type {r.content_type} from {url}")
+                if r.content_length is not None and r.content_length > self.max_source_size:
+                    raise ImageFetchError(f"Image at {url} is too large")
+                data = bytearray()
+                async for chunk in r.content.iter_chunked(64 * 1024):
+                    data.extend(chunk)
+                    if len(data) > self.max_source_size:
+                        raise ImageFetchError(f"Image at {url} is too large")
+                return bytes(data), r.content_type
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise ImageFetchError(f"Failed to fetch {url}: {e!r}") from e
+
+    def _store(self, key: str, data: bytes, content_type: str, width: int) -> str:
+        """
+        Check that an image can be decoded, resize it (if it can be) and
+        write it to disk. This blocks, so is run in an executor.
+
+        Raises
+        ------
+        ImageFetchError
+            If the image is larger than ``[image_proxy] max_pixels`` or is
+            broken.
+        UnsupportedImageError
+            If the image's format can't be read.
+        """
+
+        ext = mimetypes.guess_extension(content_type) or ".img"
+        image_format, options = None, {}
+        if content_type in RESIZABLE_TYPES:
+            image_format, ext, options = RESIZABLE_TYPES[content_type]
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                if image.width * image.height > self.max_pixels:
+                    raise ImageFetchError(f"Refusing to decode image {key} of {image.width}x{image.height} pixels")
+
+                # Decode the whole image whether it's resized or not, so
+                # that truncated and broken images are never stored
+                image.load()
+                if image_format and width and image.width > width:
+                    height = round(image.height * width / image.width)
+                    image = image.resize((width, height), Image.LANCZOS)
+                    if image_format == "JPEG" and image.mode != "RGB":
+                        image = image.convert("RGB")
+                    output = io.BytesIO()
+                    image.save(output, image_format, **options)
+                    data = output.getvalue()
+        except Image.DecompressionBombError as e:
+            raise ImageFetchError(f"Refusing to decode image {key}: {e}") from e
+        except UnidentifiedImageError as e:
+            raise UnsupportedImageError(f"Couldn't identify image {key}") from e
+        except (OSError, ValueError) as e:
+            raise ImageFetchError(f"Couldn't decode image {key}: {e!r}") from e
+
+        # Write it somewhere else first so that a half-written file is
+        # never served
+        name = key + ext
+        temp = os.path.join(self.directory, f".{name}.tmp")
+        with open(temp, "wb") as a:
+            a.write(data)
+        os.replace(temp, os.path.join(self.directory, name))
+        return name
+
+
+image_proxy = ImageProxy()
+
+
+async def serve_proxied_image(request: Request) -> Response:
+    """
+    Serve an image through the proxy. The query has the remote image's
+    ``url``, the width ``w`` to resize it to, and the signature ``s`` from
+    :meth:`ImageProxy.url`.
+    """
+
+    image_proxy.configure(request.app['config'])
+    url = request.query.get("url", "")
+    signature = request.query.get("s", "")
+    try:
+        width = int(request.query.get("w", "0"))
+    except ValueError:
+        raise HTTPBadRequest()
+    if not url.startswith(("http://", "https://")) or (width and width not in image_proxy.widths):
+        raise HTTPBadRequest()
+    if not hmac.compare_digest(signature, image_proxy.sign(url, width)):
+        raise HTTPForbidden()
+    try:
+        path = await image_proxy.get(url, width)
+    except UnsupportedImageError as e:
+        log.warning(str(e))
+        raise HTTPUnsupportedMediaType()
+    except ImageFetchError as e:
+        log.warning(str(e))
+        raise HTTPBadGateway()
+    headers = {
+        "Cache-Control": "public, max-age=%s" % image_proxy.proxy_config.get('max_age', 2592000),
+        "Content-Security-Policy": "default-src 'none'; style-src 'unsafe-inline'; sandbox",
+        "X-Content-Type-Options": "nosniff",
+    }
+    content_type = mimetypes.guess_type(path)[0]
+    if content_type:
+        headers["Content-Type"] = content_type
+    return FileResponse(path, headers=headers)
+
+
+def install_image_proxy_globals(request: Request) -> None:
+    """
+    Give the templates ``proxied_image`` for linking to remote images
+    through the proxy.
+    """
+
+    env = aiohttp_jinja2.get_env(request.app)
+    if "proxied_image" in env.globals:
+        return
+    image_proxy.configure(request.app['config'])
+    env.globals["proxied_image"] = image_proxy.url
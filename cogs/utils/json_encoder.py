@@ -1,19 +1,72 @@
-from typing import Any
+from typing import Any, Optional
 import json
 from datetime import datetime
 import uuid
 
+from aiohttp.web import Response
+import asyncpg
+
+from .raffle import Raffle
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 __all__ = (
     'HTTPEncoder',
+    'json_dumps',
+    'json_response',
 )
 
 
+def _default(o: Any) -> Any:
+    if isinstance(o, asyncpg.Record):
+        return dict(o)
+    elif isinstance(o, Raffle):
+        return o.to_json()
+    elif isinstance(o, datetime):
+        return o.isoformat()
+    elif isinstance(o, uuid.UUID):
+        return str(o)
+    raise TypeError(f"Object of type {o.__class__.__name__} is not JSON serializable")
+
+
 class HTTPEncoder(json.JSONEncoder):
 
     def default(self, o: Any) -> Any:
-        if isinstance(o, datetime):
-            return o.isoformat()
-        elif isinstance(o, uuid.UUID):
-            return str(o)
-        return super().default(o)
+        try:
+            return _default(o)
+        except TypeError:
+            return super().default(o)
+
+
+def json_dumps(item: Any) -> bytes:
+    """
+    Serialize an item to JSON in a single pass. Database records, raffles,
+    datetimes and UUIDs are all handled. ``orjson`` is used if it's
+    installed.
+    """
+
+    if orjson is not None:
+        return orjson.dumps(item, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(item, cls=HTTPEncoder, separators=(",", ":")).encode()
+
+
+def json_response(
+        data: Any,
+        *,
+        status: int = 200,
+        headers: Optional[dict] = None) -> Response:
+    """
+    A replacement for :func:`aiohttp.web.json_response` that serializes
+    its data with :func:`json_dumps`.
+    """
+
+    return Response(
+        body=json_dumps(data),
+        status=status,
+        headers=headers,
+        content_type="application/json",
+    )
@@ -0,0 +1,193 @@
+from bisect import bisect_left
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Sequence, Tuple
+import asyncio
+
+import aiohttp
+
+
+__all__ = (
+    'Counter',
+    'Gauge',
+    'Histogram',
+    'render_metrics',
+    'create_trace_config',
+)
+
+
+LabelValues = Tuple[str, ...]
+
+
+class _Metric:
+
+    TYPE: str = "untyped"
+    registry: List['_Metric'] = []
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(i, "")) for i in self.labels)
+
+    def _format_labels(self, values: LabelValues, extra: Optional[Dict[str, str]] = None) -> str:
+        pairs = list(zip(self.labels, values))
+        pairs.extend((extra or {}).items())
+        if not pairs:
+            return ""
+        escaped = (
+            '%s="%s"' % (i, o.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+            for i, o in pairs
+        )
+        return "{%s}" % ",".join(escaped)
+
+    def render(self) -> List[str]:
+        return [
+            "# HELP %s %s" % (self.name, self.description),
+            "# TYPE %s %s" % (self.name, self.TYPE),
+        ]
+
+
+class Counter(_Metric):
+    """
+    A value that only goes up, eg a number of requests.
+    """
+
+    TYPE = "counter"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        super().__init__(name, description, labels)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for key, value in self.values.items():
+            lines.append("%s%s %s" % (self.name, self._format_labels(key), value))
+        return lines
+
+
+class Gauge(Counter):
+    """
+    A value that can go up and down, eg a number of open requests.
+    """
+
+    TYPE = "gauge"
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """
+    A distribution of observed values, eg request latencies, counted into
+    cumulative buckets.
+    """
+
+    TYPE = "histogram"
+    DEFAULT_BUCKETS: Tuple[float, ...] = (
+        0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+    )
+
+    def __init__(
+            self,
+            name: str,
+            description: str,
+            labels: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.counts: Dict[LabelValues, List[int]] = {}
+        self.sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        if key not in self.counts:
+            self.counts[key] = [0] * (len(self.buckets) + 1)
+            self.sums[key] = 0.0
+        self.counts[key][bisect_left(self.buckets, value)] += 1
+        self.sums[key] += value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for key, counts in self.counts.items():
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                total += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append("%s_bucket%s %s" % (self.name, self._format_labels(key, {"le": le}), total))
+            lines.append("%s_sum%s %s" % (self.name, self._format_labels(key), self.sums[key]))
+            lines.append("%s_count%s %s" % (self.name, self._format_labels(key), total))
+        return lines
+
+
+def render_metrics() -> str:
+    """
+    Render every metric in the Prometheus text exposition format.
+    """
+
+    lines = []
+    for metric in _Metric.registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+OUTBOUND_LABELS = ("upstream", "route", "method")
+outbound_duration = Histogram(
+    "outbound_request_duration_seconds",
+    "Time taken by requests to external APIs.",
+    OUTBOUND_LABELS,
+)
+outbound_requests = Counter(
+    "outbound_requests_total",
+    "Requests made to external APIs, by response status.",
+    OUTBOUND_LABELS + ("status",),
+)
+outbound_in_flight = Gauge(
+    "outbound_requests_in_flight",
+    "Requests to external APIs that are waiting on a response.",
+    OUTBOUND_LABELS,
+)
+
+
+def create_trace_config() -> aiohttp.TraceConfig:
+    """
+    Create a trace config that records the latency, status and number of
+    in-flight requests for every request made with a client session.
+
+    Requests can set ``trace_request_ctx={"upstream": ..., "route": ...}``
+    to be labelled with a name and route template; otherwise the host and
+    path of the URL are used.
+    """
+
+    async def on_request_start(_, ctx: SimpleNamespace, params: aiohttp.TraceRequestStartParams):
+        request_ctx = ctx.trace_request_ctx or {}
+        ctx.labels = {
+            "upstream": request_ctx.get("upstream") or params.url.host or "",
+            "route": request_ctx.get("route") or params.url.path,
+            "method": params.method,
+        }
+        ctx.start = asyncio.get_running_loop().time()
+        outbound_in_flight.inc(**ctx.labels)
+
+    def finish(ctx: SimpleNamespace, status: str):
+        outbound_in_flight.dec(**ctx.labels)
+        outbound_duration.observe(asyncio.get_running_loop().time() - ctx.start, **ctx.labels)
+        outbound_requests.inc(status=status, **ctx.labels)
+
+    async def on_request_end(_, ctx: SimpleNamespace, params: aiohttp.TraceRequestEndParams):
+        finish(ctx, str(params.response.status))
+
+    async def on_request_exception(_, ctx: SimpleNamespace, params: aiohttp.TraceRequestExceptionParams):
+        finish(ctx, "error")
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    return trace_config
@@ -0,0 +1,158 @@
+from typing import List, Tuple
+import logging
+import os
+import re
+
+import asyncpg
+
+
+__all__ = (
+    'get_migrations',
+    'run_migrations',
+)
+
+
+log = logging.getLogger("migrations")
+log.setLevel(logging.INFO)
+
+
+MIGRATION_FILENAME = re.compile(r"^(?P<version>\d+)_(?P<name>\w+)\.pgsql$")
+
+
+def get_migrations(directory: str) -> List[Tuple[int, str, str]]:
+    """
+    Get all of the migrations in a directory. Migration files are named
+    ``<version>_<name>.pgsql``, eg ``0002_hot_query_indexes.pgsql``.
+
+    Parameters
+    ----------
+    directory : str
+        The directory to look in.
+
+    Returns
+    -------
+    List[Tuple[int, str, str]]
+        A list of ``(version, name, path)`` tuples, sorted by version.
+    """
+
+    migrations = []
+    for filename in os.listdir(directory):
+        match = MIGRATION_FILENAME.match(filename)
+        if match is None:
+            continue
+        migrations.append((
+            int(match.group("version")),
+            match.group("name"),
+            os.path.join(directory, filename),
+        ))
+    migrations.sort()
+    versions = [i[0] for i in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError("Duplicate migration versions in %s" % directory)
+    return migrations
+
+
+async def run_migrations(
+        conn: asyncpg.Connection,
+        *,
+        baseline: str = "config/database.pgsql",
+        directory: str = "config/migrations") -> List[int]:
+    """
+    Bring the database schema up to date.
+
+    The baseline schema file is run first (it's written to be run
+    repeatedly), followed by every migration that isn't yet recorded in
+    the ``schema_migrations`` table. Each migration runs in its own
+    transaction alongside its record, so a failed migration leaves
+    nothing behind.
+
+    Parameters
+    ----------
+    conn : asyncpg.Connection
+        The connection to run the migrations over.
+    baseline : str, optional
+        The path to the baseline schema file.
+    directory : str, optional
+        The directory that the migration files are in.
+
+    Returns
+    -------
+    List[int]
+        The versions of the migrations that were applied.
+    """
+
+    # Make sure only one process is migrating at a time
+    await conn.execute("SELECT pg_advisory_lock(hashtext('schema_migrations'))")
+    try:
+        with open(baseline) as a:
+            await conn.execute(a.read())
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations(
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT TIMEZONE('UTC', NOW())
+            )
+            """
+        )
+        applied = {
+            i['version']
+            for i in await conn.fetch("SELECT version FROM schema_migrations")
+        }
+
+        # Run everything that hasn't been run yet
+        ran = []
+        for version, name, path in get_migrations(directory):
+            if version in applied:
+                continue
+            log.info("Applying migration %s %s" % (version, name))
+            with open(path) as a:
+                sql = a.read()
+            async with conn.transaction():
+                await conn.execute(sql)
+                await conn.execute(
+                    """
+                    INSERT INTO
+                        schema_migrations
+                        (
+                            version,
+                            name
+                        )
+                    VALUES
+                        (
+                            $1,
+                            $2
+                        )
+                    """,
+                    version, name,
+                )
+            ran.append(version)
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock(hashtext('schema_migrations'))")
+    return ran
+
+
+async def main(config_file: str) -> None:
+    import toml
+
+    with open(config_file) as a:
+        config = toml.load(a)
+    config_args = ("host", "port", "database", "user", "password",)
+    conn = await asyncpg.connect(**{
+        i: o
+        for i, o in config['database'].items()
+        if i in config_args
+    })
+    try:
+        ran = await run_migrations(conn)
+    finally:
+        await conn.close()
+    log.info("Applied %s migration(s)" % len(ran))
+
+
+if __name__ == "__main__":
+    import asyncio
+    import sys
+
+    logging.basicConfig()
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "config/website.toml"))
@@ -0,0 +1,93 @@
+from datetime import datetime as dt
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import asyncio
+
+
+__all__ = (
+    'PageCache',
+    'page_cache',
+)
+
+
+Loader = Callable[[], Awaitable[Tuple[Any, Optional[dt]]]]
+
+
+class PageCache:
+    """
+    An in-process, read-through cache for the data behind the website's
+    pages.
+
+    Values are loaded the first time they're asked for and kept until
+    they're invalidated (by the endpoints that change them) or until their
+    expiry time passes. Concurrent misses for the same key share a single
+    load.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[Any, Optional[dt]]] = {}
+        self._loading: Dict[str, asyncio.Task] = {}
+        self._generations: Dict[str, int] = {}
+
+    async def get(self, key: str, loader: Loader) -> Any:
+        """
+        Get a cached value, loading it if it's missing or has expired.
+
+        Parameters
+        ----------
+        key : str
+            The key of the value.
+        loader : Callable[[], Awaitable[Tuple[Any, Optional[dt]]]]
+            A coroutine function that loads the value. It returns the value
+            and the (naive UTC) time it expires at, or ``None`` if it only
+            expires when invalidated.
+
+        Returns
+        -------
+        Any
+            The cached value.
+        """
+
+        cached = self._entries.get(key)
+        if cached is not None:
+            value, expires_at = cached
+            if expires_at is None or dt.utcnow() < expires_at:
+                return value
+            del self._entries[key]
+
+        task = self._loading.get(key)
+        if task is None:
+            task = asyncio.create_task(self._load(key, loader))
+            self._loading[key] = task
+        return await asyncio.shield(task)
+
+    async def _load(self, key: str, loader: Loader) -> Any:
+        generation = self._generations.get(key, 0)
+        try:
+            value, expires_at = await loader()
+        finally:
+            if self._loading.get(key) is asyncio.current_task():
+                del self._loading[key]
+
+        # Don't store anything that was invalidated while it was loading
+        if self._generations.get(key, 0) == generation:
+            self._entries[key] = (value, expires_at)
+        return value
+
+    def invalidate(self, *keys: str) -> None:
+        """
+        Remove values from the cache, so they're loaded again the next time
+        they're asked for.
+
+        Parameters
+        ----------
+        *keys : str
+            The keys of the values to remove.
+        """
+
+        for key in keys:
+            self._entries.pop(key, None)
+            self._loading.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+
+page_cache = PageCache()
@@ -0,0 +1,151 @@
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import asyncio
+
+import aiohttp
+
+from .video import Video, VideoCollection
+
+
+__all__ = (
+    'PlaylistFetcher',
+)
+
+
+PageKey = Tuple[str, Optional[str]]
+Page = Tuple[Tuple[Video, ...], Optional[str]]
+
+
+class PlaylistFetcher:
+    """
+    Fetches the items of a set of YouTube playlists concurrently.
+
+    The videos on each page that's fetched are stored alongside its ETag,
+    so that the next fetch can send ``If-None-Match`` and reuse the stored
+    videos if YouTube replies with a ``304 Not Modified``.
+    """
+
+    URL: str = "https://www.googleapis.com/youtube/v3/playlistItems"
+    # https://developers.google.com/youtube/v3/docs/playlistItems/list
+
+    def __init__(self):
+        self.pages: Dict[PageKey, Tuple[str, Page]] = {}
+
+    async def fetch(
+            self,
+            session: aiohttp.ClientSession,
+            *,
+            api_key: str,
+            playlist_ids: Iterable[str],
+            headers: Optional[dict] = None,
+            max_results: int = 6,
+            max_pages: int = 1,
+            concurrency: int = 4,
+            limit: Optional[int] = None) -> VideoCollection:
+        """
+        Get the videos from each of the given playlists, newest first.
+
+        Parameters
+        ----------
+        session : aiohttp.ClientSession
+            The session to make the requests with.
+        api_key : str
+            The Google Cloud API key.
+        playlist_ids : Iterable[str]
+            The IDs of the playlists to get the videos of.
+        headers : Optional[dict], optional
+            Any additional headers to send with each request.
+        max_results : int, optional
+            The number of items to ask for per page.
+        max_pages : int, optional
+            The maximum number of pages to follow per playlist.
+        concurrency : int, optional
+            The maximum number of requests to have open at once.
+        limit : Optional[int], optional
+            The maximum number of videos to return. If not provided, all
+            fetched videos are returned.
+
+        Returns
+        -------
+        VideoCollection
+            The fetched videos, sorted by their publish time, newest first,
+            with any video that's in more than one playlist only included
+            once.
+        """
+
+        semaphore = asyncio.Semaphore(concurrency)
+        seen: Set[PageKey] = set()
+        playlists = await asyncio.gather(*(
+            self._fetch_playlist(
+                session,
+                semaphore,
+                seen,
+                playlist_id=pid,
+                params={
+                    "part": "snippet,contentDetails",
+                    "maxResults": max_results,
+                    "playlistId": pid,
+                    "key": api_key,
+                },
+                headers=headers or {},
+                max_pages=max_pages,
+            )
+            for pid in playlist_ids
+        ))
+
+        # Forget about any pages that we didn't ask for this time around
+        self.pages = {i: o for i, o in self.pages.items() if i in seen}
+
+        # Merge the playlists, only keeping the newest items
+        return VideoCollection.merge(playlists, limit=limit)
+
+    async def _fetch_playlist(
+            self,
+            session: aiohttp.ClientSession,
+            semaphore: asyncio.Semaphore,
+            seen: Set[PageKey],
+            *,
+            playlist_id: str,
+            params: dict,
+            headers: dict,
+            max_pages: int) -> List[Video]:
+        items: List[Video] = []
+        page_token: Optional[str] = None
+        for _ in range(max(max_pages, 1)):
+            key = (playlist_id, page_token)
+            seen.add(key)
+            page_params = params.copy()
+            if page_token:
+                page_params["pageToken"] = page_token
+            async with semaphore:
+                videos, page_token = await self._fetch_page(session, key, page_params, headers)
+            items.extend(videos)
+            if not page_token:
+                break
+        return items
+
+    async def _fetch_page(
+            self,
+            session: aiohttp.ClientSession,
+            key: PageKey,
+            params: dict,
+            headers: dict) -> Page:
+        cached = self.pages.get(key)
+        if cached:
+            headers = {**headers, "If-None-Match": cached[0]}
+        trace_request_ctx = {
+            "upstream": "youtube",
+            "route": "/youtube/v3/playlistItems",
+        }
+        async with session.get(self.URL, params=params, headers=headers, trace_request_ctx=trace_request_ctx) as site:
+            if site.status == 304 and cached:
+                return cached[1]
+            site.raise_for_status()
+            data = await site.json()
+            etag = site.headers.get('ETag') or data.get('etag')
+        page = (
+            tuple(Video(data=i) for i in data.get('items', [])),
+            data.get('nextPageToken'),
+        )
+        if etag:
+            self.pages[key] = (etag, page)
+        return page
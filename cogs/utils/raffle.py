@@ -34,6 +34,8 @@ class Raffle:
     is_giveaway: bool
         Whether or not this raffle is a giveaway or not. Shorthand for
         ``.entry_price in [None, 0]``.
+    closed: bool
+        Whether or not the raffle has been closed and its winners drawn.
     """
 
     __slots__ = (
@@ -46,6 +48,7 @@ class Raffle:
         '_entry_price',
         '_max_entries',
         'deleted',
+        'closed',
     )
 
     def __init__(self, *, data: dict):
@@ -58,6 +61,7 @@ class Raffle:
         self._entry_price: Optional[int] = data['entry_price']
         self._max_entries: Optional[int] = data['max_entries']
         self.deleted: bool = data.get('deleted', False)
+        self.closed: bool = data.get('closed', False)
 
     @property
     def max_entries(self) -> int:
@@ -99,7 +103,28 @@ class Raffle:
 
     @property
     def ended(self):
-        return dt.utcnow() > self._end_time
-
-
-
+        return self.has_ended()
+
+    def has_ended(self, now: Optional[dt] = None) -> bool:
+        """
+        Whether or not the raffle has ended as of the given time. Pass the
+        time in when checking lots of raffles, rather than looking up the
+        current time for each one.
+        """
+
+        return (now or dt.utcnow()) >= self._end_time
+
+    def to_json(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "description": self.description,
+            "image": self.image,
+            "entry_price": self.entry_price,
+            "max_entries": self.max_entries,
+            "is_giveaway": self.is_giveaway,
+            "deleted": self.deleted,
+            "closed": self.closed,
+        }
@@ -0,0 +1,84 @@
+from typing import List, Optional, Sequence, TypeVar
+import random
+
+
+__all__ = (
+    'draw_winners',
+)
+
+
+T = TypeVar("T")
+
+
+def draw_winners(
+        entrants: Sequence[T],
+        weights: Sequence[int],
+        k: int = 1,
+        *,
+        seed: Optional[int] = None) -> List[T]:
+    """
+    Draw up to ``k`` distinct winners, where each entrant's chance of
+    being picked is proportional to their weight (ie their number of
+    entries).
+
+    The weights are kept in a Fenwick tree, so each draw is a binary
+    search over the cumulative weights and a winner is taken out of the
+    running in ``O(log n)``, without sorting or copying the entrants.
+
+    Parameters
+    ----------
+    entrants : Sequence[T]
+        The entrants to draw from.
+    weights : Sequence[int]
+        The weight of each entrant. Entrants with a weight of ``0`` or
+        less can't be drawn.
+    k : int, optional
+        The number of winners to draw.
+    seed : Optional[int], optional
+        A seed for the draw. Draws with the same entrants, weights and
+        seed always give the same winners.
+
+    Returns
+    -------
+    List[T]
+        The winners, in the order they were drawn.
+    """
+
+    if len(entrants) != len(weights):
+        raise ValueError("Entrants and weights must be the same length")
+    rng = random.Random(seed)
+
+    # Build the tree; tree[i] holds the sum of the weights in (i - lowbit(i), i]
+    size = len(weights)
+    tree = [0] * (size + 1)
+    for i, weight in enumerate(weights, start=1):
+        tree[i] += max(weight, 0)
+        parent = i + (i & -i)
+        if parent <= size:
+            tree[parent] += tree[i]
+    total = sum(max(i, 0) for i in weights)
+    top_bit = 1 << (size.bit_length() - 1) if size else 0
+
+    winners: List[T] = []
+    while len(winners) < k and total > 0:
+
+        # Find the first entrant whose cumulative weight is past our target
+        target = rng.randrange(total)
+        position = 0
+        bit = top_bit
+        while bit:
+            child = position + bit
+            if child <= size and tree[child] <= target:
+                position = child
+                target -= tree[child]
+            bit >>= 1
+        winners.append(entrants[position])
+
+        # And take them out of the draw
+        weight = max(weights[position], 0)
+        total -= weight
+        i = position + 1
+        while i <= size:
+            tree[i] -= weight
+            i += i & -i
+    return winners
@@ -0,0 +1,243 @@
+from bisect import bisect_right, insort
+from datetime import datetime as dt, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import UUID
+import asyncio
+import logging
+import time
+
+from .database import Database
+from .raffle import Raffle
+
+
+__all__ = (
+    'RaffleIndex',
+    'raffle_index',
+)
+
+
+log = logging.getLogger("raffle_index")
+log.setLevel(logging.INFO)
+
+
+TimeKey = Tuple[dt, UUID]
+
+# Sorts after every real raffle ID with the same time, so that bisecting
+# with it splits the index exactly at that time
+MAX_UUID = UUID(int=(1 << 128) - 1)
+
+
+class RaffleIndex:
+    """
+    An in-process index of the raffles that haven't been deleted and are
+    either still open or ended in the last :attr:`retention`, kept sorted
+    by both start and end time. Older raffles are only ever read straight
+    from the database, so the index doesn't grow with the raffle history.
+
+    The raffles are loaded from the database the first time they're
+    needed, and changes made in this process are applied straight away by
+    the raffle API calling :meth:`update` and :meth:`remove`. The table is
+    read again once the raffles are more than :attr:`max_age` seconds old,
+    so that changes made by other processes (or straight to the database)
+    are picked up too. As every query takes the time to check against,
+    raffles move between upcoming, active and ended at exactly their start
+    and end times without the table being read again.
+
+    Attributes
+    -----------
+    raffles: Dict[UUID, Raffle]
+        The indexed raffles by their ID.
+    max_age: float
+        How long the loaded raffles are used for before they're reloaded,
+        in seconds.
+    retention: timedelta
+        How long closed raffles are kept in the index after they end.
+    """
+
+    def __init__(self):
+        self.raffles: Dict[UUID, Raffle] = {}
+        self._starts: List[TimeKey] = []
+        self._ends: List[TimeKey] = []
+        self.max_age: float = 30.0
+        self.retention: timedelta = timedelta(days=7)
+        self._loaded: bool = False
+        self._loaded_at: float = 0.0
+        self._loading: Optional[asyncio.Task] = None
+        self._generation: int = 0
+
+    async def ensure_loaded(self, config: Optional[dict] = None) -> None:
+        """
+        Load the raffles from the database if they haven't been already,
+        or if they're more than :attr:`max_age` seconds old. Concurrent
+        calls share a single load.
+
+        Parameters
+        ----------
+        config : Optional[dict], optional
+            The website config. :attr:`max_age` and :attr:`retention` are
+            read from its ``[raffles]`` table.
+        """
+
+        if config is not None:
+            raffle_config = config.get('raffles', {})
+            self.max_age = float(raffle_config.get('index_max_age', self.max_age))
+            self.retention = timedelta(seconds=raffle_config.get(
+                'index_retention', self.retention.total_seconds(),
+            ))
+        if self._loaded and time.monotonic() < self._loaded_at + self.max_age:
+            return
+        if self._loading is None:
+            self._loading = asyncio.create_task(self._load())
+        await asyncio.shield(self._loading)
+
+    async def _load(self) -> None:
+        try:
+            while True:
+                generation = self._generation
+                async with Database() as db:
+                    rows = await db.call(
+                        """
+                        SELECT
+                            *
+                        FROM
+                            raffles
+                        WHERE
+                            deleted IS FALSE
+                        AND
+                            (
+                                closed IS FALSE
+                            OR
+                                end_time > $1
+                            )
+                        """,
+                        dt.utcnow() - self.retention,
+                    )
+
+                # Load again if a raffle was changed while we were reading
+                # the table, so that we don't overwrite the change
+                if generation == self._generation:
+                    break
+            self.replace(Raffle(data=i) for i in rows)
+        except Exception:
+
+            # Keep using the raffles we've got rather than failing every
+            # page, and don't try again until they're due a reload
+            if not self._loaded:
+                raise
+            log.exception("Failed to reload raffles")
+            self._loaded_at = time.monotonic()
+        finally:
+            self._loading = None
+
+    def replace(self, raffles: Iterable[Raffle]) -> None:
+        """
+        Replace everything in the index with the given raffles.
+        """
+
+        now = dt.utcnow()
+        self.raffles = {i.id: i for i in raffles if self._keeps(i, now)}
+        self._starts = sorted((i._start_time, i.id) for i in self.raffles.values())
+        self._ends = sorted((i._end_time, i.id) for i in self.raffles.values())
+        self._loaded = True
+        self._loaded_at = time.monotonic()
+
+    def update(self, raffle: Raffle) -> None:
+        """
+        Add a raffle to the index, or replace the stored copy of it.
+        Deleted raffles, and closed raffles that ended before the
+        retention period, are removed instead.
+        """
+
+        self._generation += 1
+        if not self._loaded:
+            return
+        self._discard(raffle.id)
+        if not self._keeps(raffle):
+            return
+        self.raffles[raffle.id] = raffle
+        insort(self._starts, (raffle._start_time, raffle.id))
+        insort(self._ends, (raffle._end_time, raffle.id))
+
+    def _keeps(self, raffle: Raffle, now: Optional[dt] = None) -> bool:
+        if raffle.deleted:
+            return False
+        return not raffle.closed or raffle._end_time > (now or dt.utcnow()) - self.retention
+
+    def remove(self, raffle_id: UUID) -> None:
+        """
+        Remove a raffle from the index, if it's in there.
+        """
+
+        self._generation += 1
+        if not self._loaded:
+            return
+        self._discard(raffle_id)
+
+    def _discard(self, raffle_id: UUID) -> None:
+        raffle = self.raffles.pop(raffle_id, None)
+        if raffle is None:
+            return
+        for keys, time in ((self._starts, raffle._start_time), (self._ends, raffle._end_time)):
+            index = bisect_right(keys, (time, raffle_id)) - 1
+            del keys[index]
+
+    def active(self, now: Optional[dt] = None) -> List[Raffle]:
+        """
+        Get the raffles that have started but not yet ended, soonest ending
+        first.
+        """
+
+        now = now or dt.utcnow()
+        start = bisect_right(self._ends, (now, MAX_UUID))
+        return [
+            raffle
+            for raffle in (self.raffles[i] for _, i in self._ends[start:])
+            if raffle._start_time <= now
+        ]
+
+    def upcoming(self, now: Optional[dt] = None) -> List[Raffle]:
+        """
+        Get the raffles that haven't started yet, soonest starting first.
+        """
+
+        now = now or dt.utcnow()
+        start = bisect_right(self._starts, (now, MAX_UUID))
+        return [self.raffles[i] for _, i in self._starts[start:]]
+
+    def ended(self, now: Optional[dt] = None) -> List[Raffle]:
+        """
+        Get the raffles that have ended, most recently ended first. Closed
+        raffles are only included for :attr:`retention` after they end.
+        """
+
+        now = now or dt.utcnow()
+        end = bisect_right(self._ends, (now, MAX_UUID))
+        return [self.raffles[i] for _, i in reversed(self._ends[:end])]
+
+    def next_change(self, now: Optional[dt] = None) -> Optional[dt]:
+        """
+        Get the next time that a raffle starts or ends, or ``None`` if none
+        of them will.
+        """
+
+        now = now or dt.utcnow()
+        times = []
+        for keys in (self._starts, self._ends):
+            index = bisect_right(keys, (now, MAX_UUID))
+            if index < len(keys):
+                times.append(keys[index][0])
+        return min(times, default=None)
+
+    def valid_until(self, now: Optional[dt] = None) -> dt:
+        """
+        Get the time that anything shown from the index could next change:
+        either a raffle starts or ends, or the index is due to be reloaded.
+        """
+
+        now = now or dt.utcnow()
+        reload_in = max(self._loaded_at + self.max_age - time.monotonic(), 0)
+        reload_at = now + timedelta(seconds=reload_in)
+        return min(self.next_change(now) or reload_at, reload_at)
+
+
+raffle_index = RaffleIndex()
@@ -0,0 +1,433 @@
+from datetime import datetime as dt, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+import asyncio
+import heapq
+import logging
+import secrets
+
+from aiohttp.web import Request, StreamResponse, middleware
+
+from .database import Database
+from .raffle import Raffle
+from .raffle_draw import draw_winners
+from .raffle_index import raffle_index
+
+
+__all__ = (
+    'RaffleScheduler',
+    'raffle_scheduler',
+    'raffle_scheduler_middleware',
+    'get_raffle_entrants',
+    'get_raffle_winners',
+    'close_raffle',
+)
+
+
+log = logging.getLogger("raffle_scheduler")
+log.setLevel(logging.INFO)
+
+
+async def get_raffle_entrants(db: Any, raffle_id: UUID) -> List[Any]:
+    """
+    Get each user that entered a raffle and how many times they entered,
+    ordered by user ID so that seeded draws can be repeated.
+    """
+
+    return await db.call(
+        """
+        SELECT
+            twitch_username,
+            entries.user_id,
+            entries.count
+        FROM
+            (
+                SELECT
+                    user_id,
+                    COUNT(*)
+                FROM
+                    raffle_entries
+                WHERE
+                    raffle_id = $1
+                GROUP BY
+                    user_id
+            ) entries
+        LEFT JOIN
+            users
+        ON
+            users.id = entries.user_id
+        ORDER BY
+            entries.user_id
+        """,
+        raffle_id,
+    )
+
+
+async def get_raffle_winners(db: Any, raffle_id: UUID) -> List[Any]:
+    """
+    Get the winners that were stored when a raffle was closed, in the
+    order they were drawn.
+    """
+
+    return await db.call(
+        """
+        SELECT
+            twitch_username,
+            raffle_winners.user_id,
+            (
+                SELECT
+                    COUNT(*)
+                FROM
+                    raffle_entries
+                WHERE
+                    raffle_entries.raffle_id = raffle_winners.raffle_id
+                AND
+                    raffle_entries.user_id = raffle_winners.user_id
+            ) AS count,
+            raffles.draw_seed
+        FROM
+            raffle_winners
+        INNER JOIN
+            raffles
+        ON
+            raffles.id = raffle_winners.raffle_id
+        LEFT JOIN
+            users
+        ON
+            users.id = raffle_winners.user_id
+        WHERE
+            raffle_winners.raffle_id = $1
+        ORDER BY
+            raffle_winners.position
+        """,
+        raffle_id,
+    )
+
+
+async def close_raffle(
+        db: Database,
+        raffle_id: UUID,
+        *,
+        count: int = 1,
+        seed: Optional[int] = None) -> Optional[Tuple[Any, List[Any]]]:
+    """
+    Close a raffle that's ended, drawing and storing its winners.
+
+    The raffle is only closed if it's ended and hasn't been closed
+    already; the row is locked while it's being closed, so if several
+    processes try to close the same raffle at once, only one of them will
+    draw its winners.
+
+    Parameters
+    ----------
+    db : Database
+        An open database connection.
+    raffle_id : UUID
+        The ID of the raffle to close.
+    count : int, optional
+        The number of winners to draw.
+    seed : Optional[int], optional
+        The seed to draw the winners with. A random one is used if not
+        given.
+
+    Returns
+    -------
+    Optional[Tuple[Any, List[Any]]]
+        The closed raffle's row and its winners, or ``None`` if the raffle
+        wasn't closed.
+    """
+
+    if seed is None:
+        seed = secrets.randbits(64)
+    async with db.transaction() as transaction:
+        raffle_rows = await transaction.call(
+            """
+            UPDATE
+                raffles
+            SET
+                closed = TRUE,
+                draw_seed = $2
+            WHERE
+                id = $1
+            AND
+                closed IS FALSE
+            AND
+                deleted IS FALSE
+            AND
+                end_time <= TIMEZONE('UTC', NOW())
+            RETURNING
+                *
+            """,
+            raffle_id, str(seed),
+        )
+        if not raffle_rows:
+            return None
+        entrants = await get_raffle_entrants(transaction, raffle_id)
+        winners = draw_winners(
+            entrants,
+            [i['count'] for i in entrants],
+            count,
+            seed=seed,
+        )
+        if winners:
+            await transaction.call(
+                """
+                INSERT INTO
+                    raffle_winners
+                    (
+                        raffle_id,
+                        position,
+                        user_id
+                    )
+                SELECT
+                    $1,
+                    winners.position - 1,
+                    winners.user_id
+                FROM
+                    UNNEST($2::UUID[])
+                    WITH ORDINALITY
+                    AS winners(user_id, position)
+                """,
+                raffle_id, [i['user_id'] for i in winners],
+            )
+    return raffle_rows[0], winners
+
+
+class RaffleScheduler:
+    """
+    Closes raffles and draws their winners as soon as they end.
+
+    The end times of every open raffle are kept in a min-heap, and a
+    background task sleeps until the earliest one. The heap is rebuilt
+    from the database when the task starts and then every
+    ``resync_interval`` seconds, so raffles are still closed after a
+    restart, or if they were created by another process. The raffle API
+    calls :meth:`schedule` and :meth:`cancel` so that changes made in this
+    process take effect immediately.
+
+    Every process runs its own scheduler; :func:`close_raffle` makes sure
+    that each raffle is only drawn once between them.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[dt, UUID]] = []
+        self._end_times: Dict[UUID, dt] = {}
+        self._config: dict = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+
+    @property
+    def enabled(self) -> bool:
+        return (
+            self._config.get('database', {}).get('enabled', False)
+            and self._config.get('raffles', {}).get('auto_draw', True)
+        )
+
+    @property
+    def winner_count(self) -> int:
+        return int(self._config.get('raffles', {}).get('winner_count', 1))
+
+    @property
+    def resync_interval(self) -> float:
+        return float(self._config.get('raffles', {}).get('resync_interval', 60))
+
+    @property
+    def retry_delay(self) -> float:
+        return max(float(self._config.get('raffles', {}).get('retry_delay', 1)), 1.0)
+
+    def ensure_started(self, config: dict) -> None:
+        """
+        Start the background task if it isn't already running.
+
+        Parameters
+        ----------
+        config : dict
+            The website config. Settings are read from its ``[raffles]``
+            table.
+        """
+
+        if self._task is not None and not self._task.done():
+            return
+        self._config = config
+        if not self.enabled:
+            return
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def close_overdue(self, config: dict) -> None:
+        """
+        Close every raffle that's already ended, once, without starting
+        the background task. This is run by ``_run_website.sh`` before
+        the website starts, since the background task isn't started until
+        the first request comes in.
+
+        Parameters
+        ----------
+        config : dict
+            The website config. Settings are read from its ``[raffles]``
+            table.
+        """
+
+        self._config = config
+        if not self.enabled:
+            return
+        await self.rebuild()
+        await self._close_due()
+
+    def schedule(self, raffle_id: UUID, end_time: dt) -> None:
+        """
+        Set the time that a raffle should be closed at, replacing any time
+        that it was already scheduled for.
+        """
+
+        self._end_times[raffle_id] = end_time
+        heapq.heappush(self._heap, (end_time, raffle_id))
+        if self._wake is not None:
+            self._wake.set()
+
+    def cancel(self, raffle_id: UUID) -> None:
+        """
+        Stop a raffle from being closed.
+        """
+
+        self._end_times.pop(raffle_id, None)
+
+    async def rebuild(self) -> None:
+        """
+        Replace the heap with every raffle that still needs to be closed.
+        """
+
+        async with Database() as db:
+            rows = await db.call(
+                """
+                SELECT
+                    id,
+                    end_time
+                FROM
+                    raffles
+                WHERE
+                    closed IS FALSE
+                AND
+                    deleted IS FALSE
+                """,
+            )
+        self._end_times = {i['id']: i['end_time'] for i in rows}
+        self._heap = [(o, i) for i, o in self._end_times.items()]
+        heapq.heapify(self._heap)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        resync_at = 0.0
+        failures = 0
+        while True:
+            try:
+                if loop.time() >= resync_at:
+                    await self.rebuild()
+                    resync_at = loop.time() + self.resync_interval
+                await self._close_due()
+                failures = 0
+            except Exception:
+                log.exception("Failed to close raffles")
+                resync_at = 0.0
+                failures += 1
+
+            # Back off before trying again, doubling the wait for each
+            # failure in a row; anything that's due will still be due
+            if failures:
+                delay = self.retry_delay * 2 ** (failures - 1)
+                await asyncio.sleep(min(delay, max(self.resync_interval, self.retry_delay)))
+                continue
+
+            # Sleep until the next raffle ends, or until something's
+            # scheduled that might end sooner
+            timeout = max(resync_at - loop.time(), 1.0)
+            if self._heap:
+                until_end = (self._heap[0][0] - dt.utcnow()).total_seconds()
+                timeout = min(timeout, max(until_end, 0.0))
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _close_due(self) -> None:
+        now = dt.utcnow()
+        while self._heap and self._heap[0][0] <= now:
+            end_time, raffle_id = heapq.heappop(self._heap)
+
+            # Skip anything that's been rescheduled or cancelled since it
+            # was pushed
+            if self._end_times.get(raffle_id) != end_time:
+                continue
+            del self._end_times[raffle_id]
+            await self._close(raffle_id)
+
+    async def _close(self, raffle_id: UUID) -> None:
+        async with Database() as db:
+            closed = await close_raffle(db, raffle_id, count=self.winner_count)
+            if closed is None:
+
+                # Either someone else closed it, or the database's clock
+                # thinks that it hasn't ended yet
+                rows = await db.call(
+                    """
+                    SELECT
+                        end_time
+                    FROM
+                        raffles
+                    WHERE
+                        id = $1
+                    AND
+                        closed IS FALSE
+                    AND
+                        deleted IS FALSE
+                    """,
+                    raffle_id,
+                )
+                if rows:
+                    retry_at = dt.utcnow() + timedelta(seconds=1)
+                    self.schedule(raffle_id, max(rows[0]['end_time'], retry_at))
+                return
+        raffle_row, winners = closed
+        raffle_index.update(Raffle(data=raffle_row))
+        log.info(
+            "Closed raffle %s (%s); winners: %s"
+            % (raffle_id, raffle_row['name'], ", ".join(str(i['twitch_username']) for i in winners) or "none")
+        )
+
+
+raffle_scheduler = RaffleScheduler()
+
+
+@middleware
+async def raffle_scheduler_middleware(request: Request, handler) -> StreamResponse:
+    """
+    Make sure that the raffle scheduler is running. VBU doesn't give the
+    website's routes a startup hook, so it's started by the first request;
+    raffles that ended while the website was down are closed before it
+    starts by ``python -m cogs.utils.raffle_scheduler``.
+    """
+
+    raffle_scheduler.ensure_started(request.app['config'])
+    return await handler(request)
+
+
+async def main(config_file: str) -> None:
+    import toml
+
+    with open(config_file) as a:
+        config = toml.load(a)
+    if not config.get('database', {}).get('enabled', False):
+        return
+    await Database.create_pool(config['database'])
+    try:
+        await raffle_scheduler.close_overdue(config)
+    finally:
+        await Database.pool.close()
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig()
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "config/website.toml"))
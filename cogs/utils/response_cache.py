@@ -0,0 +1,192 @@
+from datetime import datetime as dt, timedelta
+from typing import Callable, Dict, Optional, Set
+import functools
+import hashlib
+
+from aiohttp.web import Request, Response
+
+from .metrics import Counter
+from .session_user import get_session_user
+
+
+__all__ = (
+    'CachedResponse',
+    'ResponseCache',
+    'response_cache',
+    'cache_response',
+)
+
+
+cache_requests = Counter(
+    "response_cache_requests_total",
+    "Requests to cacheable pages, by whether they were served from the cache.",
+    ("route", "result"),
+)
+
+
+def make_etag(body: bytes) -> str:
+    return '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """
+    Whether the request's ``If-None-Match`` header matches the given
+    (strong) ETag. Weak comparison is used, as the spec asks for.
+    """
+
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    for i in header.split(","):
+        i = i.strip()
+        if i == "*":
+            return True
+        if i.startswith("W/"):
+            i = i[2:]
+        if i == etag:
+            return True
+    return False
+
+
+class CachedResponse:
+    """
+    A rendered page that can be served again without being rendered.
+    """
+
+    __slots__ = (
+        'body',
+        'etag',
+        'content_type',
+        'charset',
+        'expires_at',
+    )
+
+    def __init__(self, response: Response, etag: str, expires_at: Optional[dt]):
+        self.body: bytes = response.body
+        self.etag = etag
+        self.content_type = response.content_type
+        self.charset = response.charset
+        self.expires_at = expires_at
+
+    def make_response(self, request: Request, cache_control: str) -> Response:
+        headers = {
+            "ETag": self.etag,
+            "Cache-Control": cache_control,
+            "Vary": "Cookie",
+        }
+        if etag_matches(request, self.etag):
+            return Response(status=304, headers=headers)
+        return Response(
+            body=self.body,
+            headers=headers,
+            content_type=self.content_type,
+            charset=self.charset,
+        )
+
+
+class ResponseCache:
+    """
+    An in-process cache of the rendered pages that are shown to visitors
+    who aren't logged in.
+
+    Each page is stored against some tags, and the endpoints that change
+    the data behind a page invalidate its tags. Invalidations only reach
+    the process that made the change, so pages also expire after a TTL.
+    That only limits how long this cache serves a page; the data it's
+    rendered from can be cached by the process too (eg in the raffle
+    index or the page cache), so a page can be out of date by up to the
+    TTL plus the age of that data. Pages are given an earlier expiry by
+    ``cache_response(expires_at=...)`` where the data says when it'll
+    next change or be reloaded.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, CachedResponse] = {}
+        self._tags: Dict[str, Set[str]] = {}
+        self.generation: int = 0
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        cached = self._entries.get(key)
+        if cached is None:
+            return None
+        if cached.expires_at is not None and dt.utcnow() >= cached.expires_at:
+            del self._entries[key]
+            return None
+        return cached
+
+    def set(self, key: str, cached: CachedResponse, tags: Set[str], generation: int) -> None:
+        """
+        Store a page, unless anything was invalidated since the given
+        generation (as it might have been rendered from stale data).
+        """
+
+        if generation != self.generation:
+            return
+        self._entries[key] = cached
+        for i in tags:
+            self._tags.setdefault(i, set()).add(key)
+
+    def invalidate(self, *tags: str) -> None:
+        """
+        Remove every page stored against any of the given tags.
+        """
+
+        self.generation += 1
+        for i in tags:
+            for key in self._tags.pop(i, ()):
+                self._entries.pop(key, None)
+
+
+response_cache = ResponseCache()
+
+
+def cache_response(*tags: str, expires_at: Optional[Callable[[], Optional[dt]]] = None):
+    """
+    Cache the rendered page for visitors who aren't logged in, and answer
+    conditional requests for any visitor with a ``304``.
+
+    Parameters
+    ----------
+    *tags : str
+        The tags to store the page against, for :meth:`ResponseCache.invalidate`.
+    expires_at : Optional[Callable[[], Optional[dt]]], optional
+        A function giving the (naive UTC) time that the page changes by
+        itself, if it does.
+    """
+
+    def inner(func):
+        @functools.wraps(func)
+        async def wrapper(request: Request):
+            config = request.app['config'].get('response_cache', {})
+            if not config.get('enabled', True):
+                return await func(request)
+            user = await get_session_user(request)
+            key = request.path
+            route = request.match_info.route.resource
+            route_name = route.canonical if route else key
+
+            # Serve the stored page to anyone not logged in
+            if not user:
+                cached = response_cache.get(key)
+                if cached is not None:
+                    cache_requests.inc(route=route_name, result="hit")
+                    return cached.make_response(request, "public, no-cache")
+            cache_requests.inc(route=route_name, result="miss" if not user else "bypass")
+
+            # Render it
+            generation = response_cache.generation
+            response = await func(request)
+            if not isinstance(response, Response) or response.status != 200 or not isinstance(response.body, bytes):
+                return response
+            expiry = dt.utcnow() + timedelta(seconds=config.get('ttl', 60))
+            if expires_at is not None:
+                changes_at = expires_at()
+                if changes_at is not None:
+                    expiry = min(expiry, changes_at)
+            cached = CachedResponse(response, make_etag(response.body), expiry)
+            if user:
+                return cached.make_response(request, "private, no-cache")
+            response_cache.set(key, cached, set(tags), generation)
+            return cached.make_response(request, "public, no-cache")
+        return wrapper
+    return inner
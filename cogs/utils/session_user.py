@@ -0,0 +1,163 @@
+from typing import ClassVar, Dict, Optional, Tuple
+from uuid import UUID
+import time
+
+from aiohttp.web import Request
+import aiohttp_session
+
+from .database import Database
+from .website_permissions import WebsitePermissions
+
+
+__all__ = (
+    'SessionUser',
+    'get_session_user',
+)
+
+
+class SessionUser:
+    """
+    The logged in user for a request, as stored in their session cookie.
+
+    The cookie only holds the user's ID, permission bits and Twitch
+    username, which is all that rendering a page needs. The rest of their
+    ``users`` row is only loaded from the database by the code that asks
+    for it with :func:`fetch_profile`.
+
+    Attributes
+    -----------
+    id: Optional[UUID]
+        The ID of the user, or ``None`` if nobody is logged in.
+    permissions: WebsitePermissions
+        The permissions that the user had when they logged in.
+    twitch_username: Optional[str]
+        The user's Twitch username when they logged in, if it's known.
+    profile: Optional[dict]
+        The user's row from the database, if it's been loaded with
+        :func:`fetch_profile`.
+    """
+
+    __slots__ = (
+        'id',
+        'permissions',
+        'twitch_username',
+        'profile',
+    )
+
+    SESSION_KEY: ClassVar[str] = "user"
+
+    # Profiles are cached briefly, so that a user joining several raffles
+    # doesn't need a lookup for each
+    profile_cache: ClassVar[Dict[UUID, Tuple[float, dict]]] = {}
+    profile_cache_ttl: ClassVar[float] = 60.0
+    profile_cache_max_size: ClassVar[int] = 1_000
+
+    def __init__(
+            self,
+            id: Optional[UUID] = None,
+            permissions: int = 0,
+            twitch_username: Optional[str] = None):
+        self.id: Optional[UUID] = id
+        self.permissions = WebsitePermissions(permissions)
+        self.twitch_username: Optional[str] = twitch_username
+        self.profile: Optional[dict] = None
+
+    def __bool__(self) -> bool:
+        return self.id is not None
+
+    @classmethod
+    def from_session(cls, session: aiohttp_session.Session) -> 'SessionUser':
+        """
+        Read the user out of a session. Sessions from before the cookie was
+        made compact are converted as they're read. Sessions from before
+        the username was stored in it give a user without one.
+        """
+
+        stored = session.get(cls.SESSION_KEY)
+        if stored:
+            return cls(UUID(stored[0]), stored[1], *stored[2:3])
+        # VBU's Discord login also uses "user_info", so make sure that this
+        # is one of our rows before converting it
+        legacy = session.get("user_info")
+        if legacy and legacy.get("id") and "twitch_id" in legacy:
+            user = cls(UUID(legacy['id']), legacy.get('permissions', 0), legacy.get('twitch_username'))
+            del session["user_info"]
+            user.store(session)
+            return user
+        return cls()
+
+    @classmethod
+    def login(cls, session: aiohttp_session.Session, row: dict) -> 'SessionUser':
+        """
+        Store a user from the ``users`` table in the given session.
+        """
+
+        user = cls(row['id'], row['permissions'], row['twitch_username'])
+        user.store(session)
+        user._cache_profile(dict(row))
+        return user
+
+    def store(self, session: aiohttp_session.Session) -> None:
+        session[self.SESSION_KEY] = [str(self.id), self.permissions.value, self.twitch_username]
+
+    async def fetch_profile(self, db: Optional[Database] = None) -> Optional[dict]:
+        """
+        Get the user's row from the database.
+
+        Parameters
+        ----------
+        db : Optional[Database], optional
+            An open database connection to use. If not given, a new one is
+            opened if the profile isn't cached.
+
+        Returns
+        -------
+        Optional[dict]
+            The user's data, or ``None`` if nobody is logged in.
+        """
+
+        if self.profile is not None or self.id is None:
+            return self.profile
+        cached = self.profile_cache.get(self.id)
+        if cached and cached[0] > time.monotonic():
+            self.profile = cached[1]
+            return self.profile
+        sql = """
+        SELECT
+            *
+        FROM
+            users
+        WHERE
+            id = $1
+        """
+        if db is None:
+            async with Database() as db:
+                rows = await db.call(sql, self.id)
+        else:
+            rows = await db.call(sql, self.id)
+        if rows:
+            self._cache_profile(dict(rows[0]))
+        return self.profile
+
+    def _cache_profile(self, profile: dict) -> None:
+        self.profile = profile
+        if len(self.profile_cache) >= self.profile_cache_max_size:
+            now = time.monotonic()
+            for i, o in list(self.profile_cache.items()):
+                if o[0] <= now:
+                    del self.profile_cache[i]
+        self.profile_cache[self.id] = (time.monotonic() + self.profile_cache_ttl, profile)
+
+
+async def get_session_user(request: Request) -> SessionUser:
+    """
+    Get the logged in user for a request. The session is only read once,
+    however many times this is called while handling the request.
+    """
+
+    user = request.get("session_user")
+    if user is None:
+        session = await aiohttp_session.get_session(request)
+        user = SessionUser.from_session(session)
+        request["session_user"] = user
+    return user
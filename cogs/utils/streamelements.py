@@ -1,13 +1,21 @@
-from dataclasses import dataclass
-from typing import Dict, Optional
+from dataclasses import dataclass, replace
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+import asyncio
 import logging
+import random
+import time
 
 import aiohttp
 
+from .metrics import create_trace_config
+from .token_bucket import TokenBucket
+
 
 __all__ = (
     'StreamElements',
     'UserPoints',
+    'RateLimited',
 )
 
 
@@ -25,37 +33,187 @@ class UserPoints:
     rank: int
 
 
+class RateLimited(Exception):
+    """
+    Raised when a request to StreamElements can't be sent before its
+    deadline because we're being rate limited.
+    """
+
+
 class StreamElements:
     """
     A representation of all the stream elements API endpoints.
+
+    Requests are paced by a token bucket per API token, which is shared
+    between instances. Failed GET requests are retried with jittered
+    backoff until their deadline passes.
     """
 
     BASE: str = "https://api.streamelements.com/kappa/v2{}"
     # BASE: str = "https://stoplight.io/mocks/streamelements/kappa/75539{}"
     channel_id_cache: Dict[str, str] = {}
 
-    def __init__(self, token: str, channel_id_cache: Optional[Dict[str, str]] = None):
+    # Maps tokens to their (username, channel ID); a token's channel never
+    # changes, so these are kept forever
+    token_channel_cache: Dict[str, Tuple[str, str]] = {}
+    token_channel_requests: Dict[str, asyncio.Task] = {}
+
+    # Points lookups are shared between instances; the cache maps
+    # (channel, username) to (expiry time, points)
+    points_cache: Dict[Tuple[str, str], Tuple[float, UserPoints]] = {}
+    points_requests: Dict[Tuple[str, str], asyncio.Task] = {}
+    points_cache_ttl: float = 5.0
+    points_cache_max_size: int = 1_000
+
+    # Outbound requests are paced per token
+    buckets: Dict[str, TokenBucket] = {}
+    rate_limit: float = 10.0
+    burst: int = 10
+    request_deadline: float = 5.0
+    max_retries: int = 3
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(
+            self,
+            token: str,
+            channel_id_cache: Optional[Dict[str, str]] = None,
+            *,
+            session: Optional[aiohttp.ClientSession] = None,
+            points_cache_ttl: Optional[float] = None,
+            rate_limit: Optional[float] = None,
+            burst: Optional[int] = None,
+            request_deadline: Optional[float] = None,
+            max_retries: Optional[int] = None):
         self.token = token
         self.channel_id: Optional[str] = None
         if channel_id_cache:
             self.channel_id_cache = channel_id_cache
+        if token in self.token_channel_cache:
+            self.channel_id = self.token_channel_cache[token][1]
+        self.session = session
+        if points_cache_ttl is not None:
+            self.points_cache_ttl = points_cache_ttl
+        if request_deadline is not None:
+            self.request_deadline = request_deadline
+        if max_retries is not None:
+            self.max_retries = max_retries
+        if token not in self.buckets:
+            self.buckets[token] = TokenBucket(
+                rate_limit or self.rate_limit,
+                burst or self.burst,
+            )
+        self.bucket = self.buckets[token]
 
-    async def _request(self, method: str, url: str, **kwargs):
+    async def _request(self, method: str, url: str, *, route: Optional[str] = None, **kwargs):
         headers = {
             "Authorization": f"Bearer {self.token}",
             "Accept": "application/json",
         }
         log.info("Performing %s %s with %s" % (method, url, kwargs))
-        async with aiohttp.ClientSession() as session:
-            async with session.request(
-                    method,
-                    self.BASE.format(url),
-                    json=kwargs or None,
-                    headers=headers) as r:
-                r.raise_for_status()
+        deadline = time.monotonic() + self.request_deadline
+        attempt = 0
+        while True:
+            if not await self.bucket.acquire(deadline):
+                raise RateLimited()
+            attempt += 1
+            try:
+                if self.session is None:
+                    async with aiohttp.ClientSession(trace_configs=[create_trace_config()]) as session:
+                        r, d = await self._send(session, method, url, route, headers, kwargs)
+                else:
+                    r, d = await self._send(self.session, method, url, route, headers, kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error: Exception = e
+                retry_after = 0.0
+            else:
+                log.info("Returned %s %s %s %s" % (method, url, r.status, d))
+                retry_after = self._read_rate_limit_headers(r.headers)
+                if r.ok:
+                    return d
+                if r.status == 429:
+                    error = RateLimited()
+                else:
+                    error = aiohttp.ClientResponseError(
+                        r.request_info,
+                        r.history,
+                        status=r.status,
+                        message=r.reason or "",
+                        headers=r.headers,
+                    )
+                if r.status not in self.RETRY_STATUSES:
+                    raise error
+
+            # Only GETs are safe to send twice
+            if method != "GET" or attempt > self.max_retries:
+                raise error
+
+            # Back off before trying again, as long as there's time
+            delay = max(random.uniform(0, min(2.0, 0.1 * 2 ** attempt)), retry_after)
+            if time.monotonic() + delay > deadline:
+                raise error
+            log.info("Retrying %s %s in %.2fs" % (method, url, delay))
+            await asyncio.sleep(delay)
+
+    def _read_rate_limit_headers(self, headers) -> float:
+        """
+        Update the bucket from the rate limit headers of a response,
+        returning the number of seconds we've been asked to wait for.
+        """
+
+        retry_after = 0.0
+        if headers.get("Retry-After"):
+            value = headers["Retry-After"]
+            try:
+                retry_after = float(value)
+            except ValueError:
+                try:
+                    retry_after = parsedate_to_datetime(value).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    pass
+        if headers.get("X-RateLimit-Remaining"):
+            try:
+                remaining = int(headers["X-RateLimit-Remaining"])
+            except ValueError:
+                remaining = None
+            if remaining is not None:
+                self.bucket.limit_remaining(remaining)
+            if remaining == 0 and headers.get("X-RateLimit-Reset"):
+                try:
+                    reset = float(headers["X-RateLimit-Reset"])
+                except ValueError:
+                    reset = 0.0
+                if reset > 1e12:  # Epoch milliseconds
+                    reset = reset / 1_000 - time.time()
+                elif reset > 1e9:  # Epoch seconds
+                    reset = reset - time.time()
+                retry_after = max(retry_after, reset)
+        if retry_after > 0:
+            self.bucket.pause(retry_after)
+        return max(retry_after, 0.0)
+
+    async def _send(
+            self,
+            session: aiohttp.ClientSession,
+            method: str,
+            url: str,
+            route: Optional[str],
+            headers: dict,
+            payload: dict):
+        trace_request_ctx = {
+            "upstream": "streamelements",
+            "route": route or url,
+        }
+        async with session.request(
+                method,
+                self.BASE.format(url),
+                json=payload or None,
+                headers=headers,
+                trace_request_ctx=trace_request_ctx) as r:
+            if r.ok:
                 d = await r.json()
-        log.info("Returned %s %s %s %s" % (method, url, r.status, d))
-        return d
+            else:
+                d = await r.text()
+        return r, d
 
     async def get_channel_id(self) -> str:
         """
@@ -64,11 +222,51 @@ class StreamElements:
 
         if self.channel_id:
             return self.channel_id
-        data = await self._request("GET", "/channels/me")
-        self.channel_id = data['_id']
-        self.channel_id_cache[data['username']] = self.channel_id
+        _, self.channel_id = await self.get_channel()
         return self.channel_id
 
+    async def get_channel(self) -> Tuple[str, str]:
+        """
+        Get the username and ID of the channel for the current token. This
+        is only asked for once per token; concurrent calls share a request.
+
+        Returns
+        -------
+        Tuple[str, str]
+            The username and ID of the channel.
+        """
+
+        if self.token in self.token_channel_cache:
+            return self.token_channel_cache[self.token]
+        task = self.token_channel_requests.get(self.token)
+        if task is None:
+            task = asyncio.create_task(self._request("GET", "/channels/me"))
+            self.token_channel_requests[self.token] = task
+        try:
+            data = await asyncio.shield(task)
+        finally:
+            if task.done():
+                self.token_channel_requests.pop(self.token, None)
+        self.cache_channel(data['username'], data['_id'])
+        return self.token_channel_cache[self.token]
+
+    def cache_channel(self, username: str, channel_id: str) -> None:
+        """
+        Store the channel for the current token, eg when it's been loaded
+        from somewhere other than the API.
+
+        Parameters
+        ----------
+        username : str
+            The username of the channel.
+        channel_id : str
+            The ID of the channel.
+        """
+
+        self.channel_id = channel_id
+        self.channel_id_cache[username] = channel_id
+        self.token_channel_cache[self.token] = (username, channel_id)
+
     async def get_user_points(
             self,
             *,
@@ -77,6 +275,9 @@ class StreamElements:
         """
         Get the number of points a user has for a given channel.
 
+        Concurrent lookups for the same user share a single request, and
+        the result is cached for :attr:`points_cache_ttl` seconds.
+
         Parameters
         ----------
         channel : Optional[str], optional
@@ -94,15 +295,51 @@ class StreamElements:
 
         if channel is None:
             channel = await self.get_channel_id()
-        data = await self._request("GET", f"/points/{channel}/{user}")
-        return UserPoints(**data)
+        key = (channel, user.lower())
+        cached = self.points_cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        task = self.points_requests.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch_user_points(channel, user))
+            self.points_requests[key] = task
+        return await asyncio.shield(task)
+
+    async def _fetch_user_points(self, channel: str, user: str) -> UserPoints:
+        key = (channel, user.lower())
+        task = asyncio.current_task()
+        try:
+            data = await self._request(
+                "GET",
+                f"/points/{channel}/{user}",
+                route="/points/{channel}/{user}",
+            )
+        finally:
+
+            # If the points were changed while we were waiting then
+            # this request has been replaced, and its data is stale
+            superseded = self.points_requests.get(key) is not task
+            if not superseded:
+                del self.points_requests[key]
+        points = UserPoints(**data)
+        if not superseded:
+            self._cache_points(key, points, time.monotonic() + self.points_cache_ttl)
+        return points
+
+    def _cache_points(self, key: Tuple[str, str], points: UserPoints, expires_at: float) -> None:
+        if len(self.points_cache) >= self.points_cache_max_size:
+            now = time.monotonic()
+            for i, o in list(self.points_cache.items()):
+                if o[0] <= now:
+                    del self.points_cache[i]
+        self.points_cache[key] = (expires_at, points)
 
     async def modify_user_points(
             self,
             *,
             channel: Optional[str] = None,
             user: str,
-            amount: int) -> None:
+            amount: int) -> Optional[int]:
         """
         Modify the number of points that a user has.
 
@@ -116,8 +353,36 @@ class StreamElements:
             The username of the user you want to modify.
         amount : int
             The number of points you want to change them by.
+
+        Returns
+        -------
+        Optional[int]
+            The user's new number of points, if StreamElements gave it.
         """
 
         if channel is None:
             channel = await self.get_channel_id()
-        await self._request("PUT", f"/points/{channel}/{user}/{amount}")
+        data = await self._request(
+            "PUT",
+            f"/points/{channel}/{user}/{amount}",
+            route="/points/{channel}/{user}/{amount}",
+        )
+
+        new_amount = None
+        if isinstance(data, dict) and data.get("newAmount") is not None:
+            new_amount = data["newAmount"]
+
+        # Update our cached points to match
+        key = (channel, user.lower())
+        self.points_requests.pop(key, None)
+        cached = self.points_cache.get(key)
+        if cached is None:
+            return new_amount
+        expires_at, points = cached
+        if new_amount is not None:
+            points = replace(points, points=new_amount)
+            expires_at = time.monotonic() + self.points_cache_ttl
+        else:
+            points = replace(points, points=points.points + amount)
+        self._cache_points(key, points, expires_at)
+        return new_amount
@@ -0,0 +1,120 @@
+from contextvars import ContextVar
+from typing import Dict, Optional
+import logging
+import time
+
+from aiohttp.web import Request, StreamResponse, middleware
+
+from .metrics import Histogram
+
+
+__all__ = (
+    'RequestTimings',
+    'current_timings',
+    'timing_middleware',
+)
+
+
+log = logging.getLogger("timing")
+
+
+request_duration = Histogram(
+    "http_request_duration_seconds",
+    "Time taken to handle requests to the website.",
+    ("route", "method"),
+)
+
+
+class RequestTimings:
+    """
+    A breakdown of where the time handling a single request went.
+
+    Attributes
+    -----------
+    start: float
+        The ``time.perf_counter()`` value at the start of the request.
+    durations: Dict[str, float]
+        The total time spent on each part of the request, in seconds.
+    counts: Dict[str, int]
+        The number of times each part was recorded.
+    view_end: Optional[float]
+        When the view function returned, if the request was for a
+        template page. Anything after this is template rendering.
+    slow_query_threshold: float
+        How long, in seconds, a database query can take before it's
+        logged as slow.
+    """
+
+    __slots__ = (
+        'start',
+        'durations',
+        'counts',
+        'view_end',
+        'slow_query_threshold',
+    )
+
+    def __init__(self, *, slow_query_threshold: float = 0.1):
+        self.start: float = time.perf_counter()
+        self.durations: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.view_end: Optional[float] = None
+        self.slow_query_threshold = slow_query_threshold
+
+    def add(self, name: str, duration: float) -> None:
+        self.durations[name] = self.durations.get(name, 0.0) + duration
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def header(self) -> str:
+        """
+        Format the timings as a ``Server-Timing`` header value.
+        """
+
+        parts = []
+        for name, duration in self.durations.items():
+            part = "%s;dur=%.2f" % (name, duration * 1_000)
+            if self.counts[name] > 1:
+                part += ';desc="%sx"' % self.counts[name]
+            parts.append(part)
+        return ", ".join(parts)
+
+
+current_timings: ContextVar[Optional[RequestTimings]] = ContextVar("current_timings", default=None)
+
+
+@middleware
+async def timing_middleware(request: Request, handler) -> StreamResponse:
+    """
+    Time each request, adding the breakdown as a ``Server-Timing`` header.
+    Responses that were streamed by the handler aren't timed.
+    """
+
+    threshold = request.app['config'].get('database', {}).get('slow_query_threshold', 0.1)
+    timings = RequestTimings(slow_query_threshold=threshold)
+    token = current_timings.set(timings)
+    try:
+        response = await handler(request)
+    finally:
+        current_timings.reset(token)
+
+    # Streamed responses (such as the live entry counts) have sent their
+    # headers already, and took as long as the client stayed connected
+    # rather than as long as the request took to handle, so they're left
+    # out of both the header and the request durations
+    if response.prepared:
+        return response
+    end = time.perf_counter()
+    if timings.view_end is not None:
+        timings.add("view", timings.view_end - timings.start)
+        timings.add("render", end - timings.view_end)
+    timings.add("total", end - timings.start)
+
+    # Store the overall time against the route, rather than the path
+    route = request.match_info.route.resource
+    request_duration.observe(
+        end - timings.start,
+        route=route.canonical if route else "",
+        method=request.method,
+    )
+    response.headers["Server-Timing"] = timings.header()
+    log.debug("%s %s: %s" % (request.method, request.path, response.headers["Server-Timing"]))
+    return response
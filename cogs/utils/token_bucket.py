@@ -0,0 +1,95 @@
+from typing import Optional
+import asyncio
+import time
+
+
+__all__ = (
+    'TokenBucket',
+)
+
+
+class TokenBucket:
+    """
+    A token bucket for pacing outbound requests to an API.
+
+    Tokens are added at :attr:`rate` per second, up to :attr:`capacity`.
+    Callers that can't get a token straight away reserve one and wait their
+    turn, so queued requests are sent in order at a steady rate rather than
+    all at once.
+
+    Attributes
+    -----------
+    rate: float
+        The number of tokens added per second.
+    capacity: float
+        The maximum number of tokens that can be stored up for a burst.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens: float = capacity
+        self.updated: float = time.monotonic()
+        self.paused_until: float = 0.0
+
+    def _refill(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return now
+
+    async def acquire(self, deadline: Optional[float] = None) -> bool:
+        """
+        Take a token from the bucket, waiting for one if necessary.
+
+        Parameters
+        ----------
+        deadline : Optional[float], optional
+            The monotonic time by which a token needs to be available. If
+            one won't be available by then, no token is taken.
+
+        Returns
+        -------
+        bool
+            Whether or not a token was taken.
+        """
+
+        now = self._refill()
+        wait = max(
+            self.paused_until - now,
+            (1 - self.tokens) / self.rate,
+            0,
+        )
+        if deadline is not None and now + wait > deadline:
+            return False
+        self.tokens -= 1
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return True
+
+    def pause(self, seconds: float) -> None:
+        """
+        Stop handing out tokens for a given amount of time, eg when the API
+        has told us to back off.
+
+        Parameters
+        ----------
+        seconds : float
+            The number of seconds to pause for.
+        """
+
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def limit_remaining(self, remaining: int) -> None:
+        """
+        Make sure the bucket doesn't hold more tokens than the API says we
+        have left.
+
+        Parameters
+        ----------
+        remaining : int
+            The number of requests the API says are remaining.
+        """
+
+        self._refill()
+        self.tokens = min(self.tokens, remaining)
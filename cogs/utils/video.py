@@ -1,8 +1,13 @@
-from datetime import datetime as dt
+from datetime import datetime as dt, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from operator import attrgetter
+import heapq
+import itertools
 
 
 __all__ = (
     'Video',
+    'VideoCollection',
 )
 
 
@@ -11,55 +16,143 @@ class Video:
     A container class for YouTube playlist items. Sort of.
     This entirely ignores that they're only partial items and instead
     pretends they're whole videos.
+
+    Videos are immutable once they're created; their publish time is
+    parsed and their JSON built only once.
     """
 
     __slots__ = (
         'playlist_video_id',
-        '_published_at',
+        'published_at',
         'title',
         'description',
         'channel_id',
         'channel',
         'id',
         'thumbnail',
+        '_json',
     )
 
     def __init__(self, *, data: dict):
-        self.playlist_video_id = data['id']
-        self._published_at = data['contentDetails']['videoPublishedAt']
-        self.title = data['snippet']['title']
-        self.description = data['snippet']['description']
-        self.channel_id = data['snippet']['channelId']
-        self.channel = data['snippet']['channelTitle']
-        self.id = data['contentDetails']['videoId']
+        snippet = data['snippet']
+        content_details = data['contentDetails']
+        published_at = dt.strptime(content_details['videoPublishedAt'], "%Y-%m-%dT%H:%M:%SZ")  # 2011-11-22T15:29:40Z
         try:
-            thumbnails = data['snippet']['thumbnails']
+            thumbnails = snippet['thumbnails']
             if "maxres" in thumbnails:
-                self.thumbnail = thumbnails['maxres']['url']
+                thumbnail = thumbnails['maxres']['url']
             # elif "standard" in thumbnails:
-            #     self.thumbnail = thumbnails['standard']['url']
+            #     thumbnail = thumbnails['standard']['url']
             # elif "high" in thumbnails:
-            #     self.thumbnail = thumbnails['high']['url']
+            #     thumbnail = thumbnails['high']['url']
             elif "medium" in thumbnails:
-                self.thumbnail = thumbnails['medium']['url']
+                thumbnail = thumbnails['medium']['url']
             else:
-                self.thumbnail = thumbnails['default']['url']
-        except IndexError:
-            self.thumbnail = ""
-    
-    @property
-    def published_at(self) -> float:
-        v = dt.strptime(self._published_at, "%Y-%m-%dT%H:%M:%SZ")  # 2011-11-22T15:29:40Z
-        return v.timestamp()
+                thumbnail = thumbnails['default']['url']
+        except (IndexError, KeyError):
+            thumbnail = ""
+        set_ = super().__setattr__
+        set_('playlist_video_id', data['id'])
+        set_('published_at', published_at.replace(tzinfo=timezone.utc).timestamp())
+        set_('title', snippet['title'])
+        set_('description', snippet['description'])
+        set_('channel_id', snippet['channelId'])
+        set_('channel', snippet['channelTitle'])
+        set_('id', content_details['videoId'])
+        set_('thumbnail', thumbnail)
+        set_('_json', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{self.__class__.__name__} objects are immutable")
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} id={self.id!r} title={self.title!r}>"
 
     def to_json(self) -> dict:
-        return {
-            "playlist_video_id": self.playlist_video_id,
-            "published_at": self.published_at,
-            "title": self.title,
-            "description": self.description,
-            "channel_id": self.channel_id,
-            "channel": self.channel,
-            "id": self.id,
-        }
-    
+        """
+        Get the video as a JSON-safe dict. This is built the first time
+        it's asked for, and the same dict is returned after that, so it
+        shouldn't be changed.
+        """
+
+        if self._json is None:
+            super().__setattr__('_json', {
+                "playlist_video_id": self.playlist_video_id,
+                "published_at": self.published_at,
+                "title": self.title,
+                "description": self.description,
+                "channel_id": self.channel_id,
+                "channel": self.channel,
+                "id": self.id,
+            })
+        return self._json
+
+
+class VideoCollection:
+    """
+    An immutable list of videos, newest first, with no video appearing
+    more than once.
+    """
+
+    __slots__ = (
+        'videos',
+        '_json',
+    )
+
+    def __init__(self, videos: Iterable[Video] = ()):
+        self.videos: Tuple[Video, ...] = tuple(videos)
+        self._json: Optional[List[dict]] = None
+
+    @classmethod
+    def merge(
+            cls,
+            playlists: Iterable[Iterable[Video]],
+            *,
+            limit: Optional[int] = None) -> 'VideoCollection':
+        """
+        Merge several lists of videos together, newest first, dropping any
+        video that's already been seen in a previous list.
+
+        Parameters
+        ----------
+        playlists : Iterable[Iterable[Video]]
+            The lists of videos to merge. They don't need to be sorted.
+        limit : Optional[int], optional
+            The maximum number of videos to keep. If not provided, all of
+            the videos are kept.
+
+        Returns
+        -------
+        VideoCollection
+            The merged videos.
+        """
+
+        # A video's publish time is the same in every playlist that it's
+        # in, so the first copy of it can be kept
+        unique: Dict[str, Video] = {}
+        for i in itertools.chain.from_iterable(playlists):
+            unique.setdefault(i.id, i)
+
+        # Only the newest videos are needed, so there's no need to sort
+        # all of them
+        key = attrgetter('published_at')
+        if limit is None:
+            return cls(sorted(unique.values(), key=key, reverse=True))
+        return cls(heapq.nlargest(limit, unique.values(), key=key))
+
+    def __iter__(self) -> Iterator[Video]:
+        return iter(self.videos)
+
+    def __len__(self) -> int:
+        return len(self.videos)
+
+    def __getitem__(self, index):
+        return self.videos[index]
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} videos={len(self.videos)}>"
+
+    def to_json(self) -> List[dict]:
+        if self._json is None:
+            self._json = [i.to_json() for i in self.videos]
+        return self._json
@@ -0,0 +1,124 @@
+from typing import Awaitable, Callable, Optional
+import asyncio
+import logging
+import time
+
+from .video import VideoCollection
+
+
+__all__ = (
+    'VideoCache',
+)
+
+
+log = logging.getLogger("video_cache")
+log.setLevel(logging.INFO)
+
+
+class VideoCache:
+    """
+    An app-wide, stale-while-revalidate cache of the videos shown on the
+    videos page.
+
+    The first call to :meth:`get` fetches the videos and starts a
+    background task that refreshes them shortly before they expire. If a
+    refresh fails, the previous videos carry on being served until one
+    succeeds. Concurrent callers share a single fetch (and its error), and
+    if the videos have never been fetched, requests don't try again until
+    ``cache_retry_delay`` seconds after a failure, serving no videos in the
+    meantime.
+
+    Attributes
+    -----------
+    fetch: Callable[[dict], Awaitable[VideoCollection]]
+        The coroutine used to get a fresh list of videos. It's passed the
+        website config.
+    videos: Optional[VideoCollection]
+        The cached videos, or ``None`` if they've never been fetched.
+    fetched_at: float
+        The monotonic time that the videos were last fetched at.
+    """
+
+    def __init__(self, fetch: Callable[[dict], Awaitable[VideoCollection]]):
+        self.fetch = fetch
+        self.videos: Optional[VideoCollection] = None
+        self.fetched_at: float = 0.0
+        self._config: dict = {}
+        self._retry_at: float = 0.0
+        self._refreshing: Optional[asyncio.Task] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ttl(self) -> float:
+        return float(self._config.get('google', {}).get('cache_ttl', 600))
+
+    @property
+    def retry_delay(self) -> float:
+        return float(self._config.get('google', {}).get('cache_retry_delay', 30))
+
+    @property
+    def refresh_at(self) -> float:
+        """
+        The monotonic time that the background task should refresh at;
+        80% of the way through the TTL.
+        """
+
+        return self.fetched_at + (self.ttl * 0.8)
+
+    async def get(self, config: dict) -> VideoCollection:
+        """
+        Get the cached videos. This only waits on the API if the cache has
+        never been filled, and the last attempt to fill it didn't just fail.
+
+        Parameters
+        ----------
+        config : dict
+            The website config.
+
+        Returns
+        -------
+        VideoCollection
+            The cached videos.
+        """
+
+        self._config = config
+        if self.videos is None and time.monotonic() >= self._retry_at:
+            try:
+                await self.refresh()
+            except Exception:
+                pass  # Logged by the refresh
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._refresh_loop())
+        return self.videos or VideoCollection()
+
+    async def refresh(self) -> None:
+        """
+        Fetch a fresh list of videos and store it. Concurrent calls share
+        a single fetch, and get its error if it fails.
+        """
+
+        if self._refreshing is None:
+            self._refreshing = asyncio.create_task(self._refresh())
+        await asyncio.shield(self._refreshing)
+
+    async def _refresh(self) -> None:
+        try:
+            videos = await self.fetch(self._config)
+        except Exception:
+            log.exception("Failed to fetch videos")
+            self._retry_at = time.monotonic() + self.retry_delay
+            raise
+        finally:
+            self._refreshing = None
+        self.videos = videos
+        self.fetched_at = time.monotonic()
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(max(self.refresh_at - time.monotonic(), 0))
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                await asyncio.sleep(max(self._retry_at - time.monotonic(), 0))
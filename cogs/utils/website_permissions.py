@@ -8,6 +8,8 @@ __all__ = (
 
 class WebsitePermissions(Flags):
 
+    __slots__ = ()
+
     @flag_value
     def admin_panel(self):
         return 0b000_001
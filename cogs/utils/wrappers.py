@@ -1,26 +1,80 @@
 from typing import Union
+import functools
+import time
 
-from aiohttp.web import HTTPFound, Request, Response
+from aiohttp.web import HTTPFound, Request, Response, RouteTableDef
 import aiohttp_session
 
+from .assets import install_asset_globals
+from .image_proxy import install_image_proxy_globals
+from .session_user import get_session_user
+from .timing import current_timings
 from .website_permissions import WebsitePermissions
 
 
 __all__ = (
     'add_standard_args',
     'requires_permission',
+    'MiddlewareRouteTableDef',
 )
 
 
+class MiddlewareRouteTableDef(RouteTableDef):
+    """
+    A route table that runs every handler added to it through a set of
+    aiohttp middlewares.
+
+    The website's app is built by VBU, so there's no way to add
+    middlewares to it directly; this gives the same effect per route.
+    """
+
+    def __init__(self, *middlewares):
+        super().__init__()
+        self.middlewares = middlewares
+
+    def route(self, method: str, path: str, **kwargs):
+        register = super().route(method, path, **kwargs)
+
+        def inner(handler):
+            wrapped = handler
+            for m in reversed(self.middlewares):
+                wrapped = self._apply_middleware(m, wrapped)
+            register(functools.wraps(handler)(wrapped))
+            return handler
+        return inner
+
+    @staticmethod
+    def _apply_middleware(middleware, handler):
+        async def wrapper(request: Request):
+            return await middleware(request, handler)
+        return wrapper
+
+
 def add_standard_args():
     def inner(func):
         async def wrapper(request: Request):
             d: Union[None, Response, dict] = await func(request)
+            timings = current_timings.get()
+            if timings is not None:
+                timings.view_end = time.perf_counter()
             if d is None:
                 d = {}
             elif isinstance(d, Response):
                 return d
-            d['session'] = await aiohttp_session.get_session(request)
+            install_asset_globals(request)
+            install_image_proxy_globals(request)
+            user = await get_session_user(request)
+            session = await aiohttp_session.get_session(request)
+
+            # Pages only need the username, which is in the cookie; older
+            # cookies without it are filled in once and then stored
+            if user and user.twitch_username is None:
+                profile = await user.fetch_profile()
+                if profile:
+                    user.twitch_username = profile['twitch_username']
+                    user.store(session)
+            d['session'] = session
+            d['user'] = user
             d['request'] = request
             return d
         return wrapper
@@ -28,19 +82,15 @@ def add_standard_args():
 
 
 def requires_permission(**kwargs):
+    mask, expected = WebsitePermissions.compile(**kwargs)
+
     def inner(func):
         async def wrapper(request: Request):
-            session = await aiohttp_session.get_session(request)
-            user_info = session.get('user_info', {})
-            permissions_int = user_info.get('permissions', 0)
-            permissions = WebsitePermissions(permissions_int)
-            for i, o in kwargs.items():
-                if getattr(permissions, i) == o:
-                    pass
-                else:
-                    if user_info:
-                        return HTTPFound("/")
-                    return HTTPFound("/login")
+            user = await get_session_user(request)
+            if user.permissions.value & mask != expected:
+                if user:
+                    return HTTPFound("/")
+                return HTTPFound("/login")
             return await func(request)
         return wrapper
     return inner
@@ -0,0 +1,89 @@
+"""
+Helpers shared by the benchmark scripts in this directory. Run any of
+them from the repository root, eg ``python -m scripts.bench_raffle_draw``.
+
+The benchmarks that need a database use ``TCK_TEST_DATABASE_URL``, like
+the tests do, and create (then drop) their own database on that server.
+"""
+
+from typing import Awaitable, Callable, Optional
+import contextlib
+import os
+import time
+import uuid
+
+import asyncpg
+
+
+__all__ = (
+    'DATABASE_URL',
+    'time_sync',
+    'time_async',
+    'report',
+    'temporary_database',
+)
+
+
+DATABASE_URL: Optional[str] = os.environ.get("TCK_TEST_DATABASE_URL")
+
+
+def time_sync(func: Callable[[], object], *, number: int, repeat: int = 5) -> float:
+    """
+    Get the best average time of a call to a function, in seconds.
+    """
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+async def time_async(func: Callable[[], Awaitable[object]], *, number: int, repeat: int = 5) -> float:
+    """
+    Get the best average time of an awaited call to a coroutine function,
+    in seconds.
+    """
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            await func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def report(name: str, before: float, after: float) -> None:
+    """
+    Print the time taken by the old and new versions of something.
+    """
+
+    print(
+        "%-40s before %10.1fus  after %10.1fus  (%.1fx)"
+        % (name, before * 1e6, after * 1e6, before / after)
+    )
+
+
+@contextlib.asynccontextmanager
+async def temporary_database(url: str):
+    """
+    Create a migrated database to benchmark against, yielding a connection
+    to it, and drop it afterwards.
+    """
+
+    from tests.conftest import connect, create_database, drop_database, parse_database_url
+
+    server = parse_database_url(url)
+    name = f"tck_bench_{uuid.uuid4().hex[:12]}"
+    await create_database(server, name)
+    try:
+        conn: asyncpg.Connection = await connect({**server, "database": name})
+        try:
+            yield conn
+        finally:
+            await conn.close()
+    finally:
+        await drop_database(server, name)
@@ -0,0 +1,81 @@
+"""
+Compare building a JSON API response the old way (encode each row to a
+string, parse it back, then encode the response again) against
+:func:`cogs.utils.json_response`, which serializes in one pass.
+
+    python -m scripts.bench_json
+"""
+
+from datetime import datetime as dt, timedelta
+from typing import Any
+import json
+import uuid
+
+from aiohttp.web import json_response as aiohttp_json_response
+
+from cogs.utils import json_encoder
+from cogs.utils.json_encoder import HTTPEncoder, json_response
+
+from ._bench import report, time_sync
+
+
+ROW_COUNTS = (1, 50, 1_000)
+
+
+def old_json_encode(item: Any) -> Any:
+    return json.loads(json.dumps(item, cls=HTTPEncoder))
+
+
+def old_response(rows):
+    return aiohttp_json_response(
+        {
+            "message": "",
+            "data": old_json_encode([dict(i) for i in rows]),
+        },
+        dumps=HTTPEncoder().encode,
+    )
+
+
+def new_response(rows):
+    return json_response({
+        "message": "",
+        "data": rows,
+    })
+
+
+def make_rows(count: int):
+    now = dt.utcnow()
+    return [
+        {
+            "id": uuid.uuid4(),
+            "raffle_id": uuid.uuid4(),
+            "user_id": uuid.uuid4(),
+            "entry_time": now - timedelta(seconds=i),
+            "count": i,
+        }
+        for i in range(count)
+    ]
+
+
+def bench() -> None:
+    for count in ROW_COUNTS:
+        rows = make_rows(count)
+        assert json.loads(old_response(rows).text) == json.loads(new_response(rows).body)
+        number = max(10_000 // count, 10)
+        before = time_sync(lambda: old_response(rows), number=number)
+        after = time_sync(lambda: new_response(rows), number=number)
+        report("%s row(s)" % f"{count:,}", before, after)
+
+
+def main() -> None:
+    if json_encoder.orjson is not None:
+        print("With orjson:")
+        bench()
+        json_encoder.orjson = None
+        print()
+    print("With the standard library:")
+    bench()
+
+
+if __name__ == "__main__":
+    main()
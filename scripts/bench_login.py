@@ -0,0 +1,168 @@
+"""
+Compare a returning user's Twitch login the old way against the new one.
+
+* The OAuth calls used to open a new ``ClientSession`` (and so a new
+  connection) per login; they now go through the pooled
+  :class:`cogs.utils.HTTPClient` session. Twitch is stood in for by a
+  local server, so this leaves out the TLS handshake that a new
+  connection to Twitch would also pay for.
+* The user used to be stored with an INSERT that failed with a
+  ``UniqueViolationError``, and then a SELECT; it's now one upsert. This
+  part needs ``TCK_TEST_DATABASE_URL``; see ``scripts/_bench.py``. The
+  saving is one round trip to the database, so it's small against a
+  local server and grows with the network latency to a remote one.
+
+    python -m scripts.bench_login
+"""
+
+import asyncio
+
+import aiohttp
+from aiohttp import web
+import asyncpg
+
+from cogs.utils.http_client import HTTPClient
+from cogs.utils.metrics import create_trace_config
+
+from ._bench import DATABASE_URL, report, temporary_database, time_async
+
+
+LOGINS = 500
+
+
+OLD_INSERT = """
+INSERT INTO
+    users
+    (
+        id,
+        twitch_id,
+        twitch_username
+    )
+VALUES
+    (
+        uuid_generate_v4(),  -- uuid
+        $1,  -- twitch id
+        $2  -- twitch username
+    )
+RETURNING
+    *
+"""
+
+
+OLD_SELECT = """
+SELECT
+    *
+FROM
+    users
+WHERE
+    twitch_id = $1
+"""
+
+
+NEW_UPSERT = """
+INSERT INTO
+    users
+    (
+        id,
+        twitch_id,
+        twitch_username
+    )
+VALUES
+    (
+        uuid_generate_v4(),  -- uuid
+        $1,  -- twitch id
+        $2  -- twitch username
+    )
+ON CONFLICT
+    (twitch_id)
+DO UPDATE
+SET
+    twitch_username = EXCLUDED.twitch_username
+RETURNING
+    *
+"""
+
+
+async def start_fake_twitch() -> web.AppRunner:
+    """
+    Run a local server that answers the token and validate endpoints.
+    """
+
+    async def token(request: web.Request):
+        await request.post()
+        return web.json_response({"access_token": "token"})
+
+    async def validate(request: web.Request):
+        return web.json_response({"user_id": "1", "login": "user"})
+
+    app = web.Application()
+    app.router.add_post("/oauth2/token", token)
+    app.router.add_get("/oauth2/validate", validate)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    return runner
+
+
+async def oauth_calls(session: aiohttp.ClientSession, base_url: str) -> dict:
+    async with session.post(base_url + "/oauth2/token", data={"code": "code"}) as site:
+        auth_data = await site.json()
+    headers = {"Authorization": f"Bearer {auth_data['access_token']}"}
+    async with session.get(base_url + "/oauth2/validate", headers=headers) as site:
+        return await site.json()
+
+
+async def bench_oauth() -> None:
+    runner = await start_fake_twitch()
+    port = runner.addresses[0][1]
+    base_url = f"http://127.0.0.1:{port}"
+
+    async def old_login():
+        async with aiohttp.ClientSession(trace_configs=[create_trace_config()]) as session:
+            await oauth_calls(session, base_url)
+
+    async def new_login():
+        await oauth_calls(HTTPClient.get_session(), base_url)
+
+    try:
+        before = await time_async(old_login, number=LOGINS)
+        after = await time_async(new_login, number=LOGINS)
+        report("OAuth calls (local server)", before, after)
+    finally:
+        await HTTPClient.close()
+        await runner.cleanup()
+
+
+async def bench_database() -> None:
+    async with temporary_database(DATABASE_URL) as conn:
+        await conn.execute(NEW_UPSERT, "1", "user")
+
+        async def old_store():
+            try:
+                await conn.fetch(OLD_INSERT, "1", "user")
+            except asyncpg.UniqueViolationError:
+                await conn.fetch(OLD_SELECT, "1")
+
+        async def new_store():
+            await conn.fetch(NEW_UPSERT, "1", "user")
+
+        before = await time_async(old_store, number=LOGINS)
+        after = await time_async(new_store, number=LOGINS)
+        report("Storing a returning user", before, after)
+
+
+async def bench() -> None:
+    print("Returning user logins:")
+    await bench_oauth()
+    if DATABASE_URL:
+        await bench_database()
+    else:
+        print("Set TCK_TEST_DATABASE_URL to compare storing the user too.")
+
+
+def main() -> None:
+    asyncio.run(bench())
+
+
+if __name__ == "__main__":
+    main()
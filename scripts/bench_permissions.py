@@ -0,0 +1,86 @@
+"""
+Compare the permission check that ``requires_permission`` used to run on
+every request (build a ``WebsitePermissions`` and ``getattr`` each
+required flag) against the bitmask it compiles now.
+
+    python -m scripts.bench_permissions
+"""
+
+from typing import Dict
+
+from cogs.utils.website_permissions import WebsitePermissions
+
+from ._bench import time_sync
+
+
+CHECKS = 1_000_000
+
+
+class legacy_flag_value:
+
+    def __init__(self, func):
+        self.name = func.__name__
+        self.value = func(None)
+
+    def __get__(self, instance, cls) -> bool:
+        return bool(instance.value & self.value)
+
+    def __call__(self, instance):
+        return self.value
+
+
+class LegacyFlags:
+    """
+    The flags class as it was before flag tables were built at class
+    creation.
+    """
+
+    VALID_FLAGS: Dict[str, int] = {
+    }
+
+    def __new__(cls, *args, **kwargs):
+        for i, o in cls.__dict__.items():
+            if isinstance(o, legacy_flag_value):
+                cls.VALID_FLAGS[i] = o(None)
+        return super().__new__(cls)
+
+    def __init__(self, value: int = 0, **kwargs):
+        self.value = value
+        for i, o in kwargs.items():
+            setattr(self, i, o)
+
+
+class LegacyWebsitePermissions(LegacyFlags):
+
+    @legacy_flag_value
+    def admin_panel(self):
+        return 0b000_001
+
+
+def old_check(permissions_int: int, required: dict) -> bool:
+    permissions = LegacyWebsitePermissions(permissions_int)
+    for i, o in required.items():
+        if getattr(permissions, i) != o:
+            return False
+    return True
+
+
+def main() -> None:
+    required = {"admin_panel": True}
+    mask, expected = WebsitePermissions.compile(**required)
+    user_permissions = WebsitePermissions(1)
+    for value in (0, 1):
+        assert old_check(value, required) == (WebsitePermissions(value).value & mask == expected)
+
+    before = time_sync(lambda: old_check(1, required), number=CHECKS, repeat=3)
+    after = time_sync(lambda: user_permissions.value & mask == expected, number=CHECKS, repeat=3)
+    print("%-40s %12s checks/s" % ("Before (build flags + getattr)", f"{1 / before:,.0f}"))
+    print("%-40s %12s checks/s  (%.1fx)" % ("After (compiled bitmask)", f"{1 / after:,.0f}", before / after))
+
+    # Session users are built with their permissions once per request
+    after = time_sync(lambda: WebsitePermissions(1).value & mask == expected, number=CHECKS, repeat=3)
+    print("%-40s %12s checks/s  (%.1fx)" % ("After, including building flags", f"{1 / after:,.0f}", before / after))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Compare drawing a raffle winner with ``ORDER BY RANDOM()`` over every
+entry (as the winner API used to) against counting entries per user and
+drawing with :func:`cogs.utils.draw_winners`, as a raffle grows to a
+million entries from a hundred thousand users.
+
+The database comparison is the end to end one: the new side includes the
+per-user aggregation query as well as the draw. It needs
+``TCK_TEST_DATABASE_URL``; see ``scripts/_bench.py``. The draw on its own
+is also timed, against a growing number of entrants.
+
+    python -m scripts.bench_raffle_draw
+"""
+
+import asyncio
+import random
+
+from cogs.utils.raffle_draw import draw_winners
+
+from ._bench import DATABASE_URL, report, temporary_database, time_async, time_sync
+
+
+ENTRY_COUNTS = (10_000, 100_000, 1_000_000)
+ENTRIES_PER_USER = 10
+
+
+OLD_DRAW = """
+SELECT
+    twitch_username,
+    raffle_entries.user_id
+FROM
+    raffle_entries
+LEFT JOIN
+    users
+ON
+    users.id = raffle_entries.user_id
+WHERE
+    raffle_id = $1
+ORDER BY
+    RANDOM()
+LIMIT
+    1
+"""
+
+
+# As run by the winner API
+ENTRANTS = """
+SELECT
+    twitch_username,
+    entries.user_id,
+    entries.count
+FROM
+    (
+        SELECT
+            user_id,
+            COUNT(*)
+        FROM
+            raffle_entries
+        WHERE
+            raffle_id = $1
+        GROUP BY
+            user_id
+    ) entries
+LEFT JOIN
+    users
+ON
+    users.id = entries.user_id
+ORDER BY
+    entries.user_id
+"""
+
+
+def bench_draw() -> None:
+    """
+    Time the draw on its own, once the entries have been counted.
+    """
+
+    print("Drawing from already counted entries:")
+    for entry_count in ENTRY_COUNTS:
+        user_count = entry_count // ENTRIES_PER_USER
+        entrants = list(range(user_count))
+        weights = [random.randint(1, 2 * ENTRIES_PER_USER - 1) for _ in entrants]
+        for k in (1, 10):
+            after = time_sync(lambda: draw_winners(entrants, weights, k), number=5)
+            print("%-40s %10.1fus" % ("%s users, %s winner(s)" % (f"{user_count:,}", k), after * 1e6))
+
+
+async def bench_database() -> None:
+    print("\nEnd to end in the database, %s entries per user:" % ENTRIES_PER_USER)
+    async with temporary_database(DATABASE_URL) as conn:
+        raffle_id = await conn.fetchval(
+            """
+            INSERT INTO
+                raffles
+                (id, name, start_time, end_time)
+            VALUES
+                (uuid_generate_v4(), 'Benchmark', NOW(), NOW())
+            RETURNING
+                id
+            """,
+        )
+        user_count = 0
+        entry_total = 0
+        for entry_count in ENTRY_COUNTS:
+            await conn.execute(
+                """
+                INSERT INTO
+                    users
+                    (id, twitch_id, twitch_username)
+                SELECT
+                    uuid_generate_v4(), 'user' || i, 'user' || i
+                FROM
+                    generate_series($1 + 1, $2) i
+                """,
+                user_count, entry_count // ENTRIES_PER_USER,
+            )
+            user_count = entry_count // ENTRIES_PER_USER
+            await conn.execute(
+                """
+                INSERT INTO
+                    raffle_entries
+                    (raffle_id, user_id)
+                SELECT
+                    $1, user_ids[1 + (i::BIGINT * 7919) % $3]
+                FROM
+                    generate_series(1, $2) i,
+                    (SELECT ARRAY_AGG(id) AS user_ids FROM users) users
+                """,
+                raffle_id, entry_count - entry_total, user_count,
+            )
+            entry_total = entry_count
+            await conn.execute("VACUUM ANALYZE")
+
+            async def new_draw():
+                entrants = await conn.fetch(ENTRANTS, raffle_id)
+                draw_winners(entrants, [i['count'] for i in entrants], 1)
+            before = await time_async(lambda: conn.fetch(OLD_DRAW, raffle_id), number=1, repeat=3)
+            after = await time_async(new_draw, number=1, repeat=3)
+            report("%s entries, %s users" % (f"{entry_count:,}", f"{user_count:,}"), before, after)
+
+
+def main() -> None:
+    bench_draw()
+    if DATABASE_URL:
+        asyncio.run(bench_database())
+    else:
+        print("\nSet TCK_TEST_DATABASE_URL to compare the whole draw in the database.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import asyncio
+import sys
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+import pytest
+
+from cogs.utils.assets import serve_static
+
+
+@pytest.fixture
+def static_client(tmp_path, monkeypatch):
+    """
+    Run a coroutine function with a test client for the static files route,
+    set up ahead of a plain static route for the same directory the way
+    that VBU adds its own.
+    """
+
+    (tmp_path / "static" / "css").mkdir(parents=True)
+    (tmp_path / "static" / "css" / "style.css").write_text("body {}")
+    (tmp_path / "secret.txt").write_text("secret")
+    monkeypatch.setattr(sys.modules["cogs.utils.assets"], "STATIC_DIRECTORY", str(tmp_path / "static"))
+
+    def runner(func):
+        async def inner():
+            app = web.Application()
+            app['config'] = {"assets": {"static_max_age": 60}}
+            app.router.add_get("/static/{path:.+}", serve_static)
+            app.router.add_static("/static", str(tmp_path / "static"), append_version=True)
+            async with TestClient(TestServer(app)) as client:
+                await func(client)
+        asyncio.run(inner())
+    return runner
+
+
+def test_static_files_are_cached(static_client):
+
+    async def test(client):
+        async with client.get("/static/css/style.css") as r:
+            assert r.status == 200
+            assert await r.text() == "body {}"
+            assert r.headers["Cache-Control"] == "public, max-age=60"
+            etag = r.headers["ETag"]
+        async with client.get("/static/css/style.css", headers={"If-None-Match": etag}) as r:
+            assert r.status == 304
+
+    static_client(test)
+
+
+@pytest.mark.parametrize("path", ["css/missing.css", "css", "..%2Fsecret.txt", "css/..%2F..%2Fsecret.txt"])
+def test_only_static_files_are_served(static_client, path):
+
+    async def test(client):
+        async with client.get("/static/" + path) as r:
+            assert r.status == 404
+
+    static_client(test)
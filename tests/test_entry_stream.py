@@ -0,0 +1,80 @@
+import asyncio
+import json
+import uuid
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+import pytest
+
+
+@pytest.fixture
+def stream_client(monkeypatch):
+    """
+    Run a coroutine function with a test client for the backend's routes,
+    logged in as a new user, with the entry broadcaster's subscriptions
+    made by ``subscribe`` instead. The function is given the client and
+    the user's ID.
+    """
+
+    from cogs import utils
+    from website import backend
+
+    user_id = uuid.uuid4()
+    monkeypatch.setattr(utils, "get_session_user", lambda _: asyncio.sleep(0, utils.SessionUser(user_id)))
+    unsubscribed = []
+    monkeypatch.setattr(utils.entry_broadcaster, "unsubscribe", unsubscribed.append)
+
+    def runner(func, subscribe):
+        monkeypatch.setattr(utils.entry_broadcaster, "subscribe", subscribe)
+
+        async def inner():
+            app = web.Application()
+            app['config'] = {"raffles": {"stream_keepalive": 1}}
+            app.add_routes(backend.routes)
+            async with TestClient(TestServer(app)) as client:
+                await func(client, user_id)
+        asyncio.run(inner())
+        return unsubscribed
+    return runner
+
+
+def test_counts_are_streamed(stream_client):
+
+    from cogs import utils
+
+    raffle_id = uuid.uuid4()
+
+    async def subscribe(config, user_id):
+        subscription = utils.EntrySubscription(user_id)
+        subscription.push({raffle_id: 10}, {raffle_id: 1})
+        return subscription
+
+    async def test(client, user_id):
+        async with client.get("/api/raffle_entries/stream") as r:
+            assert r.status == 200
+            assert r.content_type == "text/event-stream"
+            assert await r.content.readline() == b"event: entries\n"
+            data = json.loads((await r.content.readline())[len(b"data: "):])
+            assert data == {"totals": {str(raffle_id): 10}, "entries": {str(raffle_id): 1}}
+
+    unsubscribed = stream_client(test, subscribe)
+    assert len(unsubscribed) == 1
+
+
+@pytest.mark.parametrize("error, status", [(asyncio.TimeoutError, 503), (RuntimeError, 500)])
+def test_subscribe_failures_are_errors(stream_client, error, status):
+    """
+    A stream that can't be subscribed gets an error status, rather than an
+    empty stream that the browser would keep reconnecting to.
+    """
+
+    async def subscribe(config, user_id):
+        raise error()
+
+    async def test(client, user_id):
+        async with client.get("/api/raffle_entries/stream") as r:
+            assert r.status == status
+            assert r.content_type != "text/event-stream"
+
+    unsubscribed = stream_client(test, subscribe)
+    assert not unsubscribed
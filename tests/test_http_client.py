@@ -0,0 +1,29 @@
+import asyncio
+
+from cogs.utils.http_client import HTTPClient
+
+
+def test_session_is_closed_on_shutdown():
+    """
+    The shared session is closed when its event loop shuts down, without
+    anything having to close it.
+    """
+
+    async def get_session():
+        return HTTPClient.get_session()
+
+    session = asyncio.run(get_session())
+    assert session.closed
+    assert HTTPClient.session is None
+
+
+def test_session_can_be_closed_early():
+
+    async def test():
+        session = HTTPClient.get_session()
+        await HTTPClient.close()
+        assert session.closed
+        assert HTTPClient.get_session() is not session
+        await HTTPClient.close()
+
+    asyncio.run(test())
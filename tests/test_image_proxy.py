@@ -0,0 +1,250 @@
+from typing import Dict
+import asyncio
+import collections
+import io
+import os
+import random
+import sys
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from PIL import Image
+import pytest
+
+from cogs.utils.http_client import HTTPClient
+from cogs.utils.image_proxy import ImageProxy, serve_proxied_image
+
+
+WIDTHS = [320, 640, 1280]
+MAX_PIXELS = 3_000_000
+
+
+def encode_png(width: int, height: int, noise: bool = True) -> bytes:
+    if noise:
+        image = Image.frombytes("RGB", (width, height), random.Random(width).randbytes(width * height * 3))
+    else:
+        image = Image.new("RGB", (width, height))
+    output = io.BytesIO()
+    image.save(output, "PNG")
+    return output.getvalue()
+
+
+PHOTO = encode_png(1600, 800)
+SMALL_PHOTO = encode_png(200, 100)
+
+
+class FakeUpstream:
+    """
+    Stands in for the sites that proxied images are hosted on, counting
+    the requests for each path. Each response is held back for a moment so
+    that concurrent requests to the proxy overlap.
+    """
+
+    def __init__(self):
+        self.hits: Dict[str, int] = collections.Counter()
+        self.server = None
+
+    def url(self, path: str) -> str:
+        return str(self.server.make_url(path))
+
+    async def handle(self, request: web.Request):
+        self.hits[request.path] += 1
+        await asyncio.sleep(0.05)
+        name = request.match_info["name"]
+        if name in ("photo.png", "other.png"):
+            return web.Response(body=PHOTO, content_type="image/png")
+        if name == "small.png":
+            return web.Response(body=SMALL_PHOTO, content_type="image/png")
+        if name == "truncated.png":
+            return web.Response(body=PHOTO[:len(PHOTO) // 2], content_type="image/png")
+        if name == "huge.png":
+            return web.Response(body=encode_png(2000, 2000, noise=False), content_type="image/png")
+        if name == "garbage.png":
+            return web.Response(body=random.randbytes(1024), content_type="image/png")
+        if name == "page.html":
+            return web.Response(text="<html></html>", content_type="text/html")
+        if name == "redirect.png":
+            raise web.HTTPFound("/photo.png")
+        raise web.HTTPNotFound()
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get("/{name}", self.handle)
+        self.server = TestServer(app)
+        await self.server.start_server()
+        return self
+
+    async def __aexit__(self, *args):
+        await HTTPClient.close()
+        await self.server.close()
+
+
+@pytest.fixture
+def proxy_config(tmp_path):
+    return {
+        "image_proxy": {
+            "secret": "secret",
+            "directory": str(tmp_path),
+            "widths": WIDTHS,
+            "max_pixels": MAX_PIXELS,
+        },
+    }
+
+
+def create_proxy(config: dict) -> ImageProxy:
+    proxy = ImageProxy()
+    proxy.configure(config)
+    return proxy
+
+
+def image_size(path: str):
+    with Image.open(path) as image:
+        return image.size
+
+
+def test_images_are_fetched_once(proxy_config):
+    """
+    An image is only fetched the first time it's asked for, and is then
+    served from disk, including after a restart.
+    """
+
+    async def test():
+        async with FakeUpstream() as upstream:
+            url = upstream.url("/photo.png")
+            proxy = create_proxy(proxy_config)
+            path = await proxy.get(url, 0)
+            assert await proxy.get(url, 0) == path
+            assert await create_proxy(proxy_config).get(url, 0) == path
+            assert upstream.hits["/photo.png"] == 1
+            with open(path, "rb") as a:
+                assert a.read() == PHOTO
+
+    asyncio.run(test())
+
+
+@pytest.mark.parametrize("width", WIDTHS)
+def test_images_are_resized(proxy_config, width):
+
+    async def test():
+        async with FakeUpstream() as upstream:
+            proxy = create_proxy(proxy_config)
+            path = await proxy.get(upstream.url("/photo.png"), width)
+            assert image_size(path) == (width, width // 2)
+
+            # Images that are already narrow enough aren't scaled up
+            path = await proxy.get(upstream.url("/small.png"), width)
+            assert image_size(path) == (200, 100)
+
+    asyncio.run(test())
+
+
+def test_least_recently_served_images_are_evicted(proxy_config):
+    """
+    The cache directory is kept under its maximum size by removing the
+    images that were served least recently.
+    """
+
+    async def test():
+        async with FakeUpstream() as upstream:
+            proxy = create_proxy(proxy_config)
+            first = await proxy.get(upstream.url("/photo.png"), 320)
+            size = os.path.getsize(first)
+            proxy_config["image_proxy"]["max_cache_size"] = size * 5 // 2
+            proxy.configure(proxy_config)
+
+            second = await proxy.get(upstream.url("/other.png"), 320)
+            await proxy.get(upstream.url("/photo.png"), 320)
+            third = await proxy.get(upstream.url("/photo.png?copy"), 320)
+            assert os.path.exists(first)
+            assert not os.path.exists(second)
+            assert os.path.exists(third)
+            stored = [i for i in os.listdir(proxy.directory) if not i.startswith(".")]
+            assert sum(os.path.getsize(os.path.join(proxy.directory, i)) for i in stored) <= size * 5 // 2
+
+    asyncio.run(test())
+
+
+def test_concurrent_misses_share_a_fetch(proxy_config):
+
+    async def test():
+        async with FakeUpstream() as upstream:
+            proxy = create_proxy(proxy_config)
+            url = upstream.url("/photo.png")
+            paths = await asyncio.gather(*[proxy.get(url, 320) for _ in range(10)])
+            assert len(set(paths)) == 1
+            assert upstream.hits["/photo.png"] == 1
+
+    asyncio.run(test())
+
+
+def run_with_client(config: dict, monkeypatch, func):
+    """
+    Run a coroutine function with a fake upstream and a test client for
+    the proxy route, with a proxy of its own.
+    """
+
+    monkeypatch.setattr(sys.modules["cogs.utils.image_proxy"], "image_proxy", ImageProxy())
+
+    async def inner():
+        async with FakeUpstream() as upstream:
+            app = web.Application()
+            app['config'] = config
+            app.router.add_get("/img", serve_proxied_image)
+            async with TestClient(TestServer(app)) as client:
+                return await func(client, upstream)
+    asyncio.run(inner())
+
+
+def test_proxied_images_are_served(proxy_config, monkeypatch):
+
+    async def test(client, upstream):
+        url = create_proxy(proxy_config).url(upstream.url("/photo.png"), 600)
+        async with client.get(url) as r:
+            assert r.status == 200
+            assert r.content_type == "image/png"
+            assert "max-age" in r.headers["Cache-Control"]
+            assert Image.open(io.BytesIO(await r.read())).size == (640, 320)
+
+    run_with_client(proxy_config, monkeypatch, test)
+
+
+@pytest.mark.parametrize("width, signature", [(320, "0" * 32), (640, None), (320, "")])
+def test_bad_signatures_are_forbidden(proxy_config, monkeypatch, width, signature):
+
+    async def test(client, upstream):
+        photo = upstream.url("/photo.png")
+        proxy = create_proxy(proxy_config)
+        params = {"url": photo, "w": width, "s": signature}
+        if signature is None:
+            # A signature for a different width
+            params["s"] = proxy.sign(photo, 320)
+        async with client.get("/img", params=params) as r:
+            assert r.status == 403
+        assert not upstream.hits
+
+    run_with_client(proxy_config, monkeypatch, test)
+
+
+@pytest.mark.parametrize("name, status", [
+    ("missing.png", 502),
+    ("page.html", 502),
+    ("redirect.png", 502),
+    ("truncated.png", 502),
+    ("huge.png", 502),
+    ("garbage.png", 415),
+])
+@pytest.mark.parametrize("width", [None, 320])
+def test_bad_upstream_images_arent_served(proxy_config, monkeypatch, name, status, width):
+    """
+    Images that can't be fetched or decoded are refused, whether or not
+    they'd have been resized, and nothing is stored for them.
+    """
+
+    async def test(client, upstream):
+        url = create_proxy(proxy_config).url(upstream.url("/" + name), width)
+        async with client.get(url) as r:
+            assert r.status == status
+        assert not upstream.hits["/photo.png"]
+        assert not [i for i in os.listdir(proxy_config["image_proxy"]["directory"]) if not i.startswith(".")]
+
+    run_with_client(proxy_config, monkeypatch, test)
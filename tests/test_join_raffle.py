@@ -0,0 +1,175 @@
+from datetime import datetime as dt, timedelta
+from typing import List, Optional
+import asyncio
+import collections
+import uuid
+
+import pytest
+
+
+PARALLEL_JOINS = 300
+POOL_SIZE = 20
+
+
+async def create_users(conn, count: int) -> List[uuid.UUID]:
+    user_ids = [uuid.uuid4() for _ in range(count)]
+    await conn.execute(
+        """
+        INSERT INTO
+            users
+            (
+                id,
+                twitch_id,
+                twitch_username
+            )
+        SELECT
+            i,
+            i::TEXT,
+            'user'
+        FROM
+            UNNEST($1::UUID[]) i
+        """,
+        user_ids,
+    )
+    return user_ids
+
+
+async def create_raffle(
+        conn,
+        *,
+        entry_price: Optional[int] = 0,
+        max_entries: int = 1,
+        ended: bool = False,
+        closed: bool = False) -> uuid.UUID:
+    now = dt.utcnow()
+    end_time = now - timedelta(minutes=1) if ended else now + timedelta(hours=1)
+    raffle_id = uuid.uuid4()
+    await conn.execute(
+        """
+        INSERT INTO
+            raffles
+            (
+                id,
+                name,
+                start_time,
+                end_time,
+                entry_price,
+                max_entries,
+                closed
+            )
+        VALUES
+            (
+                $1,
+                'Test raffle',
+                $2,
+                $3,
+                $4,
+                $5,
+                $6
+            )
+        """,
+        raffle_id, now - timedelta(hours=1), end_time, entry_price, max_entries, closed,
+    )
+    return raffle_id
+
+
+async def join_in_parallel(pool, joins) -> collections.Counter:
+    """
+    Call join_raffle for each of the given (raffle ID, user ID) pairs at
+    once, and count the outcomes.
+    """
+
+    async def join(raffle_id, user_id):
+        async with pool.acquire() as conn:
+            return await conn.fetchval(
+                """
+                SELECT
+                    outcome
+                FROM
+                    join_raffle($1, $2)
+                """,
+                raffle_id, user_id,
+            )
+    return collections.Counter(await asyncio.gather(*[join(*i) for i in joins]))
+
+
+async def count_entries(conn, raffle_id: uuid.UUID) -> int:
+    return await conn.fetchval(
+        """
+        SELECT
+            COUNT(*)
+        FROM
+            raffle_entries
+        WHERE
+            raffle_id = $1
+        """,
+        raffle_id,
+    )
+
+
+@pytest.mark.parametrize("entry_price, max_entries", [(0, 5), (None, 5), (100, 3)])
+def test_parallel_joins_respect_max_entries(run_with_pool, entry_price, max_entries):
+    """
+    However many times a user joins a raffle at once, they only get as
+    many entries as the raffle allows. Giveaways only ever allow one.
+    """
+
+    expected = max_entries if entry_price else 1
+
+    async def test(pool):
+        async with pool.acquire() as conn:
+            user_id, = await create_users(conn, 1)
+            raffle_id = await create_raffle(conn, entry_price=entry_price, max_entries=max_entries)
+        outcomes = await join_in_parallel(pool, [(raffle_id, user_id)] * PARALLEL_JOINS)
+        assert outcomes == {"entered": expected, "full": PARALLEL_JOINS - expected}
+        async with pool.acquire() as conn:
+            assert await count_entries(conn, raffle_id) == expected
+
+    run_with_pool(test, max_size=POOL_SIZE)
+
+
+def test_parallel_joins_from_different_users(run_with_pool):
+    """
+    Different users joining at the same time don't hold each other out.
+    """
+
+    async def test(pool):
+        async with pool.acquire() as conn:
+            user_ids = await create_users(conn, PARALLEL_JOINS)
+            raffle_id = await create_raffle(conn)
+        outcomes = await join_in_parallel(pool, [(raffle_id, i) for i in user_ids])
+        assert outcomes == {"entered": PARALLEL_JOINS}
+        async with pool.acquire() as conn:
+            assert await count_entries(conn, raffle_id) == PARALLEL_JOINS
+
+    run_with_pool(test, max_size=POOL_SIZE)
+
+
+def test_ended_raffles_cant_be_joined(run_with_pool):
+
+    async def test(pool):
+        async with pool.acquire() as conn:
+            user_id, = await create_users(conn, 1)
+            raffle_id = await create_raffle(conn, ended=True)
+        outcomes = await join_in_parallel(pool, [(raffle_id, user_id), (uuid.uuid4(), user_id)])
+        assert outcomes == {"missing": 2}
+
+    run_with_pool(test, max_size=POOL_SIZE)
+
+
+def test_closed_raffles_cant_be_joined(run_with_pool):
+    """
+    A raffle that's been drawn can't be joined, even if it's been given a
+    later end time since.
+    """
+
+    async def test(pool):
+        async with pool.acquire() as conn:
+            user_id, = await create_users(conn, 1)
+            raffle_id = await create_raffle(conn, closed=True)
+        outcomes = await join_in_parallel(pool, [(raffle_id, user_id)])
+        assert outcomes == {"missing": 1}
+        async with pool.acquire() as conn:
+            assert await count_entries(conn, raffle_id) == 0
+
+    run_with_pool(test, max_size=POOL_SIZE)
@@ -0,0 +1,372 @@
+from datetime import datetime as dt, timedelta
+from typing import List
+import asyncio
+import sys
+import uuid
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+import pytest
+
+
+# Far more joins than VBU's pool has connections (asyncpg's default of 10)
+PARALLEL_JOINS = 200
+
+
+class FakeStreamElements:
+    """
+    Stands in for the StreamElements API, keeping a single user's points
+    balance. Like the real API, it'll happily take a balance negative.
+    Each call waits for ``latency`` seconds so that concurrent joins
+    interleave.
+    """
+
+    def __init__(self, balance: int, latency: float = 0.01):
+        self.balance = balance
+        self.lowest_balance = balance
+        self.latency = latency
+
+    def create(self, utils):
+        fake = self
+
+        class StreamElements(utils.StreamElements):
+
+            async def _request(self, method: str, url: str, *, route=None, **kwargs):
+                await asyncio.sleep(fake.latency)
+                if method == "GET":
+                    return {
+                        "channel": "channel",
+                        "username": "user",
+                        "points": fake.balance,
+                        "pointsAlltime": fake.balance,
+                        "watchtime": 0,
+                        "rank": 1,
+                    }
+                fake.balance += int(url.rsplit("/", 1)[-1])
+                fake.lowest_balance = min(fake.lowest_balance, fake.balance)
+                return {"newAmount": fake.balance}
+
+        StreamElements.points_cache = {}
+        StreamElements.points_requests = {}
+        se = StreamElements("token")
+        se.channel_id = "channel"
+        return se
+
+
+@pytest.fixture
+def join_client(run_with_database, database_config, monkeypatch):
+    """
+    Run a coroutine function with a test client for the backend's routes,
+    logged in as a new user. The function is given the client, the
+    database connection and the user's ID.
+    """
+
+    from cogs import utils
+    from website import backend
+
+    config = {
+        "database": database_config,
+        "raffles": {"auto_draw": False},
+        "streamelements": {"token": "token"},
+    }
+    user_id = uuid.uuid4()
+    monkeypatch.setattr(utils, "get_session_user", lambda _: asyncio.sleep(0, utils.SessionUser(user_id)))
+
+    def runner(func):
+        async def inner(db):
+            await db.call(
+                """
+                INSERT INTO
+                    users
+                    (
+                        id,
+                        twitch_id,
+                        twitch_username
+                    )
+                VALUES
+                    (
+                        $1,
+                        $2,
+                        'user'
+                    )
+                """,
+                user_id, str(user_id),
+            )
+            app = web.Application()
+            app['config'] = config
+            app.add_routes(backend.routes)
+            async with TestClient(TestServer(app)) as client:
+                return await func(client, db, user_id)
+        return run_with_database(inner)
+    return runner
+
+
+async def create_raffles(db, count: int, entry_price: int) -> List[uuid.UUID]:
+    now = dt.utcnow()
+    raffle_ids = [uuid.uuid4() for _ in range(count)]
+    await db.call(
+        """
+        INSERT INTO
+            raffles
+            (
+                id,
+                name,
+                start_time,
+                end_time,
+                entry_price,
+                max_entries
+            )
+        SELECT
+            UNNEST($1::UUID[]),
+            'Test raffle',
+            $2,
+            $3,
+            $4,
+            1
+        """,
+        raffle_ids, now - timedelta(hours=1), now + timedelta(hours=1), entry_price,
+    )
+    return raffle_ids
+
+
+async def count_entries(db, user_id: uuid.UUID) -> int:
+    rows = await db.call(
+        """
+        SELECT
+            COUNT(*)
+        FROM
+            raffle_entries
+        WHERE
+            user_id = $1
+        """,
+        user_id,
+    )
+    return rows[0]['count']
+
+
+def test_parallel_duplicate_joins_add_one_entry(join_client):
+    """
+    Joining the same free raffle many times at once only enters once.
+    """
+
+    async def test(client, db, user_id):
+        raffle_id, = await create_raffles(db, 1, entry_price=0)
+        responses = await asyncio.gather(*[
+            client.post("/api/join_raffle", json={"id": str(raffle_id)})
+            for _ in range(PARALLEL_JOINS)
+        ])
+        statuses = sorted(i.status for i in responses)
+        assert statuses == [200] + [403] * (PARALLEL_JOINS - 1)
+        assert await count_entries(db, user_id) == 1
+
+    join_client(test)
+
+
+def test_joins_show_in_active_entries(join_client):
+    """
+    The entry counts that browsers without streaming fall back to include
+    a raffle as soon as it's been joined.
+    """
+
+    async def test(client, db, user_id):
+        joined, other = await create_raffles(db, 2, entry_price=0)
+        async with client.get("/api/active_raffle_entries") as r:
+            assert await r.json() == {}
+        async with client.post("/api/join_raffle", json={"id": str(joined)}) as r:
+            assert r.status == 200
+        async with client.get("/api/active_raffle_entries") as r:
+            assert await r.json() == {str(joined): 1}
+
+    join_client(test)
+
+
+def test_parallel_paid_joins_never_overspend(join_client, monkeypatch):
+    """
+    Joining several paid raffles at once never spends more points than the
+    user has, and every raffle that was paid for has exactly one entry.
+    """
+
+    from cogs import utils
+    from website import backend
+
+    fake = FakeStreamElements(balance=150)
+    se = fake.create(utils)
+
+    async def streamelements(_):
+        return se
+    monkeypatch.setattr(backend, "streamelements", streamelements)
+
+    async def test(client, db, user_id):
+        raffle_ids = await create_raffles(db, 3, entry_price=100)
+        responses = await asyncio.gather(*[
+            client.post("/api/join_raffle", json={"id": str(raffle_ids[i % len(raffle_ids)])})
+            for i in range(PARALLEL_JOINS)
+        ])
+        assert sum(i.status == 200 for i in responses) == 1
+        assert {i.status for i in responses} <= {200, 403, 409}
+        assert fake.lowest_balance >= 0
+        assert fake.balance == 50
+        assert await count_entries(db, user_id) == 1
+
+    join_client(test)
+
+
+def test_paid_joins_dont_hold_connections(join_client, monkeypatch):
+    """
+    Joins that are waiting on StreamElements don't keep database
+    connections, so a slow StreamElements can't use up the pool.
+    """
+
+    from cogs import utils
+    from website import backend
+
+    fake = FakeStreamElements(balance=1_000, latency=0.5)
+    se = fake.create(utils)
+
+    async def streamelements(_):
+        return se
+    monkeypatch.setattr(backend, "streamelements", streamelements)
+
+    async def test(client, db, user_id):
+        raffle_id, = await create_raffles(db, 1, entry_price=100)
+        joins = asyncio.gather(*[
+            client.post("/api/join_raffle", json={"id": str(raffle_id)})
+            for _ in range(PARALLEL_JOINS)
+        ])
+        await asyncio.sleep(0.3)
+
+        async def query():
+            async with utils.Database() as other_db:
+                await other_db.call("SELECT 1")
+        await asyncio.wait_for(query(), 0.1)
+        responses = await joins
+        assert sum(i.status == 200 for i in responses) == 1
+        assert {i.status for i in responses} <= {200, 403, 409}
+        assert fake.balance == 900
+
+    join_client(test)
+
+
+def test_paid_joins_need_a_twitch_username(join_client, monkeypatch):
+
+    from cogs import utils
+    from website import backend
+
+    fake = FakeStreamElements(balance=1_000)
+    se = fake.create(utils)
+
+    async def streamelements(_):
+        return se
+    monkeypatch.setattr(backend, "streamelements", streamelements)
+
+    async def test(client, db, user_id):
+        raffle_id, = await create_raffles(db, 1, entry_price=100)
+        await db.call(
+            """
+            UPDATE
+                users
+            SET
+                twitch_username = ''
+            WHERE
+                id = $1
+            """,
+            user_id,
+        )
+        async with client.post("/api/join_raffle", json={"id": str(raffle_id)}) as r:
+            assert r.status == 400
+        assert await count_entries(db, user_id) == 0
+        assert fake.balance == 1_000
+
+    join_client(test)
+
+
+def log_in_as_admin(monkeypatch):
+    from cogs import utils
+
+    async def get_admin(_):
+        return utils.SessionUser(uuid.uuid4(), utils.WebsitePermissions(admin_panel=True).value)
+    monkeypatch.setattr(sys.modules["cogs.utils.wrappers"], "get_session_user", get_admin)
+
+
+def test_closed_raffles_keep_their_end_time(join_client, monkeypatch):
+    """
+    Once a raffle's been drawn its end time can't be changed, so it can't
+    be reopened for entries; its other details can still be edited.
+    """
+
+    log_in_as_admin(monkeypatch)
+
+    async def test(client, db, user_id):
+        raffle_id, = await create_raffles(db, 1, entry_price=0)
+        rows = await db.call(
+            """
+            UPDATE
+                raffles
+            SET
+                closed = TRUE
+            WHERE
+                id = $1
+            RETURNING
+                *
+            """,
+            raffle_id,
+        )
+        end_time = rows[0]['end_time'].replace(microsecond=0)
+        raffle = {
+            "id": str(raffle_id),
+            "name": "Renamed raffle",
+            "description": "",
+            "image": "",
+        }
+
+        async with client.put("/api/raffle", json={**raffle, "end_time": (end_time + timedelta(days=1)).isoformat()}) as r:
+            assert r.status == 409
+        async with client.put("/api/raffle", json={**raffle, "end_time": end_time.isoformat()}) as r:
+            assert r.status == 200
+            assert (await r.json())['data'][0]['name'] == "Renamed raffle"
+        async with client.post("/api/join_raffle", json={"id": str(raffle_id)}) as r:
+            assert r.status == 403
+        assert await count_entries(db, user_id) == 0
+
+    join_client(test)
+
+
+@pytest.mark.parametrize("count, status", [("0", 400), ("-1", 400), ("1", 200), ("2", 200), ("3", 400)])
+def test_winner_count_is_checked(join_client, monkeypatch, count, status):
+    """
+    Winners can only be drawn between one and as many times as there are
+    entrants.
+    """
+
+    log_in_as_admin(monkeypatch)
+
+    async def test(client, db, user_id):
+        raffle_id, = await create_raffles(db, 1, entry_price=0)
+        async with client.post("/api/join_raffle", json={"id": str(raffle_id)}) as r:
+            assert r.status == 200
+        await db.call(
+            """
+            INSERT INTO
+                raffle_entries
+                (
+                    raffle_id,
+                    user_id
+                )
+            SELECT
+                $1,
+                id
+            FROM
+                users
+            WHERE
+                id != $2
+            LIMIT
+                1
+            """,
+            raffle_id, user_id,
+        )
+        async with client.get("/api/raffle_winner", params={"id": str(raffle_id), "count": count}) as r:
+            assert r.status == status
+            if status == 200:
+                assert len((await r.json())['data']) == int(count)
+
+    join_client(test)
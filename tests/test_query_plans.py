@@ -0,0 +1,456 @@
+from datetime import datetime as dt, timedelta
+from typing import Iterator
+import asyncio
+import json
+import os
+import re
+
+import pytest
+
+from .conftest import connect, create_database, drop_database
+
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+RAFFLE_COUNT = 5_000
+USER_COUNT = 100_000
+ENTRY_COUNT = 200_000
+
+
+# The hot queries, copied from the file that runs them, and the seeded
+# values that they're run with. Each one is checked against its file so
+# that this can't drift away from what the site actually runs. Queries
+# from a PL/pgSQL function refer to its arguments by name, as the seeded
+# value's name with an underscore in front.
+HOT_QUERIES = {
+    "user's entries into listed raffles": (
+        "website/frontend.py",
+        """
+        SELECT
+            raffle_id, COUNT(id)
+        FROM
+            raffle_entries
+        WHERE
+            user_id = $1
+        AND
+            raffle_id = ANY($2::UUID[])
+        GROUP BY
+            raffle_id
+        """,
+        ("user_id", "active_raffle_ids"),
+    ),
+    "user's entries into active raffles": (
+        "website/backend.py",
+        """
+        SELECT
+            raffle_entries.raffle_id, COUNT(raffle_entries.id)
+        FROM
+            raffle_entries
+        INNER JOIN
+            raffles
+        ON
+            raffles.id = raffle_entries.raffle_id
+        WHERE
+            raffle_entries.user_id = $1
+        AND
+            raffles.deleted IS FALSE
+        AND
+            raffles.end_time > TIMEZONE('UTC', NOW())
+        AND
+            raffles.start_time <= TIMEZONE('UTC', NOW())
+        GROUP BY
+            raffle_entries.raffle_id
+        """,
+        ("user_id",),
+    ),
+    "user's entries into a raffle": (
+        "website/backend.py",
+        """
+        SELECT
+            raffle_id, COUNT(id)
+        FROM
+            raffle_entries
+        WHERE
+            user_id = $1
+        AND
+            raffle_id = $2
+        GROUP BY
+            raffle_id
+        """,
+        ("user_id", "raffle_id"),
+    ),
+    "user's entries into a raffle, when joining": (
+        "config/migrations/0005_join_raffle_closed.pgsql",
+        """
+        SELECT
+            COUNT(*)
+        INTO
+            _entry_count
+        FROM
+            raffle_entries
+        WHERE
+            raffle_entries.user_id = _user_id
+        AND
+            raffle_entries.raffle_id = _raffle_id
+        """,
+        ("user_id", "raffle_id"),
+    ),
+    "entry counts of active raffles": (
+        "cogs/utils/entry_broadcaster.py",
+        """
+        SELECT
+            raffle_id,
+            COUNT(*)
+        FROM
+            raffle_entries
+        WHERE
+            raffle_id = ANY($1::UUID[])
+        GROUP BY
+            raffle_id
+        """,
+        ("active_raffle_ids",),
+    ),
+    "listening users' entries into active raffles": (
+        "cogs/utils/entry_broadcaster.py",
+        """
+        SELECT
+            user_id,
+            raffle_id,
+            COUNT(*)
+        FROM
+            raffle_entries
+        WHERE
+            raffle_id = ANY($1::UUID[])
+        AND
+            user_id = ANY($2::UUID[])
+        GROUP BY
+            user_id,
+            raffle_id
+        """,
+        ("active_raffle_ids", "active_user_ids"),
+    ),
+    "raffle index": (
+        "cogs/utils/raffle_index.py",
+        """
+        SELECT
+            *
+        FROM
+            raffles
+        WHERE
+            deleted IS FALSE
+        AND
+            (
+                closed IS FALSE
+            OR
+                end_time > $1
+            )
+        """,
+        ("index_cutoff",),
+    ),
+    "admin raffle list": (
+        "website/frontend.py",
+        """
+        SELECT
+            *
+        FROM
+            raffles
+        WHERE
+            deleted IS FALSE
+        ORDER BY
+            start_time DESC
+        LIMIT
+            $1
+        OFFSET
+            $2
+        """,
+        ("page_size", "page_offset"),
+    ),
+    "raffle entrants": (
+        "cogs/utils/raffle_scheduler.py",
+        """
+        SELECT
+            twitch_username,
+            entries.user_id,
+            entries.count
+        FROM
+            (
+                SELECT
+                    user_id,
+                    COUNT(*)
+                FROM
+                    raffle_entries
+                WHERE
+                    raffle_id = $1
+                GROUP BY
+                    user_id
+            ) entries
+        LEFT JOIN
+            users
+        ON
+            users.id = entries.user_id
+        ORDER BY
+            entries.user_id
+        """,
+        ("raffle_id",),
+    ),
+    "raffle winners": (
+        "cogs/utils/raffle_scheduler.py",
+        """
+        SELECT
+            twitch_username,
+            raffle_winners.user_id,
+            (
+                SELECT
+                    COUNT(*)
+                FROM
+                    raffle_entries
+                WHERE
+                    raffle_entries.raffle_id = raffle_winners.raffle_id
+                AND
+                    raffle_entries.user_id = raffle_winners.user_id
+            ) AS count,
+            raffles.draw_seed
+        FROM
+            raffle_winners
+        INNER JOIN
+            raffles
+        ON
+            raffles.id = raffle_winners.raffle_id
+        LEFT JOIN
+            users
+        ON
+            users.id = raffle_winners.user_id
+        WHERE
+            raffle_winners.raffle_id = $1
+        ORDER BY
+            raffle_winners.position
+        """,
+        ("raffle_id",),
+    ),
+    "raffles left to close": (
+        "cogs/utils/raffle_scheduler.py",
+        """
+        SELECT
+            id,
+            end_time
+        FROM
+            raffles
+        WHERE
+            closed IS FALSE
+        AND
+            deleted IS FALSE
+        """,
+        (),
+    ),
+}
+
+# The tables that are big enough that reading all of them is a problem
+LARGE_TABLES = {"raffles", "raffle_entries", "users"}
+
+
+def normalize(sql: str) -> str:
+    return " ".join(sql.split())
+
+
+def as_statement(sql: str, argument_names) -> str:
+    """
+    Make a query from a PL/pgSQL function into one that can be explained
+    on its own, by dropping its INTO and making its arguments parameters.
+    """
+
+    sql = re.sub(r"\bINTO\s+\w+\s", "", sql)
+    for index, name in enumerate(argument_names, start=1):
+        sql = re.sub(rf"\b_{name}\b", f"${index}", sql)
+    return sql
+
+
+def plan_nodes(plan: dict) -> Iterator[dict]:
+    yield plan
+    for i in plan.get("Plans", []):
+        yield from plan_nodes(i)
+
+
+async def seed(conn) -> dict:
+    """
+    Fill the database with a realistic amount of raffles, users and
+    entries, most of them for raffles that have ended and been drawn.
+    Get the values that the hot queries are run with: the IDs of an
+    active raffle and a user that's entered it, of every active raffle and
+    of some of the users that have entered them, and the arguments for
+    the raffle index and the first page of the admin raffle list.
+    """
+
+    await conn.execute(
+        """
+        INSERT INTO
+            users
+            (id, twitch_id, twitch_username)
+        SELECT
+            uuid_generate_v4(), 'seed' || i, 'seed' || i
+        FROM
+            generate_series(1, $1) i
+        """,
+        USER_COUNT,
+    )
+    # Raffles are added oldest first and are closed as they're added, the
+    # way the table would have been filled in, so that the table and its
+    # partial indexes aren't left bloated
+    await conn.execute(
+        """
+        INSERT INTO
+            raffles
+            (id, name, start_time, end_time, closed)
+        SELECT
+            uuid_generate_v4(),
+            'Seed raffle ' || i,
+            TIMEZONE('UTC', NOW()) - (i || ' days')::INTERVAL,
+            TIMEZONE('UTC', NOW()) - (i || ' days')::INTERVAL + INTERVAL '2 days',
+            i >= 2
+        FROM
+            generate_series($1 - 1, 0, -1) i
+        """,
+        RAFFLE_COUNT,
+    )
+    await conn.execute(
+        """
+        INSERT INTO
+            raffle_entries
+            (raffle_id, user_id)
+        SELECT
+            raffle_ids[1 + i % $2], user_ids[1 + (i * 7919) % $3]
+        FROM
+            generate_series(1, $1) i,
+            (SELECT ARRAY_AGG(id) AS raffle_ids FROM raffles) raffles,
+            (SELECT ARRAY_AGG(id) AS user_ids FROM users) users
+        """,
+        ENTRY_COUNT, RAFFLE_COUNT, USER_COUNT,
+    )
+    await conn.execute(
+        """
+        INSERT INTO
+            raffle_winners
+            (raffle_id, position, user_id)
+        SELECT
+            DISTINCT ON (raffle_id) raffle_id, 0, user_id
+        FROM
+            raffle_entries
+        INNER JOIN
+            raffles
+        ON
+            raffles.id = raffle_entries.raffle_id
+        WHERE
+            raffles.closed
+        """,
+    )
+    await conn.execute("VACUUM ANALYZE")
+    row = await conn.fetchrow(
+        """
+        SELECT
+            raffle_entries.raffle_id,
+            raffle_entries.user_id
+        FROM
+            raffle_entries
+        INNER JOIN
+            raffles
+        ON
+            raffles.id = raffle_entries.raffle_id
+        WHERE
+            raffles.end_time > TIMEZONE('UTC', NOW())
+        LIMIT
+            1
+        """,
+    )
+    active_raffle_ids = await conn.fetchval(
+        """
+        SELECT
+            ARRAY_AGG(id)
+        FROM
+            raffles
+        WHERE
+            end_time > TIMEZONE('UTC', NOW())
+        """,
+    )
+    active_user_ids = await conn.fetchval(
+        """
+        SELECT
+            ARRAY_AGG(user_id)
+        FROM
+            (
+                SELECT
+                    DISTINCT user_id
+                FROM
+                    raffle_entries
+                WHERE
+                    raffle_id = ANY($1::UUID[])
+                LIMIT
+                    50
+            ) users
+        """,
+        active_raffle_ids,
+    )
+    return {
+        **row,
+        "active_raffle_ids": active_raffle_ids,
+        "active_user_ids": active_user_ids,
+        "index_cutoff": dt.utcnow() - timedelta(days=7),
+        "page_size": 51,
+        "page_offset": 0,
+    }
+
+
+@pytest.fixture(scope="module")
+def seeded_database(database_config):
+    """
+    A database of its own, so that the rows other tests leave behind don't
+    change the plans, seeded with the values to run the hot queries with.
+    """
+
+    config = {**database_config, "database": f"{database_config['database']}_plans"}
+
+    async def inner():
+        await create_database(database_config, config["database"])
+        conn = await connect(config)
+        try:
+            return await seed(conn)
+        finally:
+            await conn.close()
+
+    values = asyncio.run(inner())
+    try:
+        yield config, values
+    finally:
+        asyncio.run(drop_database(database_config, config["database"]))
+
+
+@pytest.mark.parametrize("name", HOT_QUERIES)
+def test_hot_queries_use_indexes(seeded_database, name):
+    """
+    None of the hot lookups read the whole of a large table, with the
+    planner's default settings and a realistically sized database.
+    """
+
+    database_config, values = seeded_database
+    path, sql, argument_names = HOT_QUERIES[name]
+    with open(os.path.join(ROOT, path)) as a:
+        assert normalize(sql) in normalize(a.read()), f"{name} isn't in {path}"
+
+    if path.endswith(".pgsql"):
+        sql = as_statement(sql, argument_names)
+
+    async def inner():
+        conn = await connect(database_config)
+        try:
+            return await conn.fetchval(
+                "EXPLAIN (FORMAT JSON) " + sql,
+                *[values[i] for i in argument_names],
+            )
+        finally:
+            await conn.close()
+
+    plan = json.loads(asyncio.run(inner()))
+    scanned = [
+        i["Relation Name"]
+        for i in plan_nodes(plan[0]["Plan"])
+        if i["Node Type"] == "Seq Scan"
+    ]
+    assert not LARGE_TABLES.intersection(scanned), json.dumps(plan, indent=4)
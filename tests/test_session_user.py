@@ -0,0 +1,83 @@
+import asyncio
+import uuid
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+import aiohttp_jinja2
+import aiohttp_session
+import jinja2
+import pytest
+
+from cogs import utils
+
+
+def run_with_client(func, session_data: dict):
+    """
+    Run a coroutine function with a test client for a page that shows the
+    logged in user's username, with the given data in the session.
+    """
+
+    @aiohttp_jinja2.template("page.htm.j2")
+    @utils.add_standard_args()
+    async def page(request: web.Request):
+        return {}
+
+    async def inner():
+        app = web.Application()
+        app['config'] = {}
+        aiohttp_session.setup(app, aiohttp_session.SimpleCookieStorage())
+        aiohttp_jinja2.setup(app, loader=jinja2.DictLoader({
+            "page.htm.j2": "{{ user.twitch_username }}",
+        }))
+        app.router.add_get("/", page)
+        async with TestClient(TestServer(app)) as client:
+            client.session.cookie_jar.update_cookies({"AIOHTTP_SESSION": utils.json_dumps({"session": session_data}).decode()})
+            await func(client)
+    asyncio.run(inner())
+
+
+def test_sessions_round_trip():
+    user = utils.SessionUser(uuid.uuid4(), 1, "user")
+    session = {}
+    user.store(session)
+    stored = utils.SessionUser.from_session(session)
+    assert (stored.id, stored.permissions.value, stored.twitch_username) == (user.id, 1, "user")
+
+
+def test_pages_dont_load_the_profile(monkeypatch):
+    """
+    Rendering a page for a logged in user doesn't need their profile, since
+    the username that pages show is in their cookie.
+    """
+
+    async def fetch_profile(self, db=None):
+        pytest.fail("The profile was loaded")
+    monkeypatch.setattr(utils.SessionUser, "fetch_profile", fetch_profile)
+
+    async def test(client):
+        async with client.get("/") as r:
+            assert await r.text() == "user"
+
+    run_with_client(test, {"user": [str(uuid.uuid4()), 0, "user"]})
+
+
+def test_older_sessions_are_given_a_username(monkeypatch):
+    """
+    Sessions from before the username was stored have it loaded from
+    their profile once, and are updated with it.
+    """
+
+    loads = []
+
+    async def fetch_profile(self, db=None):
+        loads.append(self.id)
+        return {"twitch_username": "user"}
+    monkeypatch.setattr(utils.SessionUser, "fetch_profile", fetch_profile)
+
+    async def test(client):
+        for _ in range(2):
+            async with client.get("/") as r:
+                assert await r.text() == "user"
+        assert len(loads) == 1
+
+    run_with_client(test, {"user": [str(uuid.uuid4()), 0]})
@@ -0,0 +1,62 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from cogs.utils.timing import request_duration, timing_middleware
+
+
+def run_with_client(func):
+    """
+    Run a coroutine function with a test client for a site with a timed
+    page and a timed stream.
+    """
+
+    async def page(request: web.Request):
+        return web.Response(text="page")
+
+    async def stream(request: web.Request):
+        response = web.StreamResponse()
+        await response.prepare(request)
+        await response.write(b"stream")
+        return response
+
+    async def inner():
+        app = web.Application(middlewares=[timing_middleware])
+        app['config'] = {}
+        app.router.add_get("/page", page)
+        app.router.add_get("/stream", stream)
+        async with TestClient(TestServer(app)) as client:
+            await func(client)
+    asyncio.run(inner())
+
+
+def observed(route: str) -> int:
+    return sum(request_duration.counts.get((route, "GET"), []))
+
+
+def test_pages_are_timed():
+
+    async def test(client):
+        before = observed("/page")
+        async with client.get("/page") as r:
+            assert "total;dur=" in r.headers["Server-Timing"]
+        assert observed("/page") == before + 1
+
+    run_with_client(test)
+
+
+def test_streams_arent_timed():
+    """
+    Streamed responses have already sent their headers, and last as long
+    as the client listens, so they're left out of the request durations.
+    """
+
+    async def test(client):
+        before = observed("/stream")
+        async with client.get("/stream") as r:
+            assert await r.read() == b"stream"
+            assert "Server-Timing" not in r.headers
+        assert observed("/stream") == before
+
+    run_with_client(test)
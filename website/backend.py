@@ -1,23 +1,99 @@
 from datetime import datetime as dt
-from typing import Optional, Union, overload
+from typing import Optional
 from urllib.parse import urlencode
-import json
+from uuid import UUID
+import asyncio
+import hashlib
+import hmac
+import secrets
 
-import aiohttp
-from aiohttp.web import HTTPFound, Request, Response, RouteTableDef, json_response
+from aiohttp.web import HTTPFound, HTTPServiceUnavailable, Request, Response, StreamResponse
 import aiohttp_session
-import asyncpg
 from discord.ext import vbu
 
 from cogs import utils
 
 
-routes = RouteTableDef()
+routes = utils.MiddlewareRouteTableDef(
+    utils.timing_middleware,
+    utils.raffle_scheduler_middleware,
+)
 
 
-def streamelements(r: Request):
+# The messages for each of the failure outcomes of the join_raffle
+# database function
+JOIN_RAFFLE_ERRORS = {
+    "missing": "Giveaway does not exist.",
+    "full": "Entered max amount of times already.",
+}
+
+
+async def streamelements(r: Request) -> utils.StreamElements:
     token = r.app['config']['streamelements']['token']
-    return utils.StreamElements(token)
+    session = utils.HTTPClient.get_session(r.app['config'])
+    se_config = r.app['config']['streamelements']
+    se = utils.StreamElements(
+        token,
+        session=session,
+        points_cache_ttl=se_config.get('points_cache_ttl'),
+        rate_limit=se_config.get('rate_limit'),
+        burst=se_config.get('burst'),
+        request_deadline=se_config.get('request_deadline'),
+        max_retries=se_config.get('max_retries'),
+    )
+    if se.channel_id is None:
+        await load_streamelements_channel(se)
+    return se
+
+
+async def load_streamelements_channel(se: utils.StreamElements) -> None:
+    """
+    Load the channel for a StreamElements token from the database, asking
+    the API (and saving its answer) only if we've not seen the token before.
+    """
+
+    token_hash = hashlib.sha256(se.token.encode()).hexdigest()
+    async with utils.Database() as db:
+        rows = await db.call(
+            """
+            SELECT
+                username,
+                channel_id
+            FROM
+                streamelements_channels
+            WHERE
+                token_hash = $1
+            """,
+            token_hash,
+        )
+        if rows:
+            se.cache_channel(rows[0]['username'], rows[0]['channel_id'])
+            return
+        username, channel_id = await se.get_channel()
+        await db.call(
+            """
+            INSERT INTO
+                streamelements_channels
+                (
+                    token_hash,
+                    username,
+                    channel_id
+                )
+            VALUES
+                (
+                    $1,
+                    $2,
+                    $3
+                )
+            ON CONFLICT
+                (token_hash)
+            DO UPDATE
+            SET
+                username = excluded.username,
+                channel_id = excluded.channel_id
+            """,
+            token_hash, username, channel_id,
+        )
 
 
 def try_parse_time(input_time: str, parse) -> Optional[dt]:
@@ -41,17 +117,6 @@ def parse_time(input_time: str) -> dt:
     raise TypeError()
 
 
-@overload
-def json_encode(item: dict) -> dict: ...
-@overload
-def json_encode(item: list) -> list: ...
-
-def json_encode(item: Union[dict, list]) -> Union[dict, list]:
-    if isinstance(item, asyncpg.Record):
-        item = dict(item)
-    return json.loads(json.dumps(item, cls=utils.HTTPEncoder))
-
-
 @routes.get("/login_processor/discord")
 async def discord_login_processor(request: Request):
     """
@@ -95,70 +160,69 @@ async def twitch_login_processor(request: Request):
         "grant_type": "authorization_code",
         "redirect_uri": request.app['config']['website_base_url'] + "/login_processor/twitch"
     }
-    async with aiohttp.ClientSession() as session:
-        url = "https://id.twitch.tv/oauth2/token"
-        token_site = await session.post(url, headers=headers, data=params)
+    session = utils.HTTPClient.get_session(request.app['config'])
+    url = "https://id.twitch.tv/oauth2/token"
+    trace_request_ctx = {
+        "upstream": "twitch",
+        "route": "/oauth2/token",
+    }
+    async with session.post(url, headers=headers, data=params, trace_request_ctx=trace_request_ctx) as token_site:
         if not token_site.ok:
             log.info("Failed to get token data: %s" % await token_site.text())
             return HTTPFound(location="/")
         auth_data = await token_site.json()
-        log.info("Auth token data: %s" % auth_data)
+    log.info("Auth token data: %s" % auth_data)
 
-        # Get the user's name and ID
-        headers = {
-            "Authorization": f"Bearer {auth_data['access_token']}",
-            "User-Agent": request.app['config']['user_agent'],
-        }
-        url = "https://id.twitch.tv/oauth2/validate"
-        validate_site = await session.get(url, headers=headers)
+    # Get the user's name and ID
+    headers = {
+        "Authorization": f"Bearer {auth_data['access_token']}",
+        "User-Agent": request.app['config']['user_agent'],
+    }
+    url = "https://id.twitch.tv/oauth2/validate"
+    trace_request_ctx = {
+        "upstream": "twitch",
+        "route": "/oauth2/validate",
+    }
+    async with session.get(url, headers=headers, trace_request_ctx=trace_request_ctx) as validate_site:
         if not validate_site.ok:
             log.info("Failed to validate token data: %s" % await validate_site.text())
             return HTTPFound(location="/")
         user_data = await validate_site.json()
-        log.info("Validate token data: %s" % user_data)
+    log.info("Validate token data: %s" % user_data)
 
-    # Store their data in the database if necessary
-    async with vbu.Database() as db:
-        try:
-            db_data = await db.call(
-                """
-                INSERT INTO
-                    users
-                    (
-                        id,
-                        twitch_id,
-                        twitch_username
-                    )
-                VALUES
-                    (
-                        uuid_generate_v4(),  -- uuid
-                        $1,  -- twitch id
-                        $2  -- twitch username
-                    )
-                RETURNING
-                    *
-                """,
-                user_data['user_id'], user_data['login'],
-            )
-        except asyncpg.UniqueViolationError:
-            db_data = await db.call(
-                """
-                SELECT
-                    *
-                FROM
-                    users
-                WHERE
-                    twitch_id = $1
-                """,
-                user_data['user_id'],
-            )
+    # Store their data in the database, or update their username if
+    # they've logged in before
+    async with utils.Database() as db:
+        db_data = await db.call(
+            """
+            INSERT INTO
+                users
+                (
+                    id,
+                    twitch_id,
+                    twitch_username
+                )
+            VALUES
+                (
+                    uuid_generate_v4(),  -- uuid
+                    $1,  -- twitch id
+                    $2  -- twitch username
+                )
+            ON CONFLICT
+                (twitch_id)
+            DO UPDATE
+            SET
+                twitch_username = EXCLUDED.twitch_username
+            RETURNING
+                *
+            """,
+            user_data['user_id'], user_data['login'],
+        )
 
     # It succeeded - sick
     # Let's store that and direct them as necessary
     session = await aiohttp_session.get_session(request)
-    user_db_data = dict(db_data[0])
-    user_db_data['id'] = str(user_db_data['id'])
-    session['user_info'] = user_db_data
+    utils.SessionUser.login(session, db_data[0])
     return HTTPFound(location="/")
 
 
@@ -188,6 +252,36 @@ async def login(request: Request):
     return HTTPFound(location=f"https://id.twitch.tv/oauth2/authorize?{params}")
 
 
+@routes.get("/metrics")
+async def metrics(request: Request):
+    """
+    Show the website's metrics in the Prometheus text format. These can
+    be seen by admins, or by anything that sends the metrics token from
+    the config as a bearer token.
+    """
+
+    token = request.app['config'].get('metrics', {}).get('token')
+    authorization = request.headers.get("Authorization", "")
+    if token and hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode()):
+        return metrics_response()
+    return await admin_metrics(request)
+
+
+@utils.requires_permission(admin_panel=True)
+async def admin_metrics(_: Request):
+    return metrics_response()
+
+
+def metrics_response() -> Response:
+    return Response(
+        text=utils.render_metrics(),
+        content_type="text/plain",
+        headers={
+            "Cache-Control": "no-store",
+        },
+    )
+
+
 @routes.put("/api/leaderboard")
 @utils.requires_permission(admin_panel=True)
 async def put_leaderboard(request: Request):
@@ -195,48 +289,58 @@ async def put_leaderboard(request: Request):
     Get submitted changes from the leaderboard admin page.
     """
 
-    # Get the json data from the request
+    # Get the json data from the request; later rows win if an index
+    # is given twice
     data = await request.json()
+    rows = {
+        int(row['index']): (row['name'], int(row['amount']))
+        for row in data
+    }
 
-    # Add that to the database
-    new_data = []
-    async with vbu.Database() as db:
-        for row in data:
-            new_row = await db.call(
-                """
-                INSERT INTO
-                    leaderboards
-                    (
-                        index,
-                        name,
-                        amount
-                    )
-                VALUES
-                    (
-                        $1,
-                        $2,
-                        $3
-                    )
-                ON CONFLICT
-                    (index)
-                DO UPDATE
-                SET
-                    name = excluded.name,
-                    amount = excluded.amount
-                RETURNING
-                    *
-                """,
-                int(row['index']), row['name'], int(row['amount']),
-            )
-            new_data.append(new_row[0])
+    # Add that to the database, only touching rows that changed
+    async with utils.Database() as db:
+        new_data = await db.call(
+            """
+            INSERT INTO
+                leaderboards
+                (
+                    index,
+                    name,
+                    amount
+                )
+            SELECT
+                *
+            FROM
+                UNNEST($1::INTEGER[], $2::TEXT[], $3::INTEGER[])
+            ON CONFLICT
+                (index)
+            DO UPDATE
+            SET
+                name = excluded.name,
+                amount = excluded.amount
+            WHERE
+                leaderboards.name IS DISTINCT FROM excluded.name
+            OR
+                leaderboards.amount IS DISTINCT FROM excluded.amount
+            RETURNING
+                *
+            """,
+            list(rows.keys()),
+            [i[0] for i in rows.values()],
+            [i[1] for i in rows.values()],
+        )
 
     # And done
-    return json_response({
+    utils.page_cache.invalidate("leaderboard")
+    utils.response_cache.invalidate("leaderboard")
+    return utils.json_response({
         "message": "Leaderboards updated successfully! :3",
         "data": [
-            json_encode(dict(i))
+            i
             for i in new_data
         ],
+        "changed": len(new_data),
+        "unchanged": len(rows) - len(new_data),
     })
 
 
@@ -254,7 +358,7 @@ async def put_raffle(request: Request):
     raffle_is_new = not bool(raffle_data.get('id'))
 
     # Add that to the database
-    async with vbu.Database() as db:
+    async with utils.Database() as db:
         if raffle_is_new:
             new_rows = await db.call(
                 """
@@ -291,6 +395,9 @@ async def put_raffle(request: Request):
                 raffle_data['entry_price'], raffle_data['max_entries'],
             )
         else:
+
+            # A closed raffle has already had its winners drawn, so its end
+            # time can't be moved any more; everything else can be changed
             new_rows = await db.call(
                 """
                 UPDATE
@@ -302,6 +409,12 @@ async def put_raffle(request: Request):
                     image = $5
                 WHERE
                     id = $1
+                AND
+                    (
+                        closed IS FALSE
+                    OR
+                        DATE_TRUNC('second', end_time) = DATE_TRUNC('second', $3::TIMESTAMP)
+                    )
                 RETURNING
                     *
                 """,
@@ -309,16 +422,30 @@ async def put_raffle(request: Request):
                 parse_time(raffle_data['end_time']),
                 raffle_data['description'], raffle_data['image'],
             )
+            if not new_rows:
+                return utils.json_response(
+                    {
+                        "message": "That raffle doesn't exist, or has been drawn already so its end time can't be changed.",
+                        "data": [],
+                    },
+                    status=409,
+                )
 
     # And done
+    if new_rows:
+        raffle = utils.Raffle(data=new_rows[0])
+        utils.raffle_index.update(raffle)
+        utils.response_cache.invalidate("raffles")
+        if not raffle.closed:
+            utils.raffle_scheduler.schedule(raffle.id, new_rows[0]['end_time'])
     if raffle_is_new:
         message = "Raffle created successfully! :3"
     else:
         message = "Raffle updated successfully! :3"
-    return json_response({
+    return utils.json_response({
         "message": message,
         "data": [
-            json_encode(dict(new_rows[0])),
+            new_rows[0],
         ],
     })
 
@@ -334,7 +461,7 @@ async def delete_raffle(request: Request):
     raffle_id = request.match_info['id']
 
     # Add that to the database
-    async with vbu.Database() as db:
+    async with utils.Database() as db:
         await db.call(
             """
             UPDATE
@@ -347,7 +474,10 @@ async def delete_raffle(request: Request):
             raffle_id,
         )
 
-    return json_response({
+    utils.raffle_index.remove(UUID(raffle_id))
+    utils.raffle_scheduler.cancel(UUID(raffle_id))
+    utils.response_cache.invalidate("raffles")
+    return utils.json_response({
         "message": "Raffle deleted :3",
         "data": [],
     })
@@ -364,9 +494,9 @@ async def post_join_raffle(request: Request):
         data = await request.json()
     except:
         data = {}
-    session = await aiohttp_session.get_session(request)
-    if not session.get("user_info", {}).get("id"):
-        return json_response(
+    user = await utils.get_session_user(request)
+    if not user:
+        return utils.json_response(
             {
                 "message": "Not logged in.",
                 "data": [],
@@ -374,7 +504,7 @@ async def post_join_raffle(request: Request):
             status=401,
         )
     if data.get("id") is None:
-        return json_response(
+        return utils.json_response(
             {
                 "message": "Missing ID from payload.",
                 "data": [],
@@ -382,109 +512,192 @@ async def post_join_raffle(request: Request):
             status=400,
         )
 
-    # Add that to the database
-    async with vbu.Database() as db:
-
-        # Check the ID refers to a giveaway
-        giveaway_rows = await db.call(
+    # Check that they can enter, and add their entry if so; a paid entry
+    # holds their place while they're charged for it, and is taken away
+    # again below if they can't pay
+    async with utils.Database() as db:
+        entry_rows = await db.call(
             """
             SELECT
                 *
             FROM
-                raffles
-            WHERE
-                id = $1
-            AND
-                deleted IS FALSE
-            AND
-                end_time > TIMEZONE('UTC', NOW())
+                join_raffle($1, $2)
             """,
-            data['id'],
+            data['id'], user.id,
         )
-        if not giveaway_rows:
-            return json_response(
+        outcome = entry_rows[0]['outcome']
+        if outcome != "entered":
+            return utils.json_response(
                 {
-                    "message": "Giveaway does not exist.",
+                    "message": JOIN_RAFFLE_ERRORS[outcome],
                     "data": [],
                 },
                 status=403,
             )
-        raffle = utils.Raffle(data=giveaway_rows[0])
+        entry = entry_rows[0]
+
+        # Only one paid join per user runs at a time, from checking their
+        # points through to taking them, so that concurrent joins can't
+        # each spend the same points. This is a lease on their row rather
+        # than a lock so that no connection is kept while StreamElements
+        # is being called; it runs out by itself if this process dies
+        if entry['entry_price'] > 0:
+            error = None
+            profile = await user.fetch_profile(db)
+            if not profile or not profile.get('twitch_username'):
+                error = ("Couldn't find your Twitch account - please log in again.", 400)
+            else:
+                lease_rows = await db.call(
+                    """
+                    UPDATE
+                        users
+                    SET
+                        joining_until = TIMEZONE('UTC', NOW()) + MAKE_INTERVAL(secs => $2)
+                    WHERE
+                        id = $1
+                    AND
+                        (
+                            joining_until IS NULL
+                        OR
+                            joining_until <= TIMEZONE('UTC', NOW())
+                        )
+                    RETURNING
+                        id
+                    """,
+                    user.id, request.app['config'].get('raffles', {}).get('join_lease', 60),
+                )
+                if not lease_rows:
+                    error = ("You're already entering a raffle - please wait for that to finish.", 409)
+            if error:
+                await delete_raffle_entry(db, entry['id'])
+                return utils.json_response(
+                    {
+                        "message": error[0],
+                        "data": [],
+                    },
+                    status=error[1],
+                )
 
-        # Check their current entries
-        entered_rows = await db.call(
-            """
-            SELECT
-                *
-            FROM
-                raffle_entries
-            WHERE
-                user_id = $1
-            AND
-                raffle_id = $2
-            """,
-            session['user_info']['id'], data['id'],
-        )
-        if len(entered_rows) >= raffle.max_entries:
-            return json_response(
+    # See if any points are required to enter
+    if entry['entry_price'] > 0:
+        enough_points = False
+        try:
+            enough_points = await take_entry_points(
+                request,
+                profile['twitch_username'],
+                entry['entry_price'],
+            )
+        except utils.RateLimited:
+            return utils.json_response(
                 {
-                    "message": "Entered max amount of times already.",
+                    "message": "Too many people are entering right now - please try again in a moment.",
                     "data": [],
                 },
-                status=403,
+                status=429,
             )
-
-        # See if any points are required to enter
-        if raffle.entry_price > 0:
-
-            # Check they have the required points to enter the raffle
-            se = streamelements(request)
-            twitch_username = session['user_info']['twitch_username']
-            points = await se.get_user_points(user=twitch_username)
-            if points.points < (raffle.entry_price or 0):
-                return json_response(
-                    {
-                        "message": "Not enough points to spend.",
-                        "data": [],
-                    },
-                    status=403,
+        finally:
+
+            # Give back the entry if they couldn't pay for it, and let
+            # them join something else
+            async with utils.Database() as db:
+                if not enough_points:
+                    await delete_raffle_entry(db, entry['id'])
+                await db.call(
+                    """
+                    UPDATE
+                        users
+                    SET
+                        joining_until = NULL
+                    WHERE
+                        id = $1
+                    """,
+                    user.id,
                 )
-
-            # Remove number of points from their user
-            await se.modify_user_points(
-                user=twitch_username,
-                amount=-raffle.entry_price,
+        if not enough_points:
+            return utils.json_response(
+                {
+                    "message": "Not enough points to spend.",
+                    "data": [],
+                },
+                status=403,
             )
 
-        # Add their entry
-        entry_rows = await db.call(
+    # Tell anyone watching the raffle about the new entry
+    async with utils.Database() as db:
+        count_rows = await db.call(
             """
-            INSERT INTO
+            SELECT
+                COUNT(*) AS total,
+                COUNT(*) FILTER (WHERE user_id = $2) AS user_count
+            FROM
                 raffle_entries
-                (
-                    raffle_id,
-                    user_id
-                )
-            VALUES
-                (
-                    $1,
-                    $2
-                )
-            RETURNING
-                *
+            WHERE
+                raffle_id = $1
             """,
-            giveaway_rows[0]['id'], session['user_info']['id']
+            entry['raffle_id'], user.id,
         )
+    utils.entry_broadcaster.publish(
+        entry['raffle_id'],
+        count_rows[0]['total'],
+        user.id,
+        count_rows[0]['user_count'],
+    )
 
     # And done
-    return json_response({
+    return utils.json_response({
         "message": "Added entry",
         "data": [
-            json_encode(dict(entry_rows[0])),
+            {
+                "id": entry['id'],
+                "raffle_id": entry['raffle_id'],
+                "user_id": entry['user_id'],
+                "entry_time": entry['entry_time'],
+            },
         ],
     })
 
 
+async def delete_raffle_entry(db: utils.Database, entry_id: UUID) -> None:
+    await db.call(
+        """
+        DELETE FROM
+            raffle_entries
+        WHERE
+            id = $1
+        """,
+        entry_id,
+    )
+
+
+async def take_entry_points(request: Request, twitch_username: str, entry_price: int) -> bool:
+    """
+    Take the entry price of a raffle from a user's StreamElements points,
+    returning whether or not they had enough to spend.
+    """
+
+    # Check they have the required points to enter the raffle
+    se = await streamelements(request)
+    points = await se.get_user_points(user=twitch_username)
+    if points.points < entry_price:
+        return False
+
+    # Remove number of points from their user
+    new_amount = await se.modify_user_points(
+        user=twitch_username,
+        amount=-entry_price,
+    )
+
+    # Our view of their points can be out of date (eg if they spent some
+    # through another process), so give them back if they went negative
+    if new_amount is not None and new_amount < 0:
+        await se.modify_user_points(
+            user=twitch_username,
+            amount=entry_price,
+        )
+        return False
+    return True
+
+
 @routes.get("/api/raffle_entries")
 async def get_raffle_entries(request: Request):
     """
@@ -495,12 +708,12 @@ async def get_raffle_entries(request: Request):
     data = request.query or {}
 
     # Get the logged in user
-    session = await aiohttp_session.get_session(request)
-    if not session.get("user_info", {}).get("id"):
-        return json_response({})
+    user = await utils.get_session_user(request)
+    if not user:
+        return utils.json_response({})
 
     # Open DB to check entries
-    async with vbu.Database() as db:
+    async with utils.Database() as db:
         entered_rows = await db.call(
             """
             SELECT
@@ -514,56 +727,176 @@ async def get_raffle_entries(request: Request):
             GROUP BY
                 raffle_id
             """,
-            session['user_info']['id'], data.get("id", "")
+            user.id, data.get("id", "")
         )
 
     # And done
     if not entered_rows:
-        return json_response({})
-    return json_response(
-        dict(entered_rows[0]),
-        dumps=utils.HTTPEncoder().encode,
-    )
+        return utils.json_response({})
+    return utils.json_response(entered_rows[0])
 
 
-@routes.get("/api/raffle_winner")
-@utils.requires_permission(admin_panel=True)
-async def get_raffle_winner(request: Request):
+@routes.get("/api/active_raffle_entries")
+async def get_active_raffle_entries(request: Request):
     """
-    Get the raffle entries for the logged in user.
+    Get the logged in user's number of entries into every active raffle.
     """
 
-    # Get the json data from the request
-    data = request.query or {}
+    # Get the logged in user
+    user = await utils.get_session_user(request)
+    if not user:
+        return utils.json_response({})
 
     # Open DB to check entries
-    async with vbu.Database() as db:
+    async with utils.Database() as db:
         entered_rows = await db.call(
             """
             SELECT
-                twitch_username,
-                raffle_entries.user_id
+                raffle_entries.raffle_id, COUNT(raffle_entries.id)
             FROM
                 raffle_entries
-            LEFT JOIN
-                users
+            INNER JOIN
+                raffles
             ON
-                users.id = raffle_entries.user_id
+                raffles.id = raffle_entries.raffle_id
             WHERE
-                raffle_id = $1
-            ORDER BY
-                RANDOM()
-            LIMIT
-                1
+                raffle_entries.user_id = $1
+            AND
+                raffles.deleted IS FALSE
+            AND
+                raffles.end_time > TIMEZONE('UTC', NOW())
+            AND
+                raffles.start_time <= TIMEZONE('UTC', NOW())
+            GROUP BY
+                raffle_entries.raffle_id
             """,
-            data.get("id", "")
+            user.id,
         )
 
     # And done
-    if not entered_rows:
-        return json_response({})
-    return json_response(
+    return utils.json_response({
+        str(i['raffle_id']): i['count']
+        for i in entered_rows
+    })
+
+
+@routes.get("/api/raffle_entries/stream")
+async def stream_raffle_entries(request: Request):
+    """
+    Stream the total number of entries into each active raffle, and the
+    logged in user's own entries, as Server-Sent Events whenever they
+    change.
+    """
+
+    config = request.app['config']
+    raffle_config = config.get('raffles', {})
+    keepalive = raffle_config.get('stream_keepalive', 15)
+    write_timeout = raffle_config.get('stream_write_timeout', 10)
+    user = await utils.get_session_user(request)
+
+    # Start the stream
+    response = StreamResponse(
+        headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+    # Subscribe before the stream's opened so that a failure here is sent
+    # as an error rather than an empty stream
+    try:
+        subscription = await utils.entry_broadcaster.subscribe(config, user.id)
+    except asyncio.TimeoutError:
+        raise HTTPServiceUnavailable()
+    try:
+        await response.prepare(request)
+        while True:
+            changes = await subscription.get(keepalive)
+            if changes is None:
+                message = b": keepalive\n\n"
+            else:
+                totals, entries = changes
+                data = utils.json_dumps({
+                    "totals": {str(i): o for i, o in totals.items()},
+                    "entries": {str(i): o for i, o in entries.items()},
+                })
+                message = b"event: entries\ndata: " + data + b"\n\n"
+
+            # Drop any client that can't keep up rather than buffering for it
+            try:
+                await asyncio.wait_for(response.write(message), write_timeout)
+            except asyncio.TimeoutError:
+                break
+    except ConnectionResetError:
+        pass
+    finally:
+        utils.entry_broadcaster.unsubscribe(subscription)
+    return response
+
+
+@routes.get("/api/raffle_winner")
+@utils.requires_permission(admin_panel=True)
+async def get_raffle_winner(request: Request):
+    """
+    Draw winners for a raffle, weighted by how many times each user
+    entered.
+    """
+
+    # Get the json data from the request
+    data = request.query or {}
+    try:
+        count = int(data.get("count", 1))
+        seed = int(data["seed"]) if data.get("seed") else secrets.randbits(64)
+    except ValueError:
+        return utils.json_response(
+            {
+                "message": "Invalid count or seed.",
+                "data": [],
+            },
+            status=400,
+        )
+
+    # If the raffle was closed automatically, give the winners that were
+    # drawn then unless we've been asked for a new draw
+    async with utils.Database() as db:
+        if "count" not in data and "seed" not in data:
+            winners = await utils.get_raffle_winners(db, data.get("id", ""))
+            if winners:
+                return utils.json_response(
+                    {
+                        "message": winners[0],
+                        "data": winners,
+                        "seed": winners[0]['draw_seed'],
+                    }
+                )
+
+        # Count each user's entries
+        entered_rows = await utils.get_raffle_entrants(db, data.get("id", ""))
+
+    # Each entrant can only win once
+    if not 1 <= count <= len(entered_rows):
+        return utils.json_response(
+            {
+                "message": "Can't draw %s winner(s) from %s entrant(s)." % (count, len(entered_rows)),
+                "data": [],
+            },
+            status=400,
+        )
+
+    # Pick the winners
+    winners = utils.draw_winners(
+        entered_rows,
+        [i['count'] for i in entered_rows],
+        count,
+        seed=seed,
+    )
+
+    # And done
+    return utils.json_response(
         {
-            "message": json_encode(entered_rows[0])
+            "message": winners[0],
+            "data": winners,
+            "seed": str(seed),
         }
     )
@@ -1,17 +1,25 @@
-import aiohttp
-from aiohttp.web import Request, RouteTableDef
+from datetime import datetime as dt, timedelta
+
+from aiohttp.web import Request
 from aiohttp_jinja2 import template
-from discord.ext import vbu
 
 from cogs import utils
 
 
-routes = RouteTableDef()
+routes = utils.MiddlewareRouteTableDef(
+    utils.timing_middleware,
+    utils.raffle_scheduler_middleware,
+)
+
 
+# The leaderboard is only invalidated in the process that changed it, so
+# other processes read it again after this long
+LEADERBOARD_MAX_AGE = timedelta(seconds=30)
 
 
 @routes.get("/")
 @routes.get("/index")
+@utils.cache_response()
 @template("index.htm.j2")
 @utils.add_standard_args()
 async def index(_: Request):
@@ -19,6 +27,7 @@ async def index(_: Request):
 
 
 @routes.get("/leaderboard")
+@utils.cache_response("leaderboard")
 @template("leaderboard.htm.j2")
 @utils.add_standard_args()
 async def leaderboard(_: Request):
@@ -26,7 +35,20 @@ async def leaderboard(_: Request):
     Show all of the users that are to appear on the leaderboard page.
     """
 
-    async with vbu.Database() as db:
+    leaderboard_items = await utils.page_cache.get("leaderboard", load_leaderboard)
+    return {
+        "leaderboard_items": leaderboard_items,
+    }
+
+
+async def load_leaderboard():
+    """
+    Load the items for the leaderboard pages. These are cached until
+    they're changed by the leaderboard API, or for
+    ``LEADERBOARD_MAX_AGE`` at most.
+    """
+
+    async with utils.Database() as db:
         rows = await db.call(
             """
             SELECT
@@ -40,46 +62,53 @@ async def leaderboard(_: Request):
     leaderboard_items = [None] * 10
     for i in rows:
         leaderboard_items[i['index'] - 1] = dict(i)
-    return {
-        "leaderboard_items": leaderboard_items,
-    }
+    return leaderboard_items, dt.utcnow() + LEADERBOARD_MAX_AGE
 
 
 @routes.get("/giveaways")
+@utils.cache_response("raffles", expires_at=utils.raffle_index.valid_until)
 @template("giveaways.htm.j2")
 @utils.add_standard_args()
-async def giveaways(_: Request):
+async def giveaways(request: Request):
     """
     Grab all of the data for the raffles page, allowing users to
     enter each raffle or giveaway.
     """
 
-    async with vbu.Database() as db:
-        rows = await db.call(
-            """
-            SELECT
-                *
-            FROM
-                raffles
-            WHERE
-                deleted IS FALSE
-            AND
-                end_time > TIMEZONE('UTC', NOW())
-            AND
-                start_time <= TIMEZONE('UTC', NOW())
-            """,
-        )
-    raffles = [
-        utils.Raffle(data=i)
-        for i in rows
-    ]
+    user = await utils.get_session_user(request)
+    user_id = user.id
+    await utils.raffle_index.ensure_loaded(request.app['config'])
+    raffles = utils.raffle_index.active()
+    entered_rows = []
+    if user_id and raffles:
+        async with utils.Database() as db:
+            entered_rows = await db.call(
+                """
+                SELECT
+                    raffle_id, COUNT(id)
+                FROM
+                    raffle_entries
+                WHERE
+                    user_id = $1
+                AND
+                    raffle_id = ANY($2::UUID[])
+                GROUP BY
+                    raffle_id
+                """,
+                user_id, [i.id for i in raffles],
+            )
     return {
         "raffles": [i for i in raffles if not i.is_giveaway],
         "giveaways": [i for i in raffles if i.is_giveaway],
+        "entries": {
+            i['raffle_id']: i['count']
+            for i in entered_rows
+        },
     }
 
 
 @routes.get("/videos")
+@utils.cache_response("videos")
 @template("videos.htm.j2")
 @utils.add_standard_args()
 async def videos(request: Request):
@@ -87,57 +116,81 @@ async def videos(request: Request):
     Get all the videos and show em uwu.
     """
 
-    videos = await get_videos(request)
+    videos = await video_cache.get(request.app['config'])
     return {
         "videos": videos,
     }
 
 
-async def get_videos(request: Request):
+async def get_videos(config: dict) -> utils.VideoCollection:
     """
-    Get the last N videos of a given playlist ID
-    (specified in config, as well as a Google Cloud
-    API key).
+    Get the latest videos from the playlists specified in
+    config (as well as a Google Cloud API key).
     """
 
-    # Get the playlist IDs
-    api_key = request.app['config']['google']['api_key']
-    playlist_ids = request.app['config']['google']['valid_playlists']
-
-    # Get the videos from the channel
-    videos = []
-    url = "https://www.googleapis.com/youtube/v3/playlistItems"
-    # https://developers.google.com/youtube/v3/docs/playlistItems/list
-    headers = {
-        "User-Agent": request.app['config']['user_agent'],
-    }
-    params = {
-        "part": "snippet,contentDetails",
-        "maxResults": 6,
-        "playlistId": None,
-        "key": api_key,
-    }
-    if playlist_ids:
-        async with aiohttp.ClientSession(headers=headers) as session:
-            for pid in playlist_ids:
-                params["playlistId"] = pid
-                site = await session.get(url, params=params)
-                site.raise_for_status()
-                data = await site.json()
-                videos.extend(data['items'])
-
-    # Format those into a more helpful object
-    videos = [utils.Video(data=d) for d in videos]
+    google_config = config['google']
+    playlist_ids = google_config['valid_playlists']
+    if not playlist_ids:
+        return utils.VideoCollection()
+    videos = await playlist_fetcher.fetch(
+        utils.HTTPClient.get_session(config),
+        api_key=google_config['api_key'],
+        playlist_ids=playlist_ids,
+        headers={
+            "User-Agent": config['user_agent'],
+        },
+        max_results=google_config.get('max_results', 6),
+        max_pages=google_config.get('max_pages', 1),
+        concurrency=google_config.get('concurrency', 4),
+        limit=google_config.get('max_videos'),
+    )
+
+    # The video cache stores these as soon as we return
+    utils.response_cache.invalidate("videos")
     return videos
 
 
+playlist_fetcher = utils.PlaylistFetcher()
+video_cache = utils.VideoCache(get_videos)
+
+
 @routes.get("/contact")
+@utils.cache_response()
 @template("contact.htm.j2")
 @utils.add_standard_args()
 async def contact(_: Request):
     return {}
 
 
+@routes.get("/assets/{path:.+}")
+async def assets(request: Request):
+    """
+    Serve the static files built by ``python -m cogs.utils.build_assets``.
+    """
+
+    return await utils.serve_asset(request)
+
+
+@routes.get("/static/{path:.+}")
+async def static(request: Request):
+    """
+    Serve the unbuilt static files. This is matched before VBU's own
+    ``/static`` route, which doesn't send any caching headers.
+    """
+
+    return await utils.serve_static(request)
+
+
+@routes.get("/img")
+async def proxied_image(request: Request):
+    """
+    Serve a remote image (such as a raffle image or video thumbnail)
+    from the local image cache.
+    """
+
+    return await utils.serve_proxied_image(request)
+
+
 @routes.get("/admin")
 @routes.get("/admin/")
 @template("admin/index.htm.j2")
@@ -152,20 +205,7 @@ async def admin_index(_: Request):
 @utils.requires_permission(admin_panel=True)
 @utils.add_standard_args()
 async def admin_leaderboard(_: Request):
-    async with vbu.Database() as db:
-        rows = await db.call(
-            """
-            SELECT
-                *
-            FROM
-                leaderboards
-            ORDER BY
-                index DESC
-            """
-        )
-    leaderboard_items = [None] * 10
-    for i in rows:
-        leaderboard_items[i['index'] - 1] = dict(i)
+    leaderboard_items = await utils.page_cache.get("leaderboard", load_leaderboard)
     return {
         "leaderboard_items": leaderboard_items,
     }
@@ -175,8 +215,19 @@ async def admin_leaderboard(_: Request):
 @template("admin/giveaways.htm.j2")
 @utils.requires_permission(admin_panel=True)
 @utils.add_standard_args()
-async def admin_giveaways(_: Request):
-    async with vbu.Database() as db:
+async def admin_giveaways(request: Request):
+    """
+    List the raffles that haven't been deleted, newest first, a page at a
+    time. This reads the database rather than the raffle index, since the
+    index only keeps recent raffles.
+    """
+
+    page_size = request.app['config'].get('raffles', {}).get('admin_page_size', 50)
+    try:
+        page = max(int(request.query.get("page", 0)), 0)
+    except ValueError:
+        page = 0
+    async with utils.Database() as db:
         rows = await db.call(
             """
             SELECT
@@ -184,16 +235,19 @@ async def admin_giveaways(_: Request):
             FROM
                 raffles
             WHERE
-                deleted = FALSE
+                deleted IS FALSE
             ORDER BY
-                start_time
-                DESC
+                start_time DESC
+            LIMIT
+                $1
+            OFFSET
+                $2
             """,
+            page_size + 1, page * page_size,
         )
-    raffles = [
-        utils.Raffle(data=i)
-        for i in rows
-    ]
     return {
-        "raffles": raffles,
+        "raffles": [utils.Raffle(data=i) for i in rows[:page_size]],
+        "page": page,
+        "has_next_page": len(rows) > page_size,
+        "now": dt.utcnow(),
     }